@@ -1,22 +1,32 @@
 from __future__ import annotations
 
 import asyncio
-import json
+from collections import OrderedDict, deque
 import os
 import random
 import re
-from datetime import datetime, timezone
+import threading
+import time
+import traceback
+from functools import lru_cache
 from typing import Any
 
 import aiohttp
+import orjson
 from livekit import rtc
 from livekit.agents import llm
 from livekit.agents.voice import Agent, AgentSession, room_io
 from livekit.plugins import deepgram, openai as lk_openai, silero
 
-from .db import get_course_topic_names, get_student_focus_context, get_topic_vocabulary, upsert_transcript
-from .prompts import build_system_prompt
-from .rag import retrieve_chunks
+from .db import (
+    append_transcript_items_async,
+    get_course_topic_names,
+    get_student_focus_context,
+    get_topic_vocabulary,
+    upsert_transcript_async,
+)
+from .prompts import build_system_prompt_split
+from .rag import retrieval_scheduler
 
 LIVEKIT_URL = os.environ.get("LIVEKIT_URL", "ws://livekit:7880")
 AGENT_OPENAI_MODEL = os.environ.get("AGENT_OPENAI_MODEL", "gpt-4o")
@@ -32,6 +42,24 @@ DEEPGRAM_API_URL = os.environ.get("DEEPGRAM_API_URL", "https://api.eu.deepgram.c
 OPENAI_BASE_URL: str | None = os.environ.get("OPENAI_BASE_URL") or None
 
 PACE_TAG_RE = re.compile(r"\s*<PACE:(short|long)>\s*$", re.IGNORECASE)
+# Speculative retrieval on interim transcripts: wait for the partial to settle, keep a few
+# results, and only reuse one whose text covers most of the final turn.
+SPECULATIVE_DEBOUNCE_S = 0.25
+SPECULATIVE_MAX_ENTRIES = 8
+SPECULATIVE_MIN_COVERAGE = 0.8
+# Acknowledgements and filler that never need fresh retrieval; such turns reuse the last references.
+TRIVIAL_TURN_WORDS = frozenset(
+    {
+        "yes", "yeah", "yep", "yup", "no", "nope", "ok", "okay", "right", "sure", "fine", "cool",
+        "thanks", "thank", "you", "cheers", "hmm", "um", "uh", "er", "mm", "ah", "oh", "hi", "hello",
+        "hey", "got", "it", "i", "see", "sorry", "what", "pardon", "can", "could", "please",
+        "repeat", "that", "again", "say", "go", "on", "continue", "makes", "sense", "alright",
+    }
+)
+TRANSCRIPT_SPEAKERS = {"user": "Student", "assistant": "TutorBot"}
+# Live transcript items waiting to be published; the oldest are dropped if the data channel falls behind.
+PUBLISH_QUEUE_MAX = 256
+PUBLISH_BATCH_MAX = 16
 SILENCE_NUDGE_MESSAGES = [
     "Take your time — it's a tricky one.",
     "Feel free to think out loud, even if you're not sure.",
@@ -39,6 +67,43 @@ SILENCE_NUDGE_MESSAGES = [
     "No rush — what's coming to mind so far?",
 ]
 
+# Shared by every session in the process so Deepgram connections and TLS state are reused.
+_http_session: aiohttp.ClientSession | None = None
+
+
+def _get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0,
+                ttl_dns_cache=600,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True,
+            )
+        )
+    return _http_session
+
+
+async def close_http_session() -> None:
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
+
+_vad: Any = None
+_vad_lock = threading.Lock()
+
+
+def _get_vad() -> Any:
+    """Load the Silero VAD weights once per process and share them across sessions."""
+    global _vad
+    with _vad_lock:
+        if _vad is None:
+            _vad = silero.VAD.load()
+        return _vad
+
 
 def _deepgram_url(path: str, *, websocket: bool = False) -> str:
     """Build a full Deepgram endpoint URL from the configured base."""
@@ -48,6 +113,7 @@ def _deepgram_url(path: str, *, websocket: bool = False) -> str:
     return f"{base}{path}"
 
 
+@lru_cache(maxsize=32)
 def _resolve_stt_model(model: str) -> str:
     normalized = model.strip().lower()
     if normalized == "flux":
@@ -55,6 +121,7 @@ def _resolve_stt_model(model: str) -> str:
     return model
 
 
+@lru_cache(maxsize=32)
 def _resolve_tts_model(model: str) -> str:
     normalized = model.strip().lower()
     if normalized in {"aura-2", "aura-2-draco", "draco"}:
@@ -117,25 +184,29 @@ class TutorAgent(Agent):
         repeat_flags: list[str],
         recommended_focus: list[str],
     ) -> None:
+        # Only the retrieved references change between turns.
+        prompt_prefix, prompt_suffix = build_system_prompt_split(
+            course_name,
+            topic_name,
+            tutor_name=tutor_name,
+            personality_prompt=personality_prompt,
+            repeat_flags=repeat_flags,
+            recommended_focus=recommended_focus,
+        )
         super().__init__(
-            instructions=build_system_prompt(
-                course_name,
-                topic_name,
-                "Session start. No retrieved context yet; begin with a dynamic greeting.",
-                tutor_name=tutor_name,
-                personality_prompt=personality_prompt,
-                repeat_flags=repeat_flags,
-                recommended_focus=recommended_focus,
+            instructions=(
+                f"{prompt_prefix}"
+                "Session start. No retrieved context yet; begin with a dynamic greeting."
+                f"{prompt_suffix}"
             )
         )
         self._course_id = course_id
         self._topic_id = topic_id
-        self._course_name = course_name
-        self._topic_name = topic_name
-        self._tutor_name = tutor_name
-        self._personality_prompt = personality_prompt
-        self._repeat_flags = repeat_flags
-        self._recommended_focus = recommended_focus
+        self._prompt_prefix = prompt_prefix
+        self._prompt_suffix = prompt_suffix
+        self._last_references: str | None = None
+        self._speculative: OrderedDict[str, asyncio.Task[list[dict[str, Any]]]] = OrderedDict()
+        self._speculative_handle: asyncio.TimerHandle | None = None
         self._next_nudge_s = SILENCE_NUDGE_SHORT_S
 
     def consume_next_nudge_s(self) -> float:
@@ -149,26 +220,89 @@ class TutorAgent(Agent):
             return "No strong matches found. Ask clarifying questions."
         return "\n\n".join([f"[{c['doc_title']}:{c['chunk_id']}]\n{c['content']}" for c in chunks])
 
-    async def on_user_turn_completed(self, turn_ctx: llm.ChatContext, new_message: llm.ChatMessage) -> None:
-        latest_user = new_message.text_content or ""
-        chunks = retrieve_chunks(latest_user, self._course_id, self._topic_id)
-        references = self._format_references(chunks)
-        system_prompt = build_system_prompt(
-            self._course_name,
-            self._topic_name,
-            references,
-            tutor_name=self._tutor_name,
-            personality_prompt=self._personality_prompt,
-            repeat_flags=self._repeat_flags,
-            recommended_focus=self._recommended_focus,
+    @staticmethod
+    def _is_trivial_turn(text: str) -> bool:
+        words = [word.strip(".,!?;:'\"").lower() for word in text.split()]
+        return all(not word or word in TRIVIAL_TURN_WORDS for word in words)
+
+    @staticmethod
+    def _normalize_partial(text: str) -> str:
+        return " ".join(text.lower().split()).rstrip(".,!?;:")
+
+    def prefetch_references(self, partial: str) -> None:
+        """Start retrieval for an interim transcript once it stops changing for a moment."""
+        normalized = self._normalize_partial(partial)
+        if self._speculative_handle is not None:
+            self._speculative_handle.cancel()
+            self._speculative_handle = None
+        if not normalized or normalized in self._speculative or self._is_trivial_turn(normalized):
+            return
+        loop = asyncio.get_running_loop()
+        self._speculative_handle = loop.call_later(SPECULATIVE_DEBOUNCE_S, self._start_speculation, normalized)
+
+    def _start_speculation(self, normalized: str) -> None:
+        self._speculative_handle = None
+        # A newer partial supersedes any speculation still in flight.
+        for key, task in list(self._speculative.items()):
+            if not task.done():
+                task.cancel()
+                del self._speculative[key]
+        self._speculative[normalized] = asyncio.create_task(
+            retrieval_scheduler.submit(normalized, self._course_id, self._topic_id)
         )
+        while len(self._speculative) > SPECULATIVE_MAX_ENTRIES:
+            _, evicted = self._speculative.popitem(last=False)
+            evicted.cancel()
+
+    def _discard_speculative(self) -> None:
+        if self._speculative_handle is not None:
+            self._speculative_handle.cancel()
+            self._speculative_handle = None
+        for task in self._speculative.values():
+            task.cancel()
+        self._speculative.clear()
+
+    async def _take_speculative(self, text: str) -> list[dict[str, Any]] | None:
+        """Return chunks prefetched for the longest interim prefix of ``text``, clearing the rest."""
+        normalized = self._normalize_partial(text)
+        best_key: str | None = None
+        for key in self._speculative:
+            if not normalized.startswith(key) or len(key) < SPECULATIVE_MIN_COVERAGE * len(normalized):
+                continue
+            if best_key is None or len(key) > len(best_key):
+                best_key = key
+
+        best = self._speculative.pop(best_key) if best_key is not None else None
+        self._discard_speculative()
+
+        if best is None or best.cancelled():
+            return None
+        try:
+            return await best
+        except Exception:
+            return None
 
-        filtered_items = [
-            item
-            for item in turn_ctx.items
-            if not (isinstance(item, llm.ChatMessage) and item.role in ("system", "developer"))
-        ]
-        turn_ctx.items = [llm.ChatMessage(role="system", content=[system_prompt])] + filtered_items
+    async def on_user_turn_completed(self, turn_ctx: llm.ChatContext, new_message: llm.ChatMessage) -> None:
+        latest_user = new_message.text_content or ""
+        if self._is_trivial_turn(latest_user):
+            self._discard_speculative()
+            references = self._last_references or self._format_references([])
+        else:
+            chunks = await self._take_speculative(latest_user)
+            if chunks is None:
+                chunks = await retrieval_scheduler.submit(latest_user, self._course_id, self._topic_id)
+            references = self._format_references(chunks)
+            self._last_references = references
+        system_prompt = f"{self._prompt_prefix}{references}{self._prompt_suffix}"
+
+        # The system prompt only ever lives at index 0, so swap it in place rather
+        # than rebuilding the whole history each turn.
+        items = turn_ctx.items
+        system_message = llm.ChatMessage(role="system", content=[system_prompt])
+        if items and isinstance(items[0], llm.ChatMessage) and items[0].role in ("system", "developer"):
+            items[0] = system_message
+        else:
+            items.insert(0, system_message)
 
     async def llm_node(
         self,
@@ -214,8 +348,14 @@ class TutorAgent(Agent):
         return _drain_async_stream()
 
 
+def _iso_timestamp(ts: float) -> str:
+    """Format a UTC epoch timestamp like ``datetime.isoformat`` without building a datetime."""
+    seconds, micros = divmod(round(ts * 1_000_000), 1_000_000)
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{micros:06d}+00:00"
+
+
 def _iso_now() -> str:
-    return datetime.now(timezone.utc).isoformat()
+    return _iso_timestamp(time.time())
 
 
 async def run_agent_session(
@@ -240,10 +380,20 @@ async def run_agent_session(
 ) -> None:
     room = rtc.Room()
     transcript_items: list[dict[str, Any]] = []
-    http_session = aiohttp.ClientSession()
-    persist_lock = asyncio.Lock()
+    # Items waiting for the single background writer; the event wakes it up.
+    persist_queue: deque[dict[str, Any]] = deque()
+    persist_event = asyncio.Event()
+    persist_closing = False
+    publish_queue: deque[dict[str, Any]] = deque(maxlen=PUBLISH_QUEUE_MAX)
+    publish_event = asyncio.Event()
+    publish_closing = False
     session: AgentSession | None = None
-    _watchdog_task: asyncio.Task[None] | None = None
+    # Pending silence nudge: armed when the tutor speaks, cancelled when anyone speaks again.
+    _nudge_handle: asyncio.TimerHandle | None = None
+    # The loop only holds tasks weakly, so the running nudge is kept here until it finishes.
+    _nudge_task: asyncio.Task[None] | None = None
+    _persist_task: asyncio.Task[None] | None = None
+    _publish_task: asyncio.Task[None] | None = None
 
     try:
         loop = asyncio.get_running_loop()
@@ -251,38 +401,61 @@ async def run_agent_session(
         _openai_model = agent_openai_model or AGENT_OPENAI_MODEL
         _stt_model = deepgram_stt_model or DEEPGRAM_STT_MODEL
         _tts_model = tutor_voice_model or deepgram_tts_model or DEEPGRAM_TTS_MODEL
+        http_session = _get_http_session()
         _silence_nudge_short = silence_nudge_after_s if silence_nudge_after_s is not None else SILENCE_NUDGE_SHORT_S
         _tutor_name = (tutor_name or "TutorBot").strip() or "TutorBot"
         _personality_prompt = (personality_prompt or "Be warm, concise, and Socratic. Always make the student feel capable.").strip() or "Be warm, concise, and Socratic. Always make the student feel capable."
-        # Tracks when agent last finished speaking and when student last replied,
-        # used by the silence watchdog to prompt unresponsive students.
-        _silence_state: dict[str, float | None] = {
-            "last_agent": None,
-            "last_student": 0.0,
-            "current_nudge_s": _silence_nudge_short,
-        }
+
+        participant_fut: asyncio.Future[rtc.RemoteParticipant] = loop.create_future()
+
+        @room.on("participant_connected")
+        def _on_participant_connected(remote: rtc.RemoteParticipant) -> None:
+            if not participant_fut.done():
+                participant_fut.set_result(remote)
 
         await room.connect(LIVEKIT_URL, token)
 
-        participant: rtc.RemoteParticipant | None = None
-        while participant is None:
-            remotes = list(room.remote_participants.values())
-            if remotes:
-                participant = remotes[0]
-                break
-            await asyncio.sleep(0.2)
+        # The student may already be in the room before we joined.
+        participant = next(iter(room.remote_participants.values()), None)
+        if participant is None:
+            participant = await participant_fut
         student_identity = participant.identity
 
-        async def _persist_transcript_snapshot() -> None:
-            try:
-                async with persist_lock:
-                    snapshot = list(transcript_items)
-                    await asyncio.to_thread(upsert_transcript, session_id, snapshot)
-            except Exception:
-                return
+        async def _persist_writer() -> None:
+            while True:
+                await persist_event.wait()
+                persist_event.clear()
+                pending: list[dict[str, Any]] = []
+                while persist_queue:
+                    pending.append(persist_queue.popleft())
+                if pending:
+                    try:
+                        await append_transcript_items_async(session_id, pending)
+                    except Exception:
+                        pass
+                if persist_closing:
+                    return
+
+        _persist_task = asyncio.create_task(_persist_writer())
+
+        async def _transcript_publisher() -> None:
+            while True:
+                await publish_event.wait()
+                publish_event.clear()
+                while publish_queue:
+                    batch = [publish_queue.popleft() for _ in range(min(PUBLISH_BATCH_MAX, len(publish_queue)))]
+                    try:
+                        payload = orjson.dumps({"items": batch})
+                        await room.local_participant.publish_data(payload, reliable=True)
+                    except Exception:
+                        pass
+                if publish_closing:
+                    return
+
+        _publish_task = asyncio.create_task(_transcript_publisher())
 
         course_name, topic_name = get_course_topic_names(course_id, topic_id)
-        topic_vocabulary = await asyncio.to_thread(get_topic_vocabulary, course_id, topic_id)
+        topic_vocabulary = await asyncio.to_thread(get_topic_vocabulary, topic_id)
         db_repeat_flags: list[str] = []
         db_recommended_focus: list[str] = []
 
@@ -315,7 +488,7 @@ async def run_agent_session(
 
         session = AgentSession(
             stt=_build_stt(http_session, _stt_model, topic_vocabulary),
-            vad=silero.VAD.load(),
+            vad=_get_vad(),
             llm=lk_openai.LLM(**_llm_kwargs),
             tts=deepgram.TTS(
                 model=_resolve_tts_model(_tts_model),
@@ -327,60 +500,54 @@ async def run_agent_session(
 
         close_fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
 
-        async def _publish_transcript_item(item: dict[str, Any]) -> None:
+        async def _send_silence_nudge() -> None:
             try:
-                payload = json.dumps(item).encode("utf-8")
-                await room.local_participant.publish_data(payload, reliable=True)
-            except Exception:
-                return
+                await session.say(  # type: ignore[union-attr]
+                    random.choice(SILENCE_NUDGE_MESSAGES),
+                    allow_interruptions=True,
+                )
+            except Exception as exc:
+                traceback.print_exception(exc)
+
+        def _start_silence_nudge() -> None:
+            nonlocal _nudge_task
+            _nudge_task = asyncio.create_task(_send_silence_nudge())
+
+        @session.on("user_input_transcribed")
+        def _on_user_input_transcribed(event: Any) -> None:
+            tutor_agent.prefetch_references(event.transcript)
 
         @session.on("conversation_item_added")
         def _on_conversation_item(event: Any) -> None:
+            nonlocal _nudge_handle
             message = event.item
             if not isinstance(message, llm.ChatMessage):
                 return
 
+            # Check the role first so system/developer items never build their text.
+            speaker = TRANSCRIPT_SPEAKERS.get(message.role)
+            if speaker is None:
+                return
+
             text = message.text_content
             if not text:
                 return
 
-            speaker: str | None = None
-            if message.role == "user":
-                speaker = "Student"
-                _silence_state["last_student"] = loop.time()
-            elif message.role == "assistant":
-                speaker = "TutorBot"
-                _silence_state["last_agent"] = loop.time()
-                _silence_state["current_nudge_s"] = tutor_agent.consume_next_nudge_s()
+            if _nudge_handle is not None:
+                _nudge_handle.cancel()
+                _nudge_handle = None
+            if speaker == "TutorBot":
+                # Nudge the student if they haven't replied within the adaptive silence threshold.
+                nudge_s = tutor_agent.consume_next_nudge_s() or _silence_nudge_short
+                _nudge_handle = loop.call_later(nudge_s, _start_silence_nudge)
 
-            if speaker is None:
-                return
-
-            timestamp = datetime.fromtimestamp(message.created_at, tz=timezone.utc).isoformat()
+            timestamp = _iso_timestamp(message.created_at)
             item = {"speaker": speaker, "text": text, "timestamp": timestamp}
             transcript_items.append(item)
-            asyncio.create_task(_publish_transcript_item(item))
-            asyncio.create_task(_persist_transcript_snapshot())
-
-        async def _silence_watchdog() -> None:
-            """Nudge the student if they haven't replied within the current adaptive silence threshold."""
-            while True:
-                await asyncio.sleep(0.5)
-                last_agent = _silence_state["last_agent"]
-                if last_agent is None:
-                    continue
-                elapsed = loop.time() - last_agent
-                last_student = _silence_state["last_student"] or 0.0
-                nudge_s = float(_silence_state["current_nudge_s"] or _silence_nudge_short)
-                if elapsed >= nudge_s and last_agent > last_student:
-                    _silence_state["last_agent"] = None  # prevent repeated nudges
-                    try:
-                        await session.say(  # type: ignore[union-attr]
-                            random.choice(SILENCE_NUDGE_MESSAGES),
-                            allow_interruptions=True,
-                        )
-                    except Exception:
-                        pass
+            publish_queue.append(item)
+            publish_event.set()
+            persist_queue.append(item)
+            persist_event.set()
 
         @session.on("close")
         def _on_session_close(_: Any) -> None:
@@ -396,8 +563,6 @@ async def run_agent_session(
             ),
         )
 
-        _watchdog_task = asyncio.create_task(_silence_watchdog())
-
         session.generate_reply(
             instructions=(
                 "Begin the session now with your dynamic greeting. Keep it under 40 words. "
@@ -408,9 +573,23 @@ async def run_agent_session(
 
         await close_fut
     finally:
-        if _watchdog_task is not None:
-            _watchdog_task.cancel()
-        await asyncio.to_thread(upsert_transcript, session_id, list(transcript_items))
+        if _nudge_handle is not None:
+            _nudge_handle.cancel()
+        if _nudge_task is not None:
+            _nudge_task.cancel()
+        # Both background writers drain what is still queued (typically the closing turn) before
+        # the room disconnects; the persist writer must also finish before the final snapshot.
+        if _publish_task is not None:
+            publish_closing = True
+            publish_event.set()
+        if _persist_task is not None:
+            persist_closing = True
+            persist_event.set()
+        await asyncio.gather(
+            *(task for task in (_publish_task, _persist_task) if task is not None),
+            return_exceptions=True,
+        )
+        await upsert_transcript_async(session_id, list(transcript_items))
         if session is not None:
             try:
                 await session.aclose()
@@ -418,4 +597,3 @@ async def run_agent_session(
                 pass
         if room.connection_state == rtc.ConnectionState.CONN_CONNECTED:
             await room.disconnect()
-        await http_session.close()
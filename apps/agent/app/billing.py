@@ -1,24 +1,31 @@
 from __future__ import annotations
 
+import asyncio
+import base64
 import csv
-import datetime
+import hashlib
 import json
 import os
 import random
+import re
 import string
-from functools import lru_cache
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 from dataclasses import dataclass
-from decimal import Decimal
 from typing import Any
-from urllib import error as urllib_error
-from urllib import request as urllib_request
-
+import httpx
+import psycopg
 import stripe
+from psycopg.rows import dict_row
 from fastapi import APIRouter, Header, HTTPException, Request
 from pydantic import BaseModel
 
-from .db import get_conn
+from .db import get_async_conn, get_conn
 
 router = APIRouter(prefix="/billing", tags=["billing"])
 
@@ -28,6 +35,24 @@ STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
 AGENT_INTERNAL_API_KEY = os.environ.get("AGENT_INTERNAL_API_KEY", "")
 SCHOOL_DOMAINS_CSV_PATH = os.environ.get("SCHOOL_DOMAINS_CSV_PATH", "")
+# Verified bearer tokens are remembered briefly so repeat calls skip the Supabase round trip.
+AUTH_CACHE_TTL_S = float(os.environ.get("AUTH_CACHE_TTL_S", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "4096"))
+# Stripe price IDs rarely change, so /plans and checkout only re-resolve them this often.
+PLAN_PRICE_SYNC_TTL_S = float(os.environ.get("PLAN_PRICE_SYNC_TTL_S", "300"))
+# How long the school_email_domains table is held in memory before it is re-read.
+SCHOOL_DOMAINS_DB_TTL_S = float(os.environ.get("SCHOOL_DOMAINS_DB_TTL_S", "600"))
+# Subscriptions fetched for checkout webhooks are reused this long unless a
+# customer.subscription.* event for the same id arrives first.
+STRIPE_SUBSCRIPTION_CACHE_TTL_S = float(os.environ.get("STRIPE_SUBSCRIPTION_CACHE_TTL_S", "300"))
+_STRIPE_SUBSCRIPTION_CACHE_MAX_ENTRIES = 1024
+# Stripe event payloads are well under this; anything larger is rejected before verification.
+_WEBHOOK_MAX_BYTES = 1024 * 1024
+# A failed event is retried in-process with exponential backoff, starting here and capped
+# below; after the last attempt it stays pending until Stripe redelivers it or a restart.
+STRIPE_EVENT_RETRY_BASE_S = float(os.environ.get("STRIPE_EVENT_RETRY_BASE_S", "5"))
+_STRIPE_EVENT_RETRY_MAX_S = 300.0
+_STRIPE_EVENT_MAX_ATTEMPTS = 8
 
 PLAN_PRODUCT_ENV_MAP: dict[str, str] = {
     "Standard Monthly": "STRIPE_PRODUCT_STANDARD_MONTHLY",
@@ -39,6 +64,14 @@ PLAN_PRODUCT_ENV_MAP: dict[str, str] = {
     "Credit Pack 10h": "STRIPE_PRODUCT_CREDIT_10H",
 }
 
+# Product IDs are read from the environment once at import.
+PLAN_PRODUCT_IDS: dict[str, str] = {
+    plan_name: (os.environ.get(env_name, "") or "").strip() for plan_name, env_name in PLAN_PRODUCT_ENV_MAP.items()
+}
+_PLAN_PRODUCT_CONFIGURED: dict[str, dict[str, bool]] = {
+    plan_name: {"productEnvConfigured": bool(product_id)} for plan_name, product_id in PLAN_PRODUCT_IDS.items()
+}
+
 PLAN_INTERVAL_MAP: dict[str, str | None] = {
     "Standard Monthly": "month",
     "School Monthly": "month",
@@ -52,6 +85,27 @@ PLAN_INTERVAL_MAP: dict[str, str | None] = {
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
+# One keep-alive client for Supabase auth so requests reuse pooled TLS connections.
+# Created lazily so it binds to the server's event loop.
+_supabase_http: httpx.AsyncClient | None = None
+
+
+def _get_supabase_http() -> httpx.AsyncClient:
+    global _supabase_http
+    if _supabase_http is None or _supabase_http.is_closed:
+        _supabase_http = httpx.AsyncClient(
+            timeout=20,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+    return _supabase_http
+
+
+async def close_supabase_http() -> None:
+    global _supabase_http
+    if _supabase_http is not None:
+        await _supabase_http.aclose()
+        _supabase_http = None
+
 
 def _resolve_school_domains_csv_path() -> Path:
     if SCHOOL_DOMAINS_CSV_PATH.strip():
@@ -65,23 +119,35 @@ def _load_school_domains_from_csv() -> frozenset[str]:
     if not csv_path.exists() or not csv_path.is_file():
         return frozenset()
 
-    domains: set[str] = set()
     with csv_path.open("r", encoding="utf-8", newline="") as handle:
-        reader = csv.DictReader(handle)
-        for row in reader:
-            domain = str((row or {}).get("domain") or "").strip().lower().lstrip("@")
-            if domain:
-                domains.add(domain)
+        reader = csv.reader(handle)
+        header = next(reader, None)
+        if not header or "domain" not in header:
+            return frozenset()
+        domain_idx = header.index("domain")
+        domains = {
+            domain
+            for row in reader
+            if len(row) > domain_idx and (domain := row[domain_idx].strip().lower().lstrip("@"))
+        }
     return frozenset(domains)
 
 
+@lru_cache(maxsize=4096)
 def _domain_in_school_csv(domain: str) -> bool:
     school_domains = _load_school_domains_from_csv()
     if not school_domains:
         return False
-    if domain in school_domains:
-        return True
-    return any(domain.endswith(f".{allowed}") for allowed in school_domains)
+    # Walk the domain's own suffixes ("a.cam.ac.uk", "cam.ac.uk", ...) so each check
+    # is a set lookup rather than a scan over every listed school domain.
+    suffix = domain
+    while True:
+        if suffix in school_domains:
+            return True
+        dot = suffix.find(".")
+        if dot < 0:
+            return False
+        suffix = suffix[dot + 1 :]
 
 
 class CheckoutSessionRequest(BaseModel):
@@ -113,31 +179,77 @@ class QuotaResult:
     billing_profile_id: str | None = None
 
 
-def _get_user_id_from_bearer(authorization: str | None) -> str:
+# sha256(token) -> (expires_at, user_id); raw tokens are never kept.
+_auth_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_auth_cache_lock = threading.Lock()
+
+
+def _auth_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _cached_user_id(token_key: str) -> str | None:
+    now = time.monotonic()
+    with _auth_cache_lock:
+        entry = _auth_cache.get(token_key)
+        if entry is None:
+            return None
+        expires_at, user_id = entry
+        if expires_at <= now:
+            del _auth_cache[token_key]
+            return None
+        _auth_cache.move_to_end(token_key)
+        return user_id
+
+
+def _token_ttl_s(token: str) -> float:
+    # The JWT's own exp (read unverified; Supabase already validated the token) caps how
+    # long the user id may be served from cache.
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return min(AUTH_CACHE_TTL_S, float(claims["exp"]) - time.time())
+    except (IndexError, KeyError, TypeError, ValueError):
+        return AUTH_CACHE_TTL_S
+
+
+def _remember_user_id(token_key: str, user_id: str, ttl_s: float) -> None:
+    if ttl_s <= 0:
+        return
+    with _auth_cache_lock:
+        _auth_cache[token_key] = (time.monotonic() + ttl_s, user_id)
+        _auth_cache.move_to_end(token_key)
+        while len(_auth_cache) > AUTH_CACHE_MAX_ENTRIES:
+            _auth_cache.popitem(last=False)
+
+
+async def get_user_id_from_bearer(authorization: str | None) -> str:
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
     if not SUPABASE_URL or not SUPABASE_PUBLISHABLE_KEY:
         raise HTTPException(status_code=500, detail="Supabase auth config missing")
 
     token = authorization.replace("Bearer ", "", 1).strip()
-    req = urllib_request.Request(
+    token_key = _auth_cache_key(token)
+    cached = _cached_user_id(token_key)
+    if cached is not None:
+        return cached
+
+    response = await _get_supabase_http().get(
         f"{SUPABASE_URL}/auth/v1/user",
-        method="GET",
         headers={
             "apikey": SUPABASE_PUBLISHABLE_KEY,
             "Authorization": f"Bearer {token}",
         },
     )
+    if response.status_code >= 400:
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
-    try:
-        with urllib_request.urlopen(req, timeout=20) as response:
-            payload = json.loads(response.read().decode("utf-8"))
-            user_id = payload.get("id")
-            if not user_id:
-                raise HTTPException(status_code=401, detail="Unauthorized")
-            return str(user_id)
-    except urllib_error.HTTPError as exc:
-        raise HTTPException(status_code=401, detail="Unauthorized") from exc
+    user_id = response.json().get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    _remember_user_id(token_key, str(user_id), _token_ttl_s(token))
+    return str(user_id)
 
 
 def _require_stripe() -> None:
@@ -152,7 +264,17 @@ def _require_internal_api_key(x_internal_api_key: str | None) -> None:
         raise HTTPException(status_code=401, detail="Invalid internal API key")
 
 
-def _sync_plan_price_ids_from_env() -> list[str]:
+_plan_price_synced_at: float | None = None
+
+
+def _sync_plan_price_ids_from_env(*, force: bool = False) -> list[str]:
+    global _plan_price_synced_at
+    now = time.monotonic()
+    if not force and _plan_price_synced_at is not None and now - _plan_price_synced_at < PLAN_PRICE_SYNC_TTL_S:
+        return []
+    # Plans whose Stripe lookup raised; the sync is only marked fresh when this stays empty.
+    failed_plans: list[str] = []
+
     def _price_matches_interval(price_obj: dict[str, Any], interval: str | None) -> bool:
         recurring = price_obj.get("recurring")
         if interval is None:
@@ -162,8 +284,7 @@ def _sync_plan_price_ids_from_env() -> list[str]:
         return str(recurring.get("interval") or "") == interval
 
     def _resolve_price_id_for_plan(plan_name: str) -> str | None:
-        product_env = PLAN_PRODUCT_ENV_MAP.get(plan_name, "")
-        product_id = (os.environ.get(product_env, "") or "").strip() if product_env else ""
+        product_id = PLAN_PRODUCT_IDS.get(plan_name, "")
         if not product_id or not STRIPE_SECRET_KEY:
             return None
 
@@ -193,15 +314,23 @@ def _sync_plan_price_ids_from_env() -> list[str]:
                 if isinstance(resolved, dict) and _price_matches_interval(resolved, target_interval):
                     chosen = resolved.get("id")
                     return str(chosen) if chosen else None
-        except Exception:
+        except Exception as exc:
+            traceback.print_exception(exc)
+            failed_plans.append(plan_name)
             return None
 
         return None
 
+    # Each plan needs its own Stripe round trips; resolve them concurrently before touching the DB.
+    configured_plans = [plan_name for plan_name, product_id in PLAN_PRODUCT_IDS.items() if product_id]
+    if not configured_plans or not STRIPE_SECRET_KEY:
+        return []
+    with ThreadPoolExecutor(max_workers=len(configured_plans)) as executor:
+        resolved_price_ids = dict(zip(configured_plans, executor.map(_resolve_price_id_for_plan, configured_plans)))
+
     updated_plan_names: list[str] = []
     with get_conn() as conn, conn.cursor() as cur:
-        for plan_name in PLAN_PRODUCT_ENV_MAP:
-            resolved_price_id = _resolve_price_id_for_plan(plan_name)
+        for plan_name, resolved_price_id in resolved_price_ids.items():
             if not resolved_price_id:
                 continue
             cur.execute(
@@ -216,88 +345,49 @@ def _sync_plan_price_ids_from_env() -> list[str]:
             if cur.rowcount > 0:
                 updated_plan_names.append(plan_name)
         conn.commit()
+
+    if not failed_plans:
+        _plan_price_synced_at = now
     return updated_plan_names
 
 
 def _pence_to_gbp_string(price_pence: int) -> str:
-    value = Decimal(price_pence) / Decimal(100)
-    return f"{value:.2f}"
+    sign = "-" if price_pence < 0 else ""
+    pounds, pence = divmod(abs(price_pence), 100)
+    return f"{sign}{pounds}.{pence:02d}"
 
 
 def _price_per_hour(price_pence: int, minutes: int | None, interval: str | None = None) -> str | None:
     if not minutes or minutes <= 0:
         return None
-    total_minutes = Decimal(minutes)
-    if interval == "year":
-        total_minutes *= 12
-    hourly = (Decimal(price_pence) / Decimal(100)) / (total_minutes / Decimal(60))
-    return f"{hourly:.2f}"
-
-
-def _minutes_used_for_students(
-    student_ids: list[str],
-    period_start: datetime.datetime | None = None,
-    period_end: datetime.datetime | None = None,
-) -> int:
-    if not student_ids:
-        return 0
-
-    query = """
-        SELECT COALESCE(SUM(COALESCE(duration_seconds, 0)), 0)
-        FROM sessions
-        WHERE student_id = ANY(%s)
-    """
-    args: list[Any] = [student_ids]
-
-    if period_start is not None:
-        query += " AND started_at >= %s"
-        args.append(period_start)
-    if period_end is not None:
-        query += " AND started_at < %s"
-        args.append(period_end)
-
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(query, tuple(args))
-        row = cur.fetchone()
-
-    seconds = int(row[0] or 0)
-    return max(0, seconds // 60)
-
-
-def _profile_student_ids(profile_id: str) -> list[str]:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            "SELECT account_type FROM profiles WHERE id = %s",
-            (profile_id,),
-        )
-        account_row = cur.fetchone()
+    total_minutes = minutes * 12 if interval == "year" else minutes
+    # Nearest penny, halves rounded up.
+    hourly_pence, remainder = divmod(price_pence * 60, total_minutes)
+    if 2 * remainder >= total_minutes:
+        hourly_pence += 1
+    return _pence_to_gbp_string(hourly_pence)
 
-        if not account_row:
-            return []
 
-        account_type = str(account_row[0])
-        if account_type == "student":
-            cur.execute("SELECT id FROM students WHERE id = %s", (profile_id,))
-            student_row = cur.fetchone()
-            return [str(student_row[0])] if student_row else []
+_db_school_domains_cache: tuple[float, frozenset[str]] | None = None
 
-        cur.execute(
-            "SELECT student_id FROM parent_student_links WHERE parent_id = %s",
-            (profile_id,),
-        )
-        return [str(row[0]) for row in cur.fetchall()]
 
+def _db_school_domains(*, conn: psycopg.Connection | None = None) -> frozenset[str]:
+    global _db_school_domains_cache
+    now = time.monotonic()
+    if _db_school_domains_cache is not None and now - _db_school_domains_cache[0] < SCHOOL_DOMAINS_DB_TTL_S:
+        return _db_school_domains_cache[1]
+    if conn is None:
+        with get_conn() as conn:
+            return _db_school_domains(conn=conn)
 
-def _parent_profile_ids_for_student(student_id: str) -> list[str]:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            "SELECT parent_id FROM parent_student_links WHERE student_id = %s",
-            (student_id,),
-        )
-        return [str(row[0]) for row in cur.fetchall()]
+    with conn.cursor() as cur:
+        cur.execute("SELECT domain FROM school_email_domains")
+        domains = frozenset(str(row[0]) for row in cur.fetchall())
+    _db_school_domains_cache = (now, domains)
+    return domains
 
 
-def is_school_email(email: str) -> bool:
+def is_school_email(email: str, *, conn: psycopg.Connection | None = None) -> bool:
     value = (email or "").strip().lower()
     if "@" not in value:
         return False
@@ -312,9 +402,7 @@ def is_school_email(email: str) -> bool:
     if domain.endswith(".sch.uk") or domain.endswith(".school.uk"):
         return True
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT 1 FROM school_email_domains WHERE domain = %s LIMIT 1", (domain,))
-        return cur.fetchone() is not None
+    return domain in _db_school_domains(conn=conn)
 
 
 def _get_or_create_billing_customer(profile_id: str) -> str:
@@ -355,97 +443,151 @@ def _get_or_create_billing_customer(profile_id: str) -> str:
     return str(customer["id"])
 
 
-def _active_subscription_for_profile(profile_id: str) -> tuple[Any, ...] | None:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT s.id, s.plan_id, s.status, s.current_period_start, s.current_period_end, p.monthly_minutes
-            FROM subscriptions s
-            LEFT JOIN plans p ON p.id = s.plan_id
-            WHERE s.profile_id = %s
-              AND s.status IN ('active','trialing','past_due')
-            ORDER BY s.updated_at DESC
-            LIMIT 1
-            """,
-            (profile_id,),
-        )
-        return cur.fetchone()
-
-
-def _credits_remaining_for_profile(profile_id: str) -> int:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT COALESCE(SUM(minutes_remaining), 0)
-            FROM usage_credits
-            WHERE profile_id = %s
-              AND minutes_remaining > 0
-              AND (expires_at IS NULL OR expires_at > NOW())
-            """,
-            (profile_id,),
-        )
-        row = cur.fetchone()
-    return int(row[0] or 0)
-
-
-def _consume_credits(profile_id: str, minutes_to_consume: int) -> None:
-    if minutes_to_consume <= 0:
-        return
-
-    remaining = minutes_to_consume
+# Everything /subscription reports for a profile, in one round trip. No row means no profile.
+_SUBSCRIPTION_OVERVIEW_SQL = """
+WITH profile AS (
+  SELECT id, email, account_type FROM profiles WHERE id = %(profile_id)s::uuid
+),
+student_ids AS (
+  SELECT s.id AS student_id
+  FROM profile pr
+  JOIN students s ON s.id = pr.id
+  WHERE pr.account_type = 'student'
+  UNION ALL
+  SELECT l.student_id
+  FROM profile pr
+  JOIN parent_student_links l ON l.parent_id = pr.id
+  WHERE pr.account_type <> 'student'
+),
+sub AS (
+  SELECT s.id, s.status, s.current_period_start, s.current_period_end, s.cancel_at_period_end,
+         p.id AS plan_id, p.name AS plan_name, p.monthly_minutes, p.price_pence, p.interval,
+         p.is_school_plan
+  FROM subscriptions s
+  LEFT JOIN plans p ON p.id = s.plan_id
+  WHERE s.profile_id = %(profile_id)s::uuid
+  ORDER BY s.updated_at DESC
+  LIMIT 1
+)
+SELECT
+  pr.email,
+  sub.id AS subscription_id,
+  sub.status,
+  sub.current_period_start,
+  sub.current_period_end,
+  sub.cancel_at_period_end,
+  sub.plan_id,
+  sub.plan_name,
+  sub.monthly_minutes,
+  sub.price_pence,
+  sub.interval,
+  sub.is_school_plan,
+  used.lifetime_seconds,
+  used.period_seconds,
+  cr.minutes_remaining AS credits_remaining
+FROM profile pr
+LEFT JOIN sub ON true
+CROSS JOIN LATERAL (
+  SELECT
+    COALESCE(SUM(COALESCE(se.duration_seconds, 0)), 0) AS lifetime_seconds,
+    COALESCE(SUM(COALESCE(se.duration_seconds, 0)) FILTER (
+      WHERE se.started_at >= sub.current_period_start
+        AND se.started_at < sub.current_period_end
+    ), 0) AS period_seconds
+  FROM sessions se
+  WHERE se.student_id IN (SELECT student_id FROM student_ids)
+) used
+CROSS JOIN LATERAL (
+  SELECT COALESCE(SUM(uc.minutes_remaining), 0) AS minutes_remaining
+  FROM usage_credits uc
+  WHERE uc.profile_id = pr.id
+    AND uc.minutes_remaining > 0
+    AND (uc.expires_at IS NULL OR uc.expires_at > NOW())
+) cr
+"""
+
+
+# Quota inputs for the student (ord 0) and each linked parent profile, in one round trip.
+_CANDIDATE_QUOTA_SQL = """
+WITH candidates AS (
+  SELECT %(student_id)s::uuid AS profile_id, 0 AS ord
+  UNION ALL
+  SELECT l.parent_id, l.id
+  FROM parent_student_links l
+  WHERE l.student_id = %(student_id)s::uuid
+)
+SELECT
+  c.profile_id,
+  cp.id IS NOT NULL AS profile_exists,
+  sub.id IS NOT NULL AS has_subscription,
+  sub.monthly_minutes,
+  used.lifetime_seconds,
+  used.period_seconds,
+  cr.minutes_remaining
+FROM candidates c
+LEFT JOIN profiles cp ON cp.id = c.profile_id
+LEFT JOIN LATERAL (
+  SELECT COALESCE(array_agg(x.student_id), '{}'::uuid[]) AS student_ids
+  FROM (
+    SELECT s.id AS student_id FROM students s
+    WHERE cp.account_type = 'student' AND s.id = c.profile_id
+    UNION ALL
+    SELECT l.student_id FROM parent_student_links l
+    WHERE cp.account_type <> 'student' AND l.parent_id = c.profile_id
+  ) x
+) st ON true
+LEFT JOIN LATERAL (
+  SELECT s.id, s.current_period_start, s.current_period_end, p.monthly_minutes
+  FROM subscriptions s
+  LEFT JOIN plans p ON p.id = s.plan_id
+  WHERE s.profile_id = c.profile_id
+    AND s.status IN ('active','trialing','past_due')
+  ORDER BY s.updated_at DESC
+  LIMIT 1
+) sub ON true
+LEFT JOIN LATERAL (
+  SELECT
+    COALESCE(SUM(COALESCE(se.duration_seconds, 0)) FILTER (WHERE c.ord = 0), 0) AS lifetime_seconds,
+    COALESCE(SUM(COALESCE(se.duration_seconds, 0)) FILTER (
+      WHERE sub.id IS NOT NULL
+        AND (sub.current_period_start IS NULL OR se.started_at >= sub.current_period_start)
+        AND (sub.current_period_end IS NULL OR se.started_at < sub.current_period_end)
+    ), 0) AS period_seconds
+  FROM sessions se
+  WHERE se.student_id = ANY(st.student_ids)
+) used ON true
+LEFT JOIN LATERAL (
+  SELECT COALESCE(SUM(uc.minutes_remaining), 0) AS minutes_remaining
+  FROM usage_credits uc
+  WHERE uc.profile_id = c.profile_id
+    AND uc.minutes_remaining > 0
+    AND (uc.expires_at IS NULL OR uc.expires_at > NOW())
+) cr ON true
+ORDER BY c.ord
+"""
+
+
+def _candidate_quota_rows(student_id: str) -> list[tuple[Any, ...]]:
     with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT id, minutes_remaining
-            FROM usage_credits
-            WHERE profile_id = %s
-              AND minutes_remaining > 0
-              AND (expires_at IS NULL OR expires_at > NOW())
-            ORDER BY created_at ASC
-            """,
-            (profile_id,),
-        )
-        rows = cur.fetchall()
+        cur.execute(_CANDIDATE_QUOTA_SQL, {"student_id": student_id})
+        return cur.fetchall()
 
-        for row in rows:
-            credit_id = int(row[0])
-            available = int(row[1])
-            if remaining <= 0:
-                break
-            deduction = min(remaining, available)
-            cur.execute(
-                """
-                UPDATE usage_credits
-                SET minutes_remaining = minutes_remaining - %s,
-                    updated_at = NOW()
-                WHERE id = %s
-                """,
-                (deduction, credit_id),
-            )
-            remaining -= deduction
 
-        conn.commit()
-
-
-def _quota_for_profile(profile_id: str, include_free_tier: bool) -> QuotaResult:
-    student_ids = _profile_student_ids(profile_id)
+def _quota_from_row(row: tuple[Any, ...], include_free_tier: bool) -> QuotaResult:
+    profile_id = str(row[0])
 
     free_remaining = 0
     if include_free_tier:
-        lifetime_used = _minutes_used_for_students(student_ids)
+        lifetime_used = max(0, int(row[4] or 0) // 60)
         free_remaining = max(0, 60 - lifetime_used)
 
     subscription_remaining = 0
-    subscription_row = _active_subscription_for_profile(profile_id)
-    if subscription_row:
-        period_start = subscription_row[3]
-        period_end = subscription_row[4]
-        monthly_minutes = int(subscription_row[5] or 0)
-        if monthly_minutes > 0:
-            used_period = _minutes_used_for_students(student_ids, period_start, period_end)
-            subscription_remaining = max(0, monthly_minutes - used_period)
-
-    credits_remaining = _credits_remaining_for_profile(profile_id)
+    monthly_minutes = int(row[3] or 0)
+    if row[2] and monthly_minutes > 0:
+        used_period = max(0, int(row[5] or 0) // 60)
+        subscription_remaining = max(0, monthly_minutes - used_period)
+
+    credits_remaining = int(row[6] or 0)
     remaining = free_remaining + subscription_remaining + credits_remaining
     if remaining > 0:
         return QuotaResult(
@@ -470,21 +612,12 @@ def _quota_for_profile(profile_id: str, include_free_tier: bool) -> QuotaResult:
 
 
 def check_subscription_quota(student_id: str) -> QuotaResult:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            "SELECT id FROM profiles WHERE id = %s",
-            (student_id,),
-        )
-        profile_row = cur.fetchone()
-        if not profile_row:
-            return QuotaResult(False, "profile_not_found", 0, 0, 0, 0, billing_profile_id=None)
-
-    student_profile_id = str(profile_row[0])
-    candidate_profile_ids = [student_profile_id, *_parent_profile_ids_for_student(student_id)]
+    rows = _candidate_quota_rows(student_id)
+    if not rows or not rows[0][1]:
+        return QuotaResult(False, "profile_not_found", 0, 0, 0, 0, billing_profile_id=None)
 
-    candidates: list[QuotaResult] = []
-    for profile_id in candidate_profile_ids:
-        candidates.append(_quota_for_profile(profile_id, include_free_tier=(profile_id == student_profile_id)))
+    # Only the student's own profile (first row) gets the free tier.
+    candidates = [_quota_from_row(row, include_free_tier=(index == 0)) for index, row in enumerate(rows)]
 
     allowed_candidates = [candidate for candidate in candidates if candidate.allowed]
     if allowed_candidates:
@@ -496,26 +629,71 @@ def check_subscription_quota(student_id: str) -> QuotaResult:
     return QuotaResult(False, "quota_exceeded", 0, 0, 0, 0, billing_profile_id=None)
 
 
-def consume_quota_minutes(student_id: str, minutes_consumed: int) -> None:
+def consume_quota_minutes(student_id: str, minutes_consumed: int) -> int:
+    """Charge a finished session against credits; returns the minutes actually deducted."""
     if minutes_consumed <= 0:
-        return
-
-    candidate_profile_ids = [student_id, *_parent_profile_ids_for_student(student_id)]
-
-    for profile_id in candidate_profile_ids:
-        if _active_subscription_for_profile(profile_id):
-            return
-
-    best_credit_profile: str | None = None
-    best_credit_minutes = 0
-    for profile_id in candidate_profile_ids:
-        remaining = _credits_remaining_for_profile(profile_id)
-        if remaining > best_credit_minutes:
-            best_credit_minutes = remaining
-            best_credit_profile = profile_id
+        return 0
 
-    if best_credit_profile and best_credit_minutes > 0:
-        _consume_credits(best_credit_profile, minutes_consumed)
+    # Skipped entirely while the student or a linked parent has an active subscription;
+    # otherwise the candidate with the most credit pays (the student wins ties), oldest
+    # credit first. Credit rows are locked before the running total is taken (FOR UPDATE
+    # cannot be combined with window functions). A concurrent call waits on those locks and
+    # then re-reads the updated balances, so minutes are neither double-spent nor dropped.
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH candidates AS (
+              SELECT %(student_id)s::uuid AS profile_id
+              UNION
+              SELECT parent_id FROM parent_student_links WHERE student_id = %(student_id)s::uuid
+            ),
+            active_subscription AS (
+              SELECT 1
+              FROM subscriptions
+              WHERE profile_id IN (SELECT profile_id FROM candidates)
+                AND status IN ('active','trialing','past_due')
+              LIMIT 1
+            ),
+            best_profile AS (
+              SELECT uc.profile_id
+              FROM usage_credits uc
+              WHERE uc.profile_id IN (SELECT profile_id FROM candidates)
+                AND uc.minutes_remaining > 0
+                AND (uc.expires_at IS NULL OR uc.expires_at > NOW())
+                AND NOT EXISTS (SELECT 1 FROM active_subscription)
+              GROUP BY uc.profile_id
+              ORDER BY SUM(uc.minutes_remaining) DESC, (uc.profile_id = %(student_id)s::uuid) DESC
+              LIMIT 1
+            ),
+            locked AS (
+              SELECT id, minutes_remaining, created_at
+              FROM usage_credits
+              WHERE profile_id = (SELECT profile_id FROM best_profile)
+                AND minutes_remaining > 0
+                AND (expires_at IS NULL OR expires_at > NOW())
+              ORDER BY created_at ASC, id ASC
+              FOR UPDATE
+            ),
+            ordered AS (
+              SELECT
+                id,
+                minutes_remaining,
+                SUM(minutes_remaining) OVER (ORDER BY created_at ASC, id ASC) - minutes_remaining AS consumed_before
+              FROM locked
+            )
+            UPDATE usage_credits AS u
+            SET minutes_remaining = o.minutes_remaining - LEAST(o.minutes_remaining, %(minutes)s - o.consumed_before),
+                updated_at = NOW()
+            FROM ordered o
+            WHERE u.id = o.id
+              AND o.consumed_before < %(minutes)s
+            RETURNING LEAST(o.minutes_remaining, %(minutes)s - o.consumed_before)
+            """,
+            {"student_id": student_id, "minutes": minutes_consumed},
+        )
+        consumed = sum(int(row[0]) for row in cur.fetchall())
+        conn.commit()
+    return consumed
 
 
 def _upsert_subscription_from_stripe(
@@ -523,15 +701,13 @@ def _upsert_subscription_from_stripe(
     stripe_subscription_id: str,
     stripe_price_id: str,
     status: str,
-    current_period_start: datetime.datetime | None,
-    current_period_end: datetime.datetime | None,
+    current_period_start_ts: int | None,
+    current_period_end_ts: int | None,
     cancel_at_period_end: bool,
+    *,
+    conn: psycopg.Connection,
 ) -> None:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT id FROM plans WHERE stripe_price_id = %s LIMIT 1", (stripe_price_id,))
-        plan_row = cur.fetchone()
-        plan_id = int(plan_row[0]) if plan_row else None
-
+    with conn.cursor() as cur:
         cur.execute(
             """
             INSERT INTO subscriptions (
@@ -546,7 +722,18 @@ def _upsert_subscription_from_stripe(
               created_at,
               updated_at
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+            VALUES (
+              %(profile_id)s,
+              (SELECT id FROM plans WHERE stripe_price_id = %(price_id)s LIMIT 1),
+              %(subscription_id)s,
+              %(price_id)s,
+              %(status)s,
+              to_timestamp(%(period_start)s::double precision),
+              to_timestamp(%(period_end)s::double precision),
+              %(cancel_at_period_end)s,
+              NOW(),
+              NOW()
+            )
             ON CONFLICT (stripe_subscription_id)
             DO UPDATE SET
               plan_id = EXCLUDED.plan_id,
@@ -557,25 +744,65 @@ def _upsert_subscription_from_stripe(
               cancel_at_period_end = EXCLUDED.cancel_at_period_end,
               updated_at = NOW()
             """,
-            (
-                profile_id,
-                plan_id,
-                stripe_subscription_id,
-                stripe_price_id,
-                status,
-                current_period_start,
-                current_period_end,
-                cancel_at_period_end,
-            ),
+            {
+                "profile_id": profile_id,
+                "subscription_id": stripe_subscription_id,
+                "price_id": stripe_price_id,
+                "status": status,
+                "period_start": current_period_start_ts,
+                "period_end": current_period_end_ts,
+                "cancel_at_period_end": cancel_at_period_end,
+            },
         )
-        conn.commit()
 
 
-def _add_credit(profile_id: str, source: str, minutes: int, metadata: dict[str, Any]) -> None:
+def _update_subscription_from_stripe(
+    stripe_subscription_id: str,
+    stripe_price_id: str,
+    status: str,
+    current_period_start_ts: int | None,
+    current_period_end_ts: int | None,
+    cancel_at_period_end: bool,
+    *,
+    conn: psycopg.Connection,
+) -> None:
+    # Only subscriptions we already know about (created at checkout) are updated.
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE subscriptions
+            SET plan_id = (SELECT id FROM plans WHERE stripe_price_id = %(price_id)s LIMIT 1),
+                stripe_price_id = %(price_id)s,
+                status = %(status)s,
+                current_period_start = to_timestamp(%(period_start)s::double precision),
+                current_period_end = to_timestamp(%(period_end)s::double precision),
+                cancel_at_period_end = %(cancel_at_period_end)s,
+                updated_at = NOW()
+            WHERE stripe_subscription_id = %(subscription_id)s
+            """,
+            {
+                "subscription_id": stripe_subscription_id,
+                "price_id": stripe_price_id,
+                "status": status,
+                "period_start": current_period_start_ts,
+                "period_end": current_period_end_ts,
+                "cancel_at_period_end": cancel_at_period_end,
+            },
+        )
+
+
+def _add_credit(
+    profile_id: str,
+    source: str,
+    minutes: int,
+    metadata: dict[str, Any],
+    *,
+    conn: psycopg.Connection,
+) -> None:
     if minutes <= 0:
         return
 
-    with get_conn() as conn, conn.cursor() as cur:
+    with conn.cursor() as cur:
         cur.execute(
             """
             INSERT INTO usage_credits (profile_id, source, minutes_total, minutes_remaining, metadata)
@@ -583,12 +810,14 @@ def _add_credit(profile_id: str, source: str, minutes: int, metadata: dict[str,
             """,
             (profile_id, source, minutes, minutes, json.dumps(metadata)),
         )
-        conn.commit()
+
+
+_REFERRAL_CODE_CHARS = string.ascii_uppercase + string.digits
+_CUSTOM_REFERRAL_CODE_RE = re.compile(r"[A-Z0-9]{4,20}")
 
 
 def _generate_referral_code(length: int = 8) -> str:
-    chars = string.ascii_uppercase + string.digits
-    return "".join(random.choice(chars) for _ in range(length))
+    return "".join(random.choices(_REFERRAL_CODE_CHARS, k=length))
 
 
 def _ensure_referral_code(profile_id: str) -> str:
@@ -603,59 +832,55 @@ def _ensure_referral_code(profile_id: str) -> str:
 
         for _ in range(5):
             code = _generate_referral_code()
-            cur.execute("SELECT 1 FROM referrals WHERE referral_code = %s", (code,))
-            if cur.fetchone() is None:
-                cur.execute(
-                    """
-                    INSERT INTO referrals (referrer_profile_id, referral_code)
-                    VALUES (%s, %s)
-                    """,
-                    (profile_id, code),
-                )
+            cur.execute(
+                """
+                INSERT INTO referrals (referrer_profile_id, referral_code)
+                VALUES (%s, %s)
+                ON CONFLICT (referral_code) DO NOTHING
+                RETURNING referral_code
+                """,
+                (profile_id, code),
+            )
+            if cur.fetchone() is not None:
                 conn.commit()
                 return code
 
     raise HTTPException(status_code=500, detail="Could not generate referral code")
 
 
-def _apply_referral_reward_if_eligible(profile_id: str) -> None:
-    with get_conn() as conn, conn.cursor() as cur:
+def _apply_referral_reward_if_eligible(profile_id: str, *, conn: psycopg.Connection) -> None:
+    # Marking the reward granted and reading the referrer is one statement, so a reward
+    # can only be claimed once even if two events race.
+    with conn.cursor() as cur:
         cur.execute(
             """
-            SELECT id, referrer_profile_id, reward_granted_at
-            FROM referrals
-            WHERE referee_profile_id = %s
-            LIMIT 1
+            UPDATE referrals
+            SET reward_granted_at = NOW()
+            WHERE referee_profile_id = %s AND reward_granted_at IS NULL
+            RETURNING referrer_profile_id
             """,
             (profile_id,),
         )
         row = cur.fetchone()
 
-        if not row:
-            return
-
-        referral_id = int(row[0])
-        referrer_profile_id = str(row[1])
-        reward_granted_at = row[2]
-
-        if reward_granted_at is not None:
-            return
-
-    _add_credit(profile_id, "referral_bonus", 300, {"kind": "referee"})
-    _add_credit(referrer_profile_id, "referral_bonus", 300, {"kind": "referrer", "refereeProfileId": profile_id})
+    if not row:
+        return
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            "UPDATE referrals SET reward_granted_at = NOW() WHERE id = %s",
-            (referral_id,),
-        )
-        conn.commit()
+    referrer_profile_id = str(row[0])
+    _add_credit(profile_id, "referral_bonus", 300, {"kind": "referee"}, conn=conn)
+    _add_credit(
+        referrer_profile_id,
+        "referral_bonus",
+        300,
+        {"kind": "referrer", "refereeProfileId": profile_id},
+        conn=conn,
+    )
 
 
 @router.get("/plans")
 async def get_plans() -> dict[str, Any]:
     _sync_plan_price_ids_from_env()
-    with get_conn() as conn, conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
         cur.execute(
             """
             SELECT id, name, plan_type, stripe_price_id, monthly_minutes, credit_minutes,
@@ -669,20 +894,27 @@ async def get_plans() -> dict[str, Any]:
 
     plans_payload = []
     for row in rows:
-        minutes = int(row[4]) if row[4] is not None else int(row[5] or 0)
+        monthly_minutes = row["monthly_minutes"]
+        credit_minutes = row["credit_minutes"]
+        price_pence = row["price_pence"]
+        interval = row["interval"] or None
         plans_payload.append(
             {
-                "id": int(row[0]),
-                "name": str(row[1]),
-                "planType": str(row[2]),
-                "stripePriceId": str(row[3]) if row[3] else None,
-                "monthlyMinutes": int(row[4]) if row[4] is not None else None,
-                "creditMinutes": int(row[5]) if row[5] is not None else None,
-                "pricePence": int(row[6]),
-                "priceGbp": _pence_to_gbp_string(int(row[6])),
-                "interval": str(row[7]) if row[7] else None,
-                "isSchoolPlan": bool(row[8]),
-                "pricePerHourGbp": _price_per_hour(int(row[6]), minutes, str(row[7]) if row[7] else None),
+                "id": row["id"],
+                "name": row["name"],
+                "planType": row["plan_type"],
+                "stripePriceId": row["stripe_price_id"] or None,
+                "monthlyMinutes": monthly_minutes,
+                "creditMinutes": credit_minutes,
+                "pricePence": price_pence,
+                "priceGbp": _pence_to_gbp_string(price_pence),
+                "interval": interval,
+                "isSchoolPlan": row["is_school_plan"],
+                "pricePerHourGbp": _price_per_hour(
+                    price_pence,
+                    monthly_minutes if monthly_minutes is not None else (credit_minutes or 0),
+                    interval,
+                ),
             }
         )
 
@@ -693,57 +925,40 @@ async def get_plans() -> dict[str, Any]:
 async def get_subscription(
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT email FROM profiles WHERE id = %s", (profile_id,))
-        profile_row = cur.fetchone()
-        if not profile_row:
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(_SUBSCRIPTION_OVERVIEW_SQL, {"profile_id": profile_id})
+            row = cur.fetchone()
+        if not row:
             raise HTTPException(status_code=404, detail="Profile not found")
-        email = str(profile_row[0])
+        school_eligible = is_school_email(str(row["email"]), conn=conn)
 
-        cur.execute(
-            """
-            SELECT s.id, s.status, s.current_period_start, s.current_period_end, s.cancel_at_period_end,
-                   p.id, p.name, p.monthly_minutes, p.price_pence, p.interval, p.is_school_plan
-            FROM subscriptions s
-            LEFT JOIN plans p ON p.id = s.plan_id
-            WHERE s.profile_id = %s
-            ORDER BY s.updated_at DESC
-            LIMIT 1
-            """,
-            (profile_id,),
-        )
-        sub_row = cur.fetchone()
-
-    student_ids = _profile_student_ids(profile_id)
-
-    used_minutes = 0
-    subscription_minutes = 0
-    if sub_row and sub_row[2] and sub_row[3]:
-        used_minutes = _minutes_used_for_students(student_ids, sub_row[2], sub_row[3])
-        subscription_minutes = int(sub_row[7] or 0)
-
-    credits_remaining = _credits_remaining_for_profile(profile_id)
-    free_used_minutes = _minutes_used_for_students(student_ids)
+    free_used_minutes = int(row["lifetime_seconds"] or 0) // 60
     free_remaining = max(0, 60 - free_used_minutes)
-    school_eligible = is_school_email(email)
+    credits_remaining = int(row["credits_remaining"] or 0)
 
     subscription_payload = None
-    if sub_row:
+    if row["subscription_id"] is not None:
+        used_minutes = 0
+        subscription_minutes = 0
+        if row["current_period_start"] and row["current_period_end"]:
+            used_minutes = int(row["period_seconds"] or 0) // 60
+            subscription_minutes = row["monthly_minutes"] or 0
         subscription_payload = {
-            "id": int(sub_row[0]),
-            "status": str(sub_row[1]),
-            "currentPeriodStart": sub_row[2],
-            "currentPeriodEnd": sub_row[3],
-            "cancelAtPeriodEnd": bool(sub_row[4]),
+            "id": row["subscription_id"],
+            "status": row["status"],
+            "currentPeriodStart": row["current_period_start"],
+            "currentPeriodEnd": row["current_period_end"],
+            "cancelAtPeriodEnd": row["cancel_at_period_end"],
             "plan": {
-                "id": int(sub_row[5]) if sub_row[5] is not None else None,
-                "name": str(sub_row[6]) if sub_row[6] is not None else None,
-                "monthlyMinutes": int(sub_row[7]) if sub_row[7] is not None else None,
-                "pricePence": int(sub_row[8]) if sub_row[8] is not None else None,
-                "interval": str(sub_row[9]) if sub_row[9] is not None else None,
-                "isSchoolPlan": bool(sub_row[10]) if sub_row[10] is not None else False,
+                "id": row["plan_id"],
+                "name": row["plan_name"],
+                "monthlyMinutes": row["monthly_minutes"],
+                "pricePence": row["price_pence"],
+                "interval": row["interval"],
+                "isSchoolPlan": bool(row["is_school_plan"]),
             },
             "usedMinutesThisPeriod": used_minutes,
             "remainingMinutesThisPeriod": max(0, subscription_minutes - used_minutes),
@@ -764,7 +979,7 @@ async def create_checkout_session(
 ) -> dict[str, Any]:
     _require_stripe()
     _sync_plan_price_ids_from_env()
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
 
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT email FROM profiles WHERE id = %s", (profile_id,))
@@ -782,6 +997,7 @@ async def create_checkout_session(
             (payload.planId,),
         )
         plan_row = cur.fetchone()
+        school_eligible = bool(plan_row and plan_row[4]) and is_school_email(email, conn=conn)
 
     if not plan_row:
         raise HTTPException(status_code=404, detail="Plan not found")
@@ -790,7 +1006,7 @@ async def create_checkout_session(
     stripe_price_id = str(plan_row[3]) if plan_row[3] else None
     is_school_plan = bool(plan_row[4])
 
-    if is_school_plan and not is_school_email(email):
+    if is_school_plan and not school_eligible:
         raise HTTPException(status_code=403, detail="School email required for this plan")
 
     if not stripe_price_id:
@@ -821,17 +1037,13 @@ async def sync_price_ids(
     x_internal_api_key: str | None = Header(default=None),
 ) -> dict[str, Any]:
     _require_internal_api_key(x_internal_api_key)
-    updated = _sync_plan_price_ids_from_env()
-    configured: dict[str, dict[str, bool]] = {}
-    for plan_name in PLAN_PRODUCT_ENV_MAP:
-        product_env_name = PLAN_PRODUCT_ENV_MAP[plan_name]
-        configured[plan_name] = {
-            "productEnvConfigured": bool((os.environ.get(product_env_name, "") or "").strip()),
-        }
+    updated = _sync_plan_price_ids_from_env(force=True)
+    # Plans were just re-synced, so drop any cached credit-pack sizes with them.
+    _plan_credit_minutes_cache.clear()
     return {
         "ok": True,
         "updatedPlans": updated,
-        "configured": configured,
+        "configured": _PLAN_PRODUCT_CONFIGURED,
     }
 
 
@@ -841,7 +1053,7 @@ async def create_portal_session(
     authorization: str | None = Header(default=None),
 ) -> dict[str, str]:
     _require_stripe()
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
 
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
@@ -861,23 +1073,185 @@ async def create_portal_session(
     return {"portalUrl": str(portal["url"])}
 
 
+_stripe_subscription_cache: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+_stripe_subscription_cache_lock = threading.Lock()
+_plan_credit_minutes_cache: dict[int, tuple[float, int]] = {}
+
+
+def _retrieve_stripe_subscription(subscription_id: str) -> Any:
+    now = time.monotonic()
+    with _stripe_subscription_cache_lock:
+        entry = _stripe_subscription_cache.get(subscription_id)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+    subscription = stripe.Subscription.retrieve(subscription_id)
+    with _stripe_subscription_cache_lock:
+        _stripe_subscription_cache[subscription_id] = (now + STRIPE_SUBSCRIPTION_CACHE_TTL_S, subscription)
+        _stripe_subscription_cache.move_to_end(subscription_id)
+        while len(_stripe_subscription_cache) > _STRIPE_SUBSCRIPTION_CACHE_MAX_ENTRIES:
+            _stripe_subscription_cache.popitem(last=False)
+    return subscription
+
+
+def _forget_stripe_subscription(subscription_id: str) -> None:
+    with _stripe_subscription_cache_lock:
+        _stripe_subscription_cache.pop(subscription_id, None)
+
+
+def _plan_credit_minutes(plan_id: int, *, conn: psycopg.Connection) -> int:
+    now = time.monotonic()
+    entry = _plan_credit_minutes_cache.get(plan_id)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT credit_minutes FROM plans WHERE id = %s", (plan_id,))
+        row = cur.fetchone()
+    credit_minutes = int(row[0] or 0) if row else 0
+    _plan_credit_minutes_cache[plan_id] = (now + PLAN_PRICE_SYNC_TTL_S, credit_minutes)
+    return credit_minutes
+
+
+async def _read_webhook_payload(request: Request) -> bytes:
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > _WEBHOOK_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Webhook payload too large")
+
+    payload = bytearray()
+    async for chunk in request.stream():
+        payload += chunk
+        if len(payload) > _WEBHOOK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Webhook payload too large")
+    return bytes(payload)
+
+
 @router.post("/webhook")
 async def stripe_webhook(request: Request) -> dict[str, bool]:
     _require_stripe()
-    payload = await request.body()
     signature = request.headers.get("stripe-signature")
 
     if not signature or not STRIPE_WEBHOOK_SECRET:
         raise HTTPException(status_code=400, detail="Missing webhook signature")
 
+    payload = await _read_webhook_payload(request)
+
+    # construct_event checks the signature before it parses the payload.
     try:
         event = stripe.Webhook.construct_event(payload, signature, STRIPE_WEBHOOK_SECRET)
-    except Exception as exc:
-        raise HTTPException(status_code=400, detail="Invalid webhook signature") from exc
+    except (stripe.SignatureVerificationError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature") from None
 
+    event_id = str(event.get("id") or "")
     event_type = str(event.get("type"))
-    data_object = event.get("data", {}).get("object", {})
 
+    # Record the event and ack straight away; Stripe only needs to know we have it.
+    # The raw payload is kept so a restart can finish anything left unprocessed.
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(
+            """
+            INSERT INTO processed_webhook_events (event_id, event_type, payload)
+            VALUES (%s, %s, %s::jsonb)
+            ON CONFLICT (event_id) DO NOTHING
+            RETURNING event_id
+            """,
+            (event_id, event_type, payload.decode("utf-8")),
+        )
+        claimed = await cur.fetchone() is not None
+        pending = claimed
+        if not claimed:
+            # A redelivery of an event we failed to apply is our cue to try it again.
+            await cur.execute(
+                "SELECT processed_at IS NULL FROM processed_webhook_events WHERE event_id = %s",
+                (event_id,),
+            )
+            row = await cur.fetchone()
+            pending = bool(row and row[0])
+        await conn.commit()
+
+    if pending:
+        _schedule_stripe_event(event_id)
+    if not claimed:
+        return {"received": True, "duplicate": True}
+    return {"received": True}
+
+
+# One worker so events are applied in the order Stripe delivered them.
+_webhook_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stripe-webhook")
+
+
+def _stripe_event_retry_delay_s(attempt: int) -> float:
+    return min(_STRIPE_EVENT_RETRY_MAX_S, STRIPE_EVENT_RETRY_BASE_S * 2 ** (attempt - 1))
+
+
+def _schedule_stripe_event(event_id: str, attempt: int = 1) -> None:
+    future = asyncio.get_running_loop().run_in_executor(_webhook_executor, _run_stripe_event, event_id)
+    future.add_done_callback(partial(_on_stripe_event_done, event_id, attempt))
+
+
+def _on_stripe_event_done(event_id: str, attempt: int, future: asyncio.Future[None]) -> None:
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is None:
+        return
+    traceback.print_exception(exc)
+    # The row is still pending; retry with backoff. Past the last attempt it is picked up
+    # again when Stripe redelivers the event or by resume_pending_stripe_events on startup.
+    if attempt < _STRIPE_EVENT_MAX_ATTEMPTS:
+        asyncio.get_running_loop().call_later(
+            _stripe_event_retry_delay_s(attempt), _schedule_stripe_event, event_id, attempt + 1
+        )
+
+
+def _run_stripe_event(event_id: str) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT event_type, payload
+                FROM processed_webhook_events
+                WHERE event_id = %s AND processed_at IS NULL AND payload IS NOT NULL
+                FOR UPDATE SKIP LOCKED
+                """,
+                (event_id,),
+            )
+            row = cur.fetchone()
+            if row is None:
+                conn.rollback()
+                return
+
+            event_type = str(row[0])
+            data_object = (row[1].get("data") or {}).get("object") or {}
+            _process_stripe_event(event_type, data_object, conn=conn)
+            cur.execute(
+                "UPDATE processed_webhook_events SET processed_at = NOW() WHERE event_id = %s",
+                (event_id,),
+            )
+        conn.commit()
+
+
+async def resume_pending_stripe_events() -> None:
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(
+            """
+            SELECT event_id
+            FROM processed_webhook_events
+            WHERE processed_at IS NULL AND payload IS NOT NULL
+            ORDER BY received_at
+            """
+        )
+        rows = await cur.fetchall()
+    for row in rows:
+        _schedule_stripe_event(str(row[0]))
+
+
+def _stripe_timestamp(value: Any) -> int | None:
+    # Stripe sends Unix seconds; Postgres converts them with to_timestamp.
+    return int(value) if value else None
+
+
+def _process_stripe_event(event_type: str, data_object: dict[str, Any], *, conn: psycopg.Connection) -> None:
     if event_type == "checkout.session.completed":
         mode = str(data_object.get("mode") or "")
         metadata = data_object.get("metadata") or {}
@@ -887,98 +1261,69 @@ async def stripe_webhook(request: Request) -> dict[str, bool]:
         if profile_id and mode == "subscription":
             subscription_id = str(data_object.get("subscription") or "")
             if subscription_id:
-                subscription = stripe.Subscription.retrieve(subscription_id)
+                subscription = _retrieve_stripe_subscription(subscription_id)
                 item = (subscription.get("items", {}).get("data") or [{}])[0]
                 price_id = str(item.get("price", {}).get("id") or "")
-                period_start = datetime.datetime.fromtimestamp(
-                    int(subscription.get("current_period_start") or 0),
-                    tz=datetime.timezone.utc,
-                ) if subscription.get("current_period_start") else None
-                period_end = datetime.datetime.fromtimestamp(
-                    int(subscription.get("current_period_end") or 0),
-                    tz=datetime.timezone.utc,
-                ) if subscription.get("current_period_end") else None
                 _upsert_subscription_from_stripe(
                     profile_id=profile_id,
                     stripe_subscription_id=subscription_id,
                     stripe_price_id=price_id,
                     status=str(subscription.get("status") or "active"),
-                    current_period_start=period_start,
-                    current_period_end=period_end,
+                    current_period_start_ts=_stripe_timestamp(subscription.get("current_period_start")),
+                    current_period_end_ts=_stripe_timestamp(subscription.get("current_period_end")),
                     cancel_at_period_end=bool(subscription.get("cancel_at_period_end") or False),
+                    conn=conn,
                 )
-                _apply_referral_reward_if_eligible(profile_id)
+                _apply_referral_reward_if_eligible(profile_id, conn=conn)
 
         if profile_id and mode == "payment" and plan_id is not None:
-            with get_conn() as conn, conn.cursor() as cur:
-                cur.execute("SELECT credit_minutes FROM plans WHERE id = %s", (plan_id,))
-                row = cur.fetchone()
-            credit_minutes = int(row[0] or 0) if row else 0
             _add_credit(
                 profile_id,
                 "credit_pack",
-                credit_minutes,
+                _plan_credit_minutes(plan_id, conn=conn),
                 {
                     "planId": plan_id,
                     "checkoutSessionId": data_object.get("id"),
                 },
+                conn=conn,
             )
 
     elif event_type in {"invoice.payment_failed", "invoice.payment_succeeded"}:
         subscription_id = str(data_object.get("subscription") or "")
         if subscription_id:
             status = "past_due" if event_type == "invoice.payment_failed" else "active"
-            with get_conn() as conn, conn.cursor() as cur:
+            with conn.cursor() as cur:
                 cur.execute(
                     "UPDATE subscriptions SET status = %s, updated_at = NOW() WHERE stripe_subscription_id = %s",
                     (status, subscription_id),
                 )
-                conn.commit()
 
     elif event_type in {"customer.subscription.updated", "customer.subscription.deleted"}:
         subscription_id = str(data_object.get("id") or "")
         if subscription_id:
+            _forget_stripe_subscription(subscription_id)
             status = "canceled" if event_type == "customer.subscription.deleted" else str(data_object.get("status") or "inactive")
             price_id = ""
             item_rows = data_object.get("items", {}).get("data") or []
             if item_rows:
                 price_id = str(item_rows[0].get("price", {}).get("id") or "")
 
-            period_start = datetime.datetime.fromtimestamp(
-                int(data_object.get("current_period_start") or 0),
-                tz=datetime.timezone.utc,
-            ) if data_object.get("current_period_start") else None
-            period_end = datetime.datetime.fromtimestamp(
-                int(data_object.get("current_period_end") or 0),
-                tz=datetime.timezone.utc,
-            ) if data_object.get("current_period_end") else None
-
-            with get_conn() as conn, conn.cursor() as cur:
-                cur.execute(
-                    "SELECT profile_id FROM subscriptions WHERE stripe_subscription_id = %s",
-                    (subscription_id,),
-                )
-                row = cur.fetchone()
-                if row:
-                    profile_id = str(row[0])
-                    _upsert_subscription_from_stripe(
-                        profile_id=profile_id,
-                        stripe_subscription_id=subscription_id,
-                        stripe_price_id=price_id,
-                        status=status,
-                        current_period_start=period_start,
-                        current_period_end=period_end,
-                        cancel_at_period_end=bool(data_object.get("cancel_at_period_end") or False),
-                    )
-
-    return {"received": True}
+            _update_subscription_from_stripe(
+                stripe_subscription_id=subscription_id,
+                stripe_price_id=price_id,
+                status=status,
+                current_period_start_ts=_stripe_timestamp(data_object.get("current_period_start")),
+                current_period_end_ts=_stripe_timestamp(data_object.get("current_period_end")),
+                cancel_at_period_end=bool(data_object.get("cancel_at_period_end") or False),
+                conn=conn,
+            )
 
 
 @router.get("/referral-code")
 async def get_referral_code(
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
     code = _ensure_referral_code(profile_id)
     custom = _get_custom_referral_code(profile_id)
     return {"referralCode": code, "customCode": custom}
@@ -999,12 +1344,10 @@ async def set_custom_referral_code(
     payload: CustomReferralCodeRequest,
     authorization: str | None = Header(default=None),
 ) -> dict[str, str]:
-    import re
-
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
     code = payload.customCode.strip().upper()
 
-    if not re.match(r'^[A-Z0-9]{4,20}$', code):
+    if not _CUSTOM_REFERRAL_CODE_RE.fullmatch(code):
         raise HTTPException(status_code=400, detail="Code must be 4-20 alphanumeric characters")
 
     # Ensure referral row exists
@@ -1033,12 +1376,19 @@ async def apply_referral(
     payload: ApplyReferralRequest,
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
+    code = payload.referralCode.strip().upper()
 
     with get_conn() as conn, conn.cursor() as cur:
+        # Two probes on the unique indexes rather than an OR across both columns.
         cur.execute(
-            "SELECT id, referrer_profile_id, referee_profile_id FROM referrals WHERE referral_code = %s OR custom_code = %s",
-            (payload.referralCode.strip().upper(), payload.referralCode.strip().upper()),
+            """
+            SELECT id, referrer_profile_id, referee_profile_id FROM referrals WHERE referral_code = %(code)s
+            UNION ALL
+            SELECT id, referrer_profile_id, referee_profile_id FROM referrals WHERE custom_code = %(code)s
+            LIMIT 1
+            """,
+            {"code": code},
         )
         row = cur.fetchone()
         if not row:
@@ -1,26 +1,52 @@
 from __future__ import annotations
 
-import json
+import asyncio
 import os
-from contextlib import contextmanager
-from typing import Iterator
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
 from typing import Any
 
+import orjson
 import psycopg
 from openai import OpenAI
+from psycopg.types.json import Jsonb
 from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
 # psycopg natively understands ?sslmode=require in the connection string;
 # no extra SSL config is needed — just ensure Supabase URLs include the param.
 # For local Docker dev the default conninfo has no sslmode, which is fine.
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
+# All API handlers, agent sessions and retrieval threads check out from these pools, so
+# DB_POOL_MAX_SIZE should cover the expected number of concurrent requests; beyond it
+# callers queue for a connection instead of opening new ones.
 DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
 DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "12"))
+# Idle connections above min_size are closed after this long, so a burst doesn't pin
+# server connections; checkouts wait at most DB_POOL_TIMEOUT_S before failing.
+DB_POOL_MAX_IDLE_S = float(os.environ.get("DB_POOL_MAX_IDLE_S", "300"))
+DB_POOL_TIMEOUT_S = float(os.environ.get("DB_POOL_TIMEOUT_S", "30"))
+# Statements executed this many times on a connection are prepared server-side, so the
+# hot quota/session/webhook queries skip parse+plan. The default 0 prepares on first use,
+# which pays off because pooled connections stay warm. Set to "off" behind a
+# transaction-mode pooler (e.g. Supabase on port 6543), which cannot hold prepared statements.
+_DB_PREPARE_THRESHOLD_RAW = os.environ.get("DB_PREPARE_THRESHOLD", "0").strip().lower()
+DB_PREPARE_THRESHOLD: int | None = (
+    None if _DB_PREPARE_THRESHOLD_RAW in {"", "off", "none"} else int(_DB_PREPARE_THRESHOLD_RAW)
+)
+# Prepared statements kept per connection (LRU). psycopg's default of 100 is below the
+# number of distinct statements the API issues, which would evict and re-prepare them.
+DB_PREPARED_MAX = int(os.environ.get("DB_PREPARED_MAX", "256"))
+# Course/topic names and topic keywords only change when content is re-seeded or
+# re-ingested (from another process), so lookups are cached per process this long.
+REFERENCE_CACHE_TTL_S = float(os.environ.get("REFERENCE_CACHE_TTL_S", "600"))
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
 _OPENAI_BASE_URL: str | None = os.environ.get("OPENAI_BASE_URL") or None
 
 _sync_pool: ConnectionPool | None = None
 _async_pool: AsyncConnectionPool | None = None
+_pool_lock = threading.Lock()
 
 _openai_kwargs: dict = {"api_key": OPENAI_API_KEY}
 if _OPENAI_BASE_URL:
@@ -28,29 +54,66 @@ if _OPENAI_BASE_URL:
 openai_client = OpenAI(**_openai_kwargs)
 
 
+def _configure_conn(conn: psycopg.Connection) -> None:
+    conn.prepared_max = DB_PREPARED_MAX
+
+
+async def _configure_async_conn(conn: psycopg.AsyncConnection) -> None:
+    conn.prepared_max = DB_PREPARED_MAX
+
+
 def _get_sync_pool() -> ConnectionPool:
     global _sync_pool
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL is required")
-    if _sync_pool is None:
-        _sync_pool = ConnectionPool(
-            conninfo=DATABASE_URL,
-            min_size=DB_POOL_MIN_SIZE,
-            max_size=DB_POOL_MAX_SIZE,
-            open=True,
-        )
-    return _sync_pool
+    pool = _sync_pool
+    if pool is None:
+        with _pool_lock:
+            if _sync_pool is None:
+                _sync_pool = ConnectionPool(
+                    conninfo=DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_idle=DB_POOL_MAX_IDLE_S,
+                    timeout=DB_POOL_TIMEOUT_S,
+                    kwargs={"prepare_threshold": DB_PREPARE_THRESHOLD},
+                    configure=_configure_conn,
+                    open=True,
+                )
+            pool = _sync_pool
+    return pool
+
+
+def _reset_pools_after_fork() -> None:
+    # A forked worker must not share the parent's sockets or pool threads; drop the
+    # references (without closing them) so the child opens its own pools on first use.
+    global _sync_pool, _async_pool, _pool_lock
+    _sync_pool = None
+    _async_pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
 
 
 async def init_async_pool() -> None:
     global _async_pool
-    _get_sync_pool()
+    if _async_pool is not None:
+        return
+    # Both pools are filled to min_size before serving, so the first requests after a
+    # deploy check out warm connections instead of paying the TCP/TLS/auth handshake.
+    await asyncio.to_thread(_get_sync_pool().wait, DB_POOL_TIMEOUT_S)
     if _async_pool is not None:
         return
     _async_pool = AsyncConnectionPool(
         conninfo=DATABASE_URL,
         min_size=DB_POOL_MIN_SIZE,
         max_size=DB_POOL_MAX_SIZE,
+        max_idle=DB_POOL_MAX_IDLE_S,
+        timeout=DB_POOL_TIMEOUT_S,
+        kwargs={"prepare_threshold": DB_PREPARE_THRESHOLD},
+        configure=_configure_async_conn,
         open=False,
     )
     await _async_pool.open(wait=True)
@@ -73,45 +136,174 @@ def get_conn() -> Iterator[psycopg.Connection]:
         yield conn
 
 
+@asynccontextmanager
+async def get_async_conn() -> AsyncIterator[psycopg.AsyncConnection]:
+    if _async_pool is None:
+        await init_async_pool()
+    assert _async_pool is not None
+    async with _async_pool.connection() as conn:
+        yield conn
+
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Inputs per embeddings request; the API accepts up to 2048.
+EMBEDDING_BATCH_SIZE = 256
+
+
+def embeddings_for(texts: list[str]) -> list[list[float]]:
+    embeddings: list[list[float]] = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        response = openai_client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts[start : start + EMBEDDING_BATCH_SIZE],
+        )
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+    return embeddings
+
+
 def embedding_for(text: str) -> list[float]:
-    response = openai_client.embeddings.create(model="text-embedding-3-small", input=text)
-    return response.data[0].embedding
+    return embeddings_for([text])[0]
 
 
-def upsert_transcript(session_id: str, transcript_items: list[dict[str, Any]]) -> None:
-    transcript_text = "\n".join(
-        [f"[{item.get('timestamp')}] {item.get('speaker')}: {item.get('text')}" for item in transcript_items]
+# Postgres renders the text lines from the JSON it is already given, so Python only
+# serialises the items once. ``doc`` is the item array being written.
+_TRANSCRIPT_TEXT_SQL = """
+COALESCE(
+  (
+    SELECT string_agg(
+      concat('[', item->>'timestamp', '] ', item->>'speaker', ': ', item->>'text'),
+      E'\\n' ORDER BY ord
     )
+    FROM jsonb_array_elements(doc) WITH ORDINALITY AS t(item, ord)
+  ),
+  ''
+)
+"""
+
+_TRANSCRIPT_ROW_SQL = f"""
+SELECT %(session_id)s::uuid, doc, {_TRANSCRIPT_TEXT_SQL}
+FROM (SELECT %(items)s AS doc) AS input
+"""
+
+_UPSERT_TRANSCRIPT_SQL = f"""
+INSERT INTO session_transcripts (session_id, transcript_json, transcript_text)
+{_TRANSCRIPT_ROW_SQL}
+ON CONFLICT (session_id)
+DO UPDATE SET transcript_json = EXCLUDED.transcript_json, transcript_text = EXCLUDED.transcript_text
+"""
+
+_APPEND_TRANSCRIPT_SQL = f"""
+INSERT INTO session_transcripts (session_id, transcript_json, transcript_text)
+{_TRANSCRIPT_ROW_SQL}
+ON CONFLICT (session_id)
+DO UPDATE SET
+  transcript_json = session_transcripts.transcript_json || EXCLUDED.transcript_json,
+  transcript_text = CASE
+    WHEN session_transcripts.transcript_text = '' THEN EXCLUDED.transcript_text
+    ELSE session_transcripts.transcript_text || E'\\n' || EXCLUDED.transcript_text
+  END
+"""
+
+
+def _transcript_params(session_id: str, items: list[dict[str, Any]]) -> dict[str, Any]:
+    # Bound as jsonb directly; orjson writes the bytes psycopg sends.
+    return {"session_id": session_id, "items": Jsonb(items, dumps=orjson.dumps)}
+
+
+def upsert_transcript(session_id: str, transcript_items: list[dict[str, Any]]) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(_UPSERT_TRANSCRIPT_SQL, _transcript_params(session_id, transcript_items))
+        conn.commit()
+
+
+def append_transcript_items(session_id: str, items: list[dict[str, Any]]) -> None:
+    """Append transcript items without rewriting the whole transcript from Python."""
+    if not items:
+        return
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(_APPEND_TRANSCRIPT_SQL, _transcript_params(session_id, items))
+        conn.commit()
+
+
+_BULK_UPSERT_TRANSCRIPTS_SQL = f"""
+INSERT INTO session_transcripts (session_id, transcript_json, transcript_text)
+SELECT session_id, doc, {_TRANSCRIPT_TEXT_SQL}
+FROM _stg_transcripts AS stg(session_id, doc)
+ON CONFLICT (session_id)
+DO UPDATE SET transcript_json = EXCLUDED.transcript_json, transcript_text = EXCLUDED.transcript_text
+"""
+
+
+def bulk_upsert_transcripts(transcripts: dict[str, list[dict[str, Any]]]) -> None:
+    """Replace many sessions' transcripts with one COPY and one upsert."""
+    if not transcripts:
+        return
 
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            """
-            INSERT INTO session_transcripts (session_id, transcript_json, transcript_text)
-            VALUES (%s, %s::jsonb, %s)
-            ON CONFLICT (session_id)
-            DO UPDATE SET transcript_json = EXCLUDED.transcript_json, transcript_text = EXCLUDED.transcript_text
-            """,
-            (session_id, json.dumps(transcript_items), transcript_text),
+            "CREATE TEMP TABLE _stg_transcripts (session_id uuid, transcript_json jsonb) ON COMMIT DROP"
         )
+        with cur.copy("COPY _stg_transcripts (session_id, transcript_json) FROM STDIN") as copy:
+            for session_id, items in transcripts.items():
+                copy.write_row((session_id, Jsonb(items, dumps=orjson.dumps)))
+        cur.execute(_BULK_UPSERT_TRANSCRIPTS_SQL)
         conn.commit()
 
 
+async def upsert_transcript_async(session_id: str, transcript_items: list[dict[str, Any]]) -> None:
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(_UPSERT_TRANSCRIPT_SQL, _transcript_params(session_id, transcript_items))
+        await conn.commit()
+
+
+async def append_transcript_items_async(session_id: str, items: list[dict[str, Any]]) -> None:
+    """Async counterpart of ``append_transcript_items`` that skips the thread-pool hop."""
+    if not items:
+        return
+
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(_APPEND_TRANSCRIPT_SQL, _transcript_params(session_id, items))
+        await conn.commit()
+
+
+_course_topic_names_cache: dict[tuple[int, int], tuple[float, tuple[str, str]]] = {}
+_topic_vocabulary_cache: dict[int, tuple[float, tuple[str, ...]]] = {}
+
+
 def get_course_topic_names(course_id: int, topic_id: int) -> tuple[str, str]:
+    key = (course_id, topic_id)
+    now = time.monotonic()
+    entry = _course_topic_names_cache.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
     with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT name FROM courses WHERE id = %s", (course_id,))
-        course = cur.fetchone()
-        cur.execute("SELECT name FROM topics WHERE id = %s", (topic_id,))
-        topic = cur.fetchone()
-    return (course[0] if course else f"course-{course_id}", topic[0] if topic else f"topic-{topic_id}")
+        cur.execute(
+            "SELECT (SELECT name FROM courses WHERE id = %s), (SELECT name FROM topics WHERE id = %s)",
+            (course_id, topic_id),
+        )
+        course_name, topic_name = cur.fetchone()
+    names = (
+        course_name if course_name is not None else f"course-{course_id}",
+        topic_name if topic_name is not None else f"topic-{topic_id}",
+    )
+    _course_topic_names_cache[key] = (now + REFERENCE_CACHE_TTL_S, names)
+    return names
 
 
-def get_topic_vocabulary(course_id: int, topic_id: int) -> list[str]:
+def get_topic_vocabulary(topic_id: int) -> list[str]:
     """Return STT hint keywords for a topic.
 
     Populated by the ingest script from the topic's ``keywords.txt`` file
     and stored in ``topics.stt_keywords``.  Returns an empty list if no
     keywords have been ingested yet.
     """
+    now = time.monotonic()
+    entry = _topic_vocabulary_cache.get(topic_id)
+    if entry is not None and entry[0] > now:
+        return list(entry[1])
+
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             "SELECT stt_keywords FROM topics WHERE id = %s",
@@ -119,15 +311,15 @@ def get_topic_vocabulary(course_id: int, topic_id: int) -> list[str]:
         )
         row = cur.fetchone()
 
-    if not row or not row[0]:
-        return []
+    keywords: tuple[str, ...] = ()
     # psycopg3 deserialises jsonb to a Python object automatically.
-    value = row[0]
+    value = row[0] if row else None
     if isinstance(value, list):
-        return [str(v) for v in value if v]
-    if isinstance(value, str):
-        return [str(v) for v in json.loads(value) if v]
-    return []
+        keywords = tuple(str(v) for v in value if v)
+    elif isinstance(value, str) and value:
+        keywords = tuple(str(v) for v in orjson.loads(value) if v)
+    _topic_vocabulary_cache[topic_id] = (now + REFERENCE_CACHE_TTL_S, keywords)
+    return list(keywords)
 
 
 def get_student_focus_context(student_id: str, enrolment_id: int | None) -> tuple[list[str], list[str]]:
@@ -137,35 +329,25 @@ def get_student_focus_context(student_id: str, enrolment_id: int | None) -> tupl
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
-            SELECT concept
-            FROM repeat_flags
-            WHERE student_id = %s AND enrolment_id = %s AND status = 'active'
-            ORDER BY flagged_at DESC
-            LIMIT 10
+            SELECT
+              ARRAY(
+                SELECT concept
+                FROM repeat_flags
+                WHERE student_id = %(student_id)s AND enrolment_id = %(enrolment_id)s AND status = 'active'
+                ORDER BY flagged_at DESC
+                LIMIT 10
+              ),
+              (
+                SELECT ARRAY(SELECT v FROM jsonb_array_elements_text(recommended_focus) AS v WHERE v <> '')
+                FROM progress_snapshots
+                WHERE student_id = %(student_id)s AND enrolment_id = %(enrolment_id)s
+                ORDER BY generated_at DESC
+                LIMIT 1
+              )
             """,
-            (student_id, enrolment_id),
+            {"student_id": student_id, "enrolment_id": enrolment_id},
         )
-        repeat_rows = cur.fetchall()
+        concepts, recommended_focus = cur.fetchone()
 
-        cur.execute(
-            """
-            SELECT recommended_focus
-            FROM progress_snapshots
-            WHERE student_id = %s AND enrolment_id = %s
-            ORDER BY generated_at DESC
-            LIMIT 1
-            """,
-            (student_id, enrolment_id),
-        )
-        snapshot_row = cur.fetchone()
-
-    repeats = [str(row[0]) for row in repeat_rows if row and row[0]]
-    focus: list[str] = []
-    if snapshot_row and snapshot_row[0]:
-        value = snapshot_row[0]
-        if isinstance(value, list):
-            focus = [str(v) for v in value if v]
-        elif isinstance(value, str):
-            focus = [str(v) for v in json.loads(value) if v]
-
-    return (repeats, focus)
+    repeats = [str(concept) for concept in concepts or [] if concept]
+    return (repeats, recommended_focus or [])
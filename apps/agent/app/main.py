@@ -1,31 +1,48 @@
 from __future__ import annotations
 
 import asyncio
+import base64
 import csv
 import datetime
+import functools
+import hashlib
+import hmac
 import io
-import json
 import os
-import random
 import re
+import secrets
+import threading
+import time
+import traceback
 import uuid
-from urllib import error as urllib_error
-from urllib import request as urllib_request
-from typing import Any
+from collections import OrderedDict
+from urllib import parse as urllib_parse
+from typing import Annotated, Any, AsyncIterator, Callable
 
+import httpx
+import orjson
 from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from livekit import api as lk_api
-from livekit.api import AccessToken, VideoGrants
 from livekit.protocol import room as proto_room
-from pydantic import BaseModel
-
-from .agent_worker import run_agent_session
-from .billing import check_subscription_quota, consume_quota_minutes, router as billing_router
-from .db import close_async_pool, get_conn, init_async_pool
+from openai import AsyncOpenAI
+from psycopg.types.json import Jsonb
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
+
+from .agent_worker import close_http_session, run_agent_session
+from .billing import (
+    check_subscription_quota,
+    close_supabase_http,
+    consume_quota_minutes,
+    get_user_id_from_bearer,
+    resume_pending_stripe_events,
+    router as billing_router,
+)
+from .db import REFERENCE_CACHE_TTL_S, close_async_pool, get_async_conn, get_conn, init_async_pool
 
-app = FastAPI(title="Director of Studies Agent")
+app = FastAPI(title="Director of Studies Agent", default_response_class=ORJSONResponse)
 app.include_router(billing_router)
 
 WEB_ORIGIN = os.environ.get("WEB_ORIGIN", "http://localhost:3000")
@@ -36,16 +53,26 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Session/calendar/reference lists are repetitive JSON; small bodies aren't worth compressing.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 
 @app.on_event("startup")
 async def _startup_db() -> None:
     await init_async_pool()
+    await resume_pending_stripe_events()
 
 
 @app.on_event("shutdown")
 async def _shutdown_db() -> None:
     await close_async_pool()
+    await close_http_session()
+    await close_supabase_http()
+    await _close_livekit_api()
+    if _openai.cache_info().currsize:
+        await _openai().close()
+        _openai.cache_clear()
+    _close_supabase_admin_http()
 
 LIVEKIT_API_KEY = os.environ.get("LIVEKIT_API_KEY", "")
 LIVEKIT_API_SECRET = os.environ.get("LIVEKIT_API_SECRET", "")
@@ -230,14 +257,22 @@ class ProgressPayload(BaseModel):
     repeat: list[RepeatPayload]
 
 
+# Waitlist signup is unauthenticated, so field lengths are bounded during validation
+# and oversized payloads are rejected before the handler runs.
+EMAIL_MAX_LENGTH = 254
+_WaitlistText = Annotated[str, StringConstraints(max_length=200)]
+
+
 class WaitlistSignupRequest(BaseModel):
-    email: str
-    name: str | None = None
-    role: str | None = None
-    school: str | None = None
-    schoolYear: str | None = None
-    subjectInterests: list[str] | None = None
-    examBoard: str | None = None
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    email: Annotated[str, StringConstraints(max_length=EMAIL_MAX_LENGTH)]
+    name: _WaitlistText | None = None
+    role: _WaitlistText | None = None
+    school: _WaitlistText | None = None
+    schoolYear: _WaitlistText | None = None
+    subjectInterests: Annotated[list[_WaitlistText], Field(max_length=50)] | None = None
+    examBoard: _WaitlistText | None = None
 
 
 class WaitlistStatusUpdateRequest(BaseModel):
@@ -247,24 +282,49 @@ class WaitlistStatusUpdateRequest(BaseModel):
 SUMMARY_OPENAI_MODEL = os.environ.get("SUMMARY_OPENAI_MODEL", "gpt-4o")
 WAITLIST_ALLOWED_ROLES = {"student", "parent"}
 WAITLIST_ALLOWED_STATUSES = {"pending", "invited"}
-EMAIL_REGEX = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+# local@domain with possessive runs, so matching is a single linear pass even on hostile
+# input; the "domain has an inner dot" rule is checked on the captured group instead.
+EMAIL_REGEX = re.compile(r"[^@\s]++@([^@\s]++)")
+# List endpoints stream one JSON object per line when the client asks for this type.
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+# LiveKit access tokens are plain HS256 JWTs; signing them directly skips the SDK's
+# grant dataclasses, and the keyed HMAC state is built once and copied per token.
+_LIVEKIT_TOKEN_TTL_S = 6 * 60 * 60
+_LIVEKIT_JWT_HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+_livekit_hmac = hmac.new(LIVEKIT_API_SECRET.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+def _sign_livekit_token(identity: str, video: dict[str, Any]) -> str:
+    now = int(time.time())
+    claims = {
+        "name": identity,
+        "video": video,
+        "sub": identity,
+        "iss": LIVEKIT_API_KEY,
+        "nbf": now,
+        "exp": now + _LIVEKIT_TOKEN_TTL_S,
+    }
+    payload = base64.urlsafe_b64encode(orjson.dumps(claims)).rstrip(b"=")
+    signing_input = _LIVEKIT_JWT_HEADER + b"." + payload
+    mac = _livekit_hmac.copy()
+    mac.update(signing_input)
+    return (signing_input + b"." + base64.urlsafe_b64encode(mac.digest()).rstrip(b"=")).decode("ascii")
 
 
 def build_agent_token(room_name: str, identity: str = "TutorBot") -> str:
-    token = AccessToken(api_key=LIVEKIT_API_KEY, api_secret=LIVEKIT_API_SECRET)
-    token.identity = identity
-    token.name = identity
-    token.with_grants(
-        VideoGrants(
-            room_join=True,
-            room=room_name,
-            can_publish=True,
-            can_subscribe=True,
-            can_publish_data=True,
-            can_update_own_metadata=True,
-        )
+    return _sign_livekit_token(
+        identity,
+        {
+            "roomJoin": True,
+            "room": room_name,
+            "canPublish": True,
+            "canSubscribe": True,
+            "canPublishData": True,
+            "canUpdateOwnMetadata": True,
+        },
     )
-    return token.to_jwt()
 
 
 def _validate_agent_runtime_config() -> list[str]:
@@ -273,42 +333,14 @@ def _validate_agent_runtime_config() -> list[str]:
 
 
 def _on_agent_task_done(task: asyncio.Task[None]) -> None:
-    try:
-        task.result()
-    except Exception:
-        import traceback
-
-        traceback.print_exc()
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        traceback.print_exception(exc)
 
 
-def _get_user_id_from_bearer(authorization: str | None) -> str:
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    if not SUPABASE_URL or not SUPABASE_PUBLISHABLE_KEY:
-        raise HTTPException(status_code=500, detail="Supabase auth config missing")
-
-    token = authorization.replace("Bearer ", "", 1).strip()
-    req = urllib_request.Request(
-        f"{SUPABASE_URL}/auth/v1/user",
-        method="GET",
-        headers={
-            "apikey": SUPABASE_PUBLISHABLE_KEY,
-            "Authorization": f"Bearer {token}",
-        },
-    )
-
-    try:
-        with urllib_request.urlopen(req, timeout=20) as response:
-            payload = json.loads(response.read().decode("utf-8"))
-            user_id = payload.get("id")
-            if not user_id:
-                raise HTTPException(status_code=401, detail="Unauthorized")
-            return str(user_id)
-    except urllib_error.HTTPError as exc:
-        raise HTTPException(status_code=401, detail="Unauthorized") from exc
-
-
-def _validate_internal_api_key(
+async def _validate_internal_api_key(
     x_internal_api_key: str | None,
     authorization: str | None = None,
     expected_user_id: str | None = None,
@@ -316,69 +348,96 @@ def _validate_internal_api_key(
     if AGENT_INTERNAL_API_KEY and x_internal_api_key == AGENT_INTERNAL_API_KEY:
         return expected_user_id
 
-    user_id = _get_user_id_from_bearer(authorization)
+    user_id = await get_user_id_from_bearer(authorization)
     if expected_user_id and user_id != expected_user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
     return user_id
 
 
+# One LiveKit API client per process so room calls reuse its HTTP connection pool.
+# Created lazily so it binds to the server's event loop.
+_livekit_api: lk_api.LiveKitAPI | None = None
+
+
+def _get_livekit_api() -> lk_api.LiveKitAPI:
+    global _livekit_api
+    if _livekit_api is None:
+        _livekit_api = lk_api.LiveKitAPI()
+    return _livekit_api
+
+
+async def _close_livekit_api() -> None:
+    global _livekit_api
+    if _livekit_api is not None:
+        await _livekit_api.aclose()
+        _livekit_api = None
+
+
 async def _ensure_room(room_name: str) -> None:
-    async with lk_api.LiveKitAPI() as livekit_api:
-        try:
-            await livekit_api.room.create_room(proto_room.CreateRoomRequest(name=room_name))
-            return
-        except Exception:
-            pass
+    livekit_api = _get_livekit_api()
+    try:
+        await livekit_api.room.create_room(proto_room.CreateRoomRequest(name=room_name))
+        return
+    except Exception:
+        pass
 
-        rooms = await livekit_api.room.list_rooms(proto_room.ListRoomsRequest(names=[room_name]))
-        if not any(room.name == room_name for room in rooms.rooms):
-            raise HTTPException(status_code=500, detail="Failed to ensure room")
+    rooms = await livekit_api.room.list_rooms(proto_room.ListRoomsRequest(names=[room_name]))
+    if not any(room.name == room_name for room in rooms.rooms):
+        raise HTTPException(status_code=500, detail="Failed to ensure room")
 
 
 def _build_participant_token(room_name: str, identity: str) -> str:
-    token = AccessToken(api_key=LIVEKIT_API_KEY, api_secret=LIVEKIT_API_SECRET)
-    token.identity = identity
-    token.name = identity
-    token.with_grants(
-        VideoGrants(
-            room_join=True,
-            room=room_name,
-            can_publish=True,
-            can_subscribe=True,
-            can_publish_data=True,
-        )
+    return _sign_livekit_token(
+        identity,
+        {
+            "roomJoin": True,
+            "room": room_name,
+            "canPublish": True,
+            "canSubscribe": True,
+            "canPublishData": True,
+        },
     )
-    return token.to_jwt()
 
 
-def _is_now_blocked(blocked_times: Any) -> bool:
+def _minute_of_day(value: Any) -> int | None:
+    hours, _, minutes = str(value or "00:00").partition(":")
+    try:
+        return int(hours) * 60 + int(minutes or 0)
+    except ValueError:
+        return None
+
+
+def _is_now_blocked(blocked_times: Any, now: datetime.datetime) -> bool:
     if not isinstance(blocked_times, list):
         return False
 
-    now = datetime.datetime.now()
     day_of_week = (now.weekday() + 1) % 7
-    current_time = now.strftime("%H:%M")
+    current_minute = now.hour * 60 + now.minute
 
     for blocked in blocked_times:
-        if not isinstance(blocked, dict):
+        if not isinstance(blocked, dict) or blocked.get("dayOfWeek") is None:
+            continue
+        if int(blocked["dayOfWeek"]) != day_of_week:
             continue
-        blocked_day = int(blocked.get("dayOfWeek") or -1)
-        start_time = str(blocked.get("startTime") or "00:00")
-        end_time = str(blocked.get("endTime") or "00:00")
-        if blocked_day == day_of_week and start_time <= current_time <= end_time:
+        start_minute = _minute_of_day(blocked.get("startTime"))
+        end_minute = _minute_of_day(blocked.get("endTime"))
+        if start_minute is not None and end_minute is not None and start_minute <= current_minute <= end_minute:
             return True
     return False
 
 
-def _load_tutor_runtime_context(
+async def _load_tutor_runtime_context(
     student_id: str,
     enrolment_id: int | None,
 ) -> tuple[dict[str, Any] | None, list[dict[str, Any]], list[str]]:
     if not enrolment_id:
         return None, [], []
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+    params = (student_id, enrolment_id)
+    # The three lookups are independent; pipeline mode sends them together and reads
+    # the results back in a single round trip.
+    async with get_async_conn() as conn, conn.pipeline():
+        tutor_cur = await conn.execute(
             """
             SELECT tp.name, tp.personality_prompt, tp.tts_voice_model, tp.tts_speed
             FROM tutor_configs tc
@@ -386,31 +445,29 @@ def _load_tutor_runtime_context(
             WHERE tc.student_id = %s AND tc.enrolment_id = %s
             LIMIT 1
             """,
-            (student_id, enrolment_id),
+            params,
         )
-        tutor_row = cur.fetchone()
-
-        cur.execute(
+        repeat_cur = await conn.execute(
             """
             SELECT concept, reason, priority
             FROM repeat_flags
             WHERE student_id = %s AND enrolment_id = %s AND status = 'active'
             """,
-            (student_id, enrolment_id),
+            params,
         )
-        repeat_rows = cur.fetchall()
-
-        cur.execute(
+        focus_cur = await conn.execute(
             """
-            SELECT recommended_focus
+            SELECT ARRAY(SELECT v FROM jsonb_array_elements_text(recommended_focus) AS v WHERE v <> '')
             FROM progress_snapshots
             WHERE student_id = %s AND enrolment_id = %s
             ORDER BY generated_at DESC
             LIMIT 1
             """,
-            (student_id, enrolment_id),
+            params,
         )
-        focus_row = cur.fetchone()
+        tutor_row = await tutor_cur.fetchone()
+        repeat_rows = await repeat_cur.fetchall()
+        focus_row = await focus_cur.fetchone()
 
     tutor_config = None
     if tutor_row:
@@ -431,13 +488,7 @@ def _load_tutor_runtime_context(
         if row and row[0] and row[1] and row[2]
     ]
 
-    recommended_focus: list[str] = []
-    if focus_row and focus_row[0]:
-        value = focus_row[0]
-        if isinstance(value, list):
-            recommended_focus = [str(v) for v in value if v]
-        elif isinstance(value, str):
-            recommended_focus = [str(v) for v in json.loads(value) if v]
+    recommended_focus: list[str] = focus_row[0] if focus_row else []
 
     return tutor_config, repeat_flags, recommended_focus
 
@@ -476,113 +527,137 @@ async def _start_agent_join(payload: JoinRequest) -> None:
     task.add_done_callback(_on_agent_task_done)
 
 
-def _create_session_sync(course_id: int, topic_id: int, student_id: str) -> SessionCreateResponse:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT subject_id, exam_board_id FROM courses WHERE id = %s", (course_id,))
-        course_row = cur.fetchone()
-
-        cur.execute("SELECT id FROM topics WHERE id = %s AND course_id = %s", (topic_id, course_id))
-        topic_row = cur.fetchone()
+_SESSION_GATES_SQL = """
+SELECT
+  c.id IS NOT NULL,
+  c.subject_id,
+  EXISTS (SELECT 1 FROM topics WHERE id = %(topic_id)s AND course_id = %(course_id)s),
+  (
+    SELECT jsonb_agg(jsonb_build_array(r.max_daily_minutes, r.max_weekly_minutes, r.blocked_times))
+    FROM restrictions r
+    WHERE r.student_id = %(student_id)s
+  ),
+  dur.daily_minutes,
+  dur.weekly_minutes,
+  p.id IS NOT NULL,
+  p.terms_accepted_at,
+  p.deleted_at,
+  st.date_of_birth > CURRENT_DATE - interval '13 years',
+  st.consent_granted_at,
+  (
+    SELECT se.id
+    FROM student_enrolments se
+    INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
+    WHERE se.student_id = %(student_id)s
+      AND bs.subject_id = c.subject_id
+      AND (bs.exam_board_id IS NULL OR bs.exam_board_id = c.exam_board_id)
+    ORDER BY bs.exam_board_id IS NULL, se.id
+    LIMIT 1
+  )
+FROM (
+  SELECT
+    COALESCE(SUM(duration_seconds) FILTER (WHERE started_at >= %(day_start)s), 0) / 60.0 AS daily_minutes,
+    COALESCE(SUM(duration_seconds), 0) / 60.0 AS weekly_minutes
+  FROM sessions
+  WHERE student_id = %(student_id)s AND status = 'summarized' AND started_at >= %(week_start)s
+) AS dur
+LEFT JOIN courses c ON c.id = %(course_id)s
+LEFT JOIN profiles p ON p.id = %(student_id)s
+LEFT JOIN students st ON st.id = %(student_id)s
+"""
+
+
+def _uuid7() -> uuid.UUID:
+    """Time-ordered UUIDv7 (RFC 9562): 48-bit Unix ms timestamp followed by random bits.
+
+    New session ids sort after existing ones, so sessions_pkey inserts land on the
+    rightmost B-tree leaf instead of splitting random pages.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value)
 
-        if not course_row or not topic_row:
-            raise HTTPException(status_code=400, detail="Invalid course/topic")
 
-        cur.execute(
-            """
-            SELECT max_daily_minutes, max_weekly_minutes, blocked_times
-            FROM restrictions
-            WHERE student_id = %s
-            """,
-            (student_id,),
-        )
-        restriction_rows = cur.fetchall()
-
-        now = datetime.datetime.now()
-        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        week_start = now - datetime.timedelta(days=7)
+async def _create_session(course_id: int, topic_id: int, student_id: str) -> SessionCreateResponse:
+    now = datetime.datetime.now()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week_start = now - datetime.timedelta(days=7)
 
-        cur.execute(
-            """
-            SELECT
-              COALESCE(SUM(CASE WHEN started_at >= %s THEN EXTRACT(EPOCH FROM (ended_at - started_at)) / 60 ELSE 0 END), 0),
-              COALESCE(SUM(CASE WHEN started_at >= %s THEN EXTRACT(EPOCH FROM (ended_at - started_at)) / 60 ELSE 0 END), 0)
-            FROM sessions
-            WHERE student_id = %s AND status = 'summarized' AND started_at >= %s
-            """,
-            (day_start, week_start, student_id, week_start),
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        # Every gate below is answered by this one round trip.
+        await cur.execute(
+            _SESSION_GATES_SQL,
+            {
+                "course_id": course_id,
+                "topic_id": topic_id,
+                "student_id": student_id,
+                "day_start": day_start,
+                "week_start": week_start,
+            },
         )
-        durations = cur.fetchone() or (0, 0)
-        total_daily_minutes = float(durations[0] or 0)
-        total_weekly_minutes = float(durations[1] or 0)
+        (
+            course_exists,
+            subject_id,
+            topic_exists,
+            restriction_rows,
+            total_daily_minutes,
+            total_weekly_minutes,
+            profile_exists,
+            terms_accepted_at,
+            deleted_at,
+            is_minor,
+            consent_granted_at,
+            matched_enrolment_id,
+        ) = await cur.fetchone()
+
+        if not course_exists or not topic_exists:
+            raise HTTPException(status_code=400, detail="Invalid course/topic")
 
-        for max_daily_minutes, max_weekly_minutes, blocked_times in restriction_rows:
+        total_daily_minutes = float(total_daily_minutes or 0)
+        total_weekly_minutes = float(total_weekly_minutes or 0)
+        for max_daily_minutes, max_weekly_minutes, blocked_times in restriction_rows or []:
             if max_daily_minutes is not None and total_daily_minutes >= float(max_daily_minutes):
                 raise HTTPException(status_code=403, detail="Daily tutorial limit reached by parent/guardian restrictions")
             if max_weekly_minutes is not None and total_weekly_minutes >= float(max_weekly_minutes):
                 raise HTTPException(status_code=403, detail="Weekly tutorial limit reached by parent/guardian restrictions")
-            if _is_now_blocked(blocked_times):
+            if _is_now_blocked(blocked_times, now):
                 raise HTTPException(status_code=403, detail="Tutorials are blocked at this time by parent/guardian restrictions")
 
-        quota = check_subscription_quota(student_id)
+        quota = await asyncio.to_thread(check_subscription_quota, student_id)
         if not quota.allowed:
             raise HTTPException(status_code=402, detail=quota.reason or "Subscription quota exceeded")
 
         # ToS gate — guests (terms_accepted_at auto-set) and normal users must have accepted
-        cur.execute("SELECT terms_accepted_at, deleted_at FROM profiles WHERE id = %s", (student_id,))
-        tos_row = cur.fetchone()
-        if tos_row and tos_row[1] is not None:
+        if profile_exists and deleted_at is not None:
             raise HTTPException(status_code=403, detail="account_deleted")
-        if tos_row and tos_row[0] is None:
+        if profile_exists and terms_accepted_at is None:
             raise HTTPException(status_code=403, detail="terms_not_accepted")
 
         # Parental consent gate — students under 13 must have consent_granted_at set
-        cur.execute("SELECT date_of_birth, consent_granted_at FROM students WHERE id = %s", (student_id,))
-        consent_row = cur.fetchone()
-        if consent_row:
-            dob = consent_row[0]
-            today = datetime.date.today()
-            age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
-            if age < 13 and consent_row[1] is None:
-                raise HTTPException(status_code=403, detail="consent_required")
-
-        subject_id = course_row[0]
-        exam_board_id = course_row[1]
-        enrolment_id: int | None = None
+        if is_minor and consent_granted_at is None:
+            raise HTTPException(status_code=403, detail="consent_required")
 
+        enrolment_id: int | None = None
         if subject_id is not None:
-            cur.execute(
-                """
-                SELECT se.id, bs.exam_board_id
-                FROM student_enrolments se
-                INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
-                WHERE se.student_id = %s
-                """,
-                (student_id,),
-            )
-            enrolments = cur.fetchall()
-
-            for row in enrolments:
-                if exam_board_id is None or row[1] == exam_board_id:
-                    enrolment_id = int(row[0])
-                    break
-
-            if enrolment_id is None:
+            if matched_enrolment_id is None:
                 raise HTTPException(status_code=403, detail="You are not enrolled in this subject/exam board")
+            enrolment_id = int(matched_enrolment_id)
 
-        session_id = str(uuid.uuid4())
+        session_id = str(_uuid7())
         room_name = f"dos-{session_id}"
         participant_token = _build_participant_token(room_name, student_id)
 
-        asyncio.run(_ensure_room(room_name))
+        await _ensure_room(room_name)
 
-        cur.execute(
+        await cur.execute(
             """
             INSERT INTO sessions (id, student_id, enrolment_id, course_id, topic_id, room_name, participant_token, status)
             VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending')
             """,
             (session_id, student_id, enrolment_id, course_id, topic_id, room_name, participant_token),
         )
-        conn.commit()
+        await conn.commit()
 
     return SessionCreateResponse(sessionId=session_id, roomName=room_name, participantToken=participant_token)
 
@@ -603,9 +678,10 @@ def _get_session_by_id_and_student_sync(session_id: str, student_id: str) -> tup
         return str(row[0]), int(row[1]), int(row[2]), int(row[3]) if row[3] is not None else None
 
 
-def _list_sessions_sync(student_id: str) -> list[SessionListItem]:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+async def _iter_sessions(student_id: str) -> AsyncIterator[SessionListItem]:
+    # cursor.stream() yields rows as they arrive instead of buffering the full history.
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        async for row in cur.stream(
             """
             SELECT
               s.id,
@@ -623,27 +699,22 @@ def _list_sessions_sync(student_id: str) -> list[SessionListItem]:
             ORDER BY s.created_at DESC
             """,
             (student_id,),
-        )
-        rows = cur.fetchall()
-
-    return [
-        SessionListItem(
-            id=str(row[0]),
-            status=str(row[1]),
-            roomName=str(row[2]),
-            createdAt=row[3],
-            startedAt=row[4],
-            endedAt=row[5],
-            courseName=str(row[6]),
-            topicName=str(row[7]),
-        )
-        for row in rows
-    ]
+        ):
+            yield SessionListItem(
+                id=str(row[0]),
+                status=str(row[1]),
+                roomName=str(row[2]),
+                createdAt=row[3],
+                startedAt=row[4],
+                endedAt=row[5],
+                courseName=str(row[6]),
+                topicName=str(row[7]),
+            )
 
 
-def _get_session_detail_sync(session_id: str, student_id: str) -> SessionDetail | None:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+async def _get_session_detail(session_id: str, student_id: str) -> SessionDetail | None:
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(
             """
             SELECT
               s.id,
@@ -672,7 +743,7 @@ def _get_session_detail_sync(session_id: str, student_id: str) -> SessionDetail
             """,
             (session_id, student_id),
         )
-        row = cur.fetchone()
+        row = await cur.fetchone()
 
     if not row:
         return None
@@ -697,7 +768,7 @@ def _get_session_detail_sync(session_id: str, student_id: str) -> SessionDetail
     )
 
 
-def _calendar_list_sync(student_id: str, from_iso: str | None, to_iso: str | None) -> list[dict[str, Any]]:
+async def _iter_calendar(student_id: str, from_iso: str | None, to_iso: str | None) -> AsyncIterator[dict[str, Any]]:
     clauses = ["student_id = %s"]
     args: list[Any] = [student_id]
     if from_iso:
@@ -716,35 +787,41 @@ def _calendar_list_sync(student_id: str, from_iso: str | None, to_iso: str | Non
         ORDER BY scheduled_at ASC
     """
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(query, tuple(args))
-        rows = cur.fetchall()
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        async for r in cur.stream(query, tuple(args)):
+            yield {
+                "id": str(r[0]),
+                "studentId": str(r[1]),
+                "enrolmentId": r[2],
+                "topicId": r[3],
+                "title": r[4],
+                "scheduledAt": r[5],
+                "durationMinutes": r[6],
+                "recurrenceRule": r[7],
+                "status": r[8],
+                "sessionId": str(r[9]) if r[9] else None,
+                "createdBy": str(r[10]),
+                "syncProvider": r[11],
+                "externalCalendarId": r[12],
+                "createdAt": r[13],
+                "updatedAt": r[14],
+            }
 
-    return [
-        {
-            "id": str(r[0]),
-            "studentId": str(r[1]),
-            "enrolmentId": r[2],
-            "topicId": r[3],
-            "title": r[4],
-            "scheduledAt": r[5],
-            "durationMinutes": r[6],
-            "recurrenceRule": r[7],
-            "status": r[8],
-            "sessionId": str(r[9]) if r[9] else None,
-            "createdBy": str(r[10]),
-            "syncProvider": r[11],
-            "externalCalendarId": r[12],
-            "createdAt": r[13],
-            "updatedAt": r[14],
-        }
-        for r in rows
-    ]
 
+def _wants_ndjson(accept: str | None) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
 
-def _calendar_create_sync(payload: CalendarCreateRequest) -> str:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+
+async def _ndjson_lines(items: AsyncIterator[Any]) -> AsyncIterator[bytes]:
+    async for item in items:
+        if isinstance(item, BaseModel):
+            item = item.model_dump()
+        yield orjson.dumps(item) + b"\n"
+
+
+async def _calendar_create(payload: CalendarCreateRequest) -> str:
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(
             """
             INSERT INTO scheduled_tutorials (
               student_id, enrolment_id, topic_id, title, scheduled_at,
@@ -763,48 +840,50 @@ def _calendar_create_sync(payload: CalendarCreateRequest) -> str:
                 payload.createdBy,
             ),
         )
-        row = cur.fetchone()
-        conn.commit()
+        row = await cur.fetchone()
+        await conn.commit()
     return str(row[0])
 
 
-def _calendar_update_sync(tutorial_id: str, payload: CalendarUpdateRequest) -> None:
-    fields: list[str] = []
-    values: list[Any] = []
-    if payload.title is not None:
-        fields.append("title = %s")
-        values.append(payload.title)
-    if payload.scheduledAt is not None:
-        fields.append("scheduled_at = %s")
-        values.append(datetime.datetime.fromisoformat(payload.scheduledAt))
-    if payload.durationMinutes is not None:
-        fields.append("duration_minutes = %s")
-        values.append(payload.durationMinutes)
-    if payload.status is not None:
-        fields.append("status = %s")
-        values.append(payload.status)
-    if payload.recurrenceRule is not None:
-        fields.append("recurrence_rule = %s")
-        values.append(payload.recurrenceRule)
-
-    fields.append("updated_at = NOW()")
-    values.extend([tutorial_id, payload.studentId])
-
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            f"UPDATE scheduled_tutorials SET {', '.join(fields)} WHERE id = %s AND student_id = %s",
-            tuple(values),
+async def _calendar_update(tutorial_id: str, payload: CalendarUpdateRequest) -> None:
+    scheduled_at = datetime.datetime.fromisoformat(payload.scheduledAt) if payload.scheduledAt is not None else None
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        # Fixed statement text so it stays prepared; unset fields bind NULL and keep their value.
+        await cur.execute(
+            """
+            UPDATE scheduled_tutorials
+            SET title = COALESCE(%(title)s, title),
+                scheduled_at = COALESCE(%(scheduled_at)s, scheduled_at),
+                duration_minutes = COALESCE(%(duration_minutes)s, duration_minutes),
+                status = COALESCE(%(status)s, status),
+                recurrence_rule = COALESCE(%(recurrence_rule)s, recurrence_rule),
+                updated_at = NOW()
+            WHERE id = %(id)s AND student_id = %(student_id)s
+            """,
+            {
+                "title": payload.title,
+                "scheduled_at": scheduled_at,
+                "duration_minutes": payload.durationMinutes,
+                "status": payload.status,
+                "recurrence_rule": payload.recurrenceRule,
+                "id": tutorial_id,
+                "student_id": payload.studentId,
+            },
         )
-        conn.commit()
+        await conn.commit()
 
 
-def _calendar_delete_sync(tutorial_id: str, student_id: str) -> None:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+async def _calendar_delete(tutorial_id: str, student_id: str) -> None:
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(
             "DELETE FROM scheduled_tutorials WHERE id = %s AND student_id = %s",
             (tutorial_id, student_id),
         )
-        conn.commit()
+        await conn.commit()
+
+
+# (expires_at, serialized response body); board/subject reference data only changes on re-seed.
+_reference_board_subjects_cache: tuple[float, bytes] | None = None
 
 
 def _reference_board_subjects_sync() -> list[dict[str, Any]]:
@@ -892,9 +971,12 @@ def _student_enrolment_delete_sync(payload: StudentEnrolmentDeleteRequest) -> No
         conn.commit()
 
 
+# 32 symbols, so masking a random byte to 5 bits picks each one uniformly.
+_INVITE_CODE_ALPHABET = b"ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+
 def _generate_code(length: int = 6) -> str:
-    chars = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-    return "".join(random.choice(chars) for _ in range(length))
+    return bytes(_INVITE_CODE_ALPHABET[b & 0x1F] for b in secrets.token_bytes(length)).decode("ascii")
 
 
 def _student_invite_code_sync(student_id: str) -> dict[str, Any]:
@@ -924,6 +1006,39 @@ def _student_invite_code_sync(student_id: str) -> dict[str, Any]:
         return {"code": code, "expiresAt": expires_at}
 
 
+# Persona and tutor-config lists are re-read on most page loads. The persona, tutor-config and
+# enrolment endpoints drop the student's entries when they write; the TTL bounds staleness
+# across workers and for other writers such as the demo login's first enrolment.
+TUTOR_LIST_CACHE_TTL_S = float(os.environ.get("TUTOR_LIST_CACHE_TTL_S", "30"))
+_TUTOR_LIST_CACHE_MAX_ENTRIES = 1024
+# (list name, student_id) -> (expires_at, rows); only touched from the event loop.
+_tutor_list_cache: OrderedDict[tuple[str, str], tuple[float, list[dict[str, Any]]]] = OrderedDict()
+
+
+async def _cached_tutor_list(
+    kind: str, student_id: str, loader: Callable[[str], list[dict[str, Any]]]
+) -> list[dict[str, Any]]:
+    key = (kind, student_id)
+    entry = _tutor_list_cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        _tutor_list_cache.move_to_end(key)
+        return entry[1]
+
+    rows = await asyncio.to_thread(loader, student_id)
+    _tutor_list_cache[key] = (time.monotonic() + TUTOR_LIST_CACHE_TTL_S, rows)
+    _tutor_list_cache.move_to_end(key)
+    while len(_tutor_list_cache) > _TUTOR_LIST_CACHE_MAX_ENTRIES:
+        _tutor_list_cache.popitem(last=False)
+    return rows
+
+
+def _invalidate_tutor_lists(student_id: str) -> None:
+    # The config list has one row per enrolment and shows persona names, so persona and
+    # enrolment changes both invalidate it.
+    _tutor_list_cache.pop(("personas", student_id), None)
+    _tutor_list_cache.pop(("config", student_id), None)
+
+
 def _tutor_personas_list_sync(student_id: str) -> list[dict[str, Any]]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
@@ -1123,45 +1238,38 @@ def _parent_link_code_sync(payload: ParentLinkCodeRequest) -> str:
         raise HTTPException(status_code=400, detail="Invite code is required")
 
     with get_conn() as conn, conn.cursor() as cur:
+        # Consuming the code, linking and granting consent for under-13s happen in one statement,
+        # so a code can only ever be redeemed once even under concurrent requests.
         cur.execute(
             """
-            SELECT id, student_id
-            FROM student_invite_codes
-            WHERE code = %s AND used_at IS NULL AND expires_at > NOW()
-            LIMIT 1
+            WITH inv AS (
+              UPDATE student_invite_codes
+              SET used_at = NOW()
+              WHERE code = %(code)s AND used_at IS NULL AND expires_at > NOW()
+              RETURNING student_id
+            ),
+            link AS (
+              INSERT INTO parent_student_links (parent_id, student_id, relationship)
+              SELECT %(parent_id)s, student_id, %(relationship)s FROM inv
+              ON CONFLICT (parent_id, student_id) DO NOTHING
+            ),
+            consent AS (
+              UPDATE students
+              SET consent_granted_at = NOW(), consent_granted_by_parent_id = %(parent_id)s
+              WHERE id IN (SELECT student_id FROM inv)
+                AND consent_granted_at IS NULL
+                AND date_of_birth > CURRENT_DATE - interval '13 years'
+            )
+            SELECT student_id FROM inv
             """,
-            (code,),
+            {"code": code, "parent_id": payload.parentId, "relationship": payload.relationship or "guardian"},
         )
         invite = cur.fetchone()
         if not invite:
             raise HTTPException(status_code=404, detail="Invalid or expired invite code")
 
-        cur.execute(
-            """
-            INSERT INTO parent_student_links (parent_id, student_id, relationship)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (parent_id, student_id) DO NOTHING
-            """,
-            (payload.parentId, invite[1], payload.relationship or "guardian"),
-        )
-        cur.execute("UPDATE student_invite_codes SET used_at = NOW() WHERE id = %s", (invite[0],))
-
-        # Grant parental consent for minors (under 13) when a parent links
-        student_id = str(invite[1])
-        cur.execute("SELECT date_of_birth FROM students WHERE id = %s", (student_id,))
-        student_row = cur.fetchone()
-        if student_row:
-            dob = student_row[0]
-            today = datetime.date.today()
-            age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
-            if age < 13:
-                cur.execute(
-                    "UPDATE students SET consent_granted_at = NOW(), consent_granted_by_parent_id = %s WHERE id = %s AND consent_granted_at IS NULL",
-                    (payload.parentId, student_id),
-                )
-
         conn.commit()
-        return student_id
+        return str(invite[0])
 
 
 def _parent_restrictions_get_sync(parent_id: str, student_id: str) -> dict[str, Any] | None:
@@ -1222,113 +1330,129 @@ def _parent_restrictions_upsert_sync(payload: ParentRestrictionsUpsertRequest) -
                 payload.studentId,
                 payload.maxDailyMinutes,
                 payload.maxWeeklyMinutes,
-                json.dumps(payload.blockedTimes or []),
+                Jsonb(payload.blockedTimes or [], dumps=orjson.dumps),
             ),
         )
 
-        mandatory = payload.mandatoryRevision or []
-        for item in mandatory:
+        enrolment_ids: list[int] = []
+        concepts: list[str] = []
+        reasons: list[str] = []
+        for item in payload.mandatoryRevision or []:
             concept = str(item.get("concept") or "").strip()
             reason = str(item.get("reason") or "").strip()
             enrolment_id = int(item.get("enrolmentId") or 0)
             if not concept or not reason or enrolment_id <= 0:
                 continue
+            enrolment_ids.append(enrolment_id)
+            concepts.append(concept)
+            reasons.append(reason)
 
-            cur.execute(
-                "SELECT id FROM student_enrolments WHERE id = %s AND student_id = %s",
-                (enrolment_id, payload.studentId),
-            )
-            if not cur.fetchone():
-                continue
-
+        if enrolment_ids:
+            # One statement for all items; the join drops enrolments that aren't this student's.
             cur.execute(
                 """
                 INSERT INTO repeat_flags (student_id, enrolment_id, concept, reason, priority, status, parent_assigned)
-                VALUES (%s, %s, %s, %s, 'high', 'active', 1)
+                SELECT se.student_id, se.id, v.concept, v.reason, 'high', 'active', 1
+                FROM unnest(%s::int[], %s::text[], %s::text[]) WITH ORDINALITY AS v(enrolment_id, concept, reason, ord)
+                INNER JOIN student_enrolments se ON se.id = v.enrolment_id AND se.student_id = %s
+                ORDER BY v.ord
                 """,
-                (payload.studentId, enrolment_id, concept, reason),
+                (enrolment_ids, concepts, reasons, payload.studentId),
             )
 
         conn.commit()
 
 
-def _progress_overview_sync(student_id: str) -> dict[str, Any]:
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
+async def _progress_overview(student_id: str) -> dict[str, Any]:
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        await cur.execute(
             """
+            WITH stats AS (
+              SELECT
+                COUNT(*) AS total_sessions,
+                COUNT(*) FILTER (WHERE created_at >= NOW() - interval '7 days') AS sessions_this_week
+              FROM sessions
+              WHERE student_id = %(student_id)s
+            ),
+            subject_progress AS (
+              SELECT se.id, s.name, s.level, COALESCE(AVG((ps.confidence_score)::numeric), 0) AS avg_confidence
+              FROM student_enrolments se
+              INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
+              INNER JOIN subjects s ON s.id = bs.subject_id
+              LEFT JOIN progress_snapshots ps ON ps.student_id = %(student_id)s AND ps.enrolment_id = se.id
+              WHERE se.student_id = %(student_id)s
+              GROUP BY se.id, s.name, s.level
+            ),
+            active_repeat AS (
+              SELECT rf.id, rf.concept, rf.reason, rf.priority, rf.flagged_at, s.name
+              FROM repeat_flags rf
+              INNER JOIN student_enrolments se ON se.id = rf.enrolment_id
+              INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
+              INNER JOIN subjects s ON s.id = bs.subject_id
+              WHERE rf.student_id = %(student_id)s AND rf.status = 'active'
+            ),
+            upcoming AS (
+              SELECT id, title, scheduled_at, status
+              FROM scheduled_tutorials
+              WHERE student_id = %(student_id)s AND status = 'scheduled'
+              ORDER BY scheduled_at
+              LIMIT 5
+            )
             SELECT
-              COUNT(*) AS total_sessions,
-              COUNT(*) FILTER (WHERE created_at >= NOW() - interval '7 days') AS sessions_this_week
-            FROM sessions
-            WHERE student_id = %s
-            """,
-            (student_id,),
-        )
-        stats = cur.fetchone() or (0, 0)
-
-        cur.execute(
-            """
-            SELECT se.id, s.name, s.level, COALESCE(AVG((ps.confidence_score)::numeric), 0)
-            FROM student_enrolments se
-            INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
-            INNER JOIN subjects s ON s.id = bs.subject_id
-            LEFT JOIN progress_snapshots ps ON ps.student_id = %s AND ps.enrolment_id = se.id
-            WHERE se.student_id = %s
-            GROUP BY se.id, s.name, s.level
-            ORDER BY s.name
-            """,
-            (student_id, student_id),
-        )
-        subject_progress = [
-            {
-                "enrolmentId": r[0],
-                "subjectName": r[1],
-                "level": r[2],
-                "avgConfidence": float(r[3]),
-            }
-            for r in cur.fetchall()
-        ]
-
-        cur.execute(
-            """
-            SELECT rf.id, rf.concept, rf.reason, rf.priority, s.name
-            FROM repeat_flags rf
-            INNER JOIN student_enrolments se ON se.id = rf.enrolment_id
-            INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
-            INNER JOIN subjects s ON s.id = bs.subject_id
-            WHERE rf.student_id = %s AND rf.status = 'active'
-            ORDER BY rf.priority, rf.flagged_at DESC
+              stats.total_sessions,
+              stats.sessions_this_week,
+              COALESCE((
+                SELECT json_agg(json_build_array(id, name, level, avg_confidence) ORDER BY name)
+                FROM subject_progress
+              ), '[]'),
+              COALESCE((
+                SELECT json_agg(
+                  json_build_array(id, concept, reason, priority, name)
+                  ORDER BY priority, flagged_at DESC
+                )
+                FROM active_repeat
+              ), '[]'),
+              COALESCE((
+                SELECT json_agg(json_build_array(id, title, scheduled_at, status) ORDER BY scheduled_at)
+                FROM upcoming
+              ), '[]')
+            FROM stats
             """,
-            (student_id,),
+            {"student_id": student_id},
         )
-        active_repeat = [
-            {
-                "id": r[0],
-                "concept": r[1],
-                "reason": r[2],
-                "priority": r[3],
-                "subjectName": r[4],
-            }
-            for r in cur.fetchall()
-        ]
+        total_sessions, sessions_this_week, progress_rows, repeat_rows, upcoming_rows = await cur.fetchone()
 
-        cur.execute(
-            """
-            SELECT id, title, scheduled_at, status
-            FROM scheduled_tutorials
-            WHERE student_id = %s AND status = 'scheduled'
-            ORDER BY scheduled_at
-            LIMIT 5
-            """,
-            (student_id,),
-        )
-        upcoming = [
-            {"id": str(r[0]), "title": r[1], "scheduledAt": r[2], "status": r[3]}
-            for r in cur.fetchall()
-        ]
+    subject_progress = [
+        {
+            "enrolmentId": r[0],
+            "subjectName": r[1],
+            "level": r[2],
+            "avgConfidence": float(r[3]),
+        }
+        for r in progress_rows
+    ]
+    active_repeat = [
+        {
+            "id": r[0],
+            "concept": r[1],
+            "reason": r[2],
+            "priority": r[3],
+            "subjectName": r[4],
+        }
+        for r in repeat_rows
+    ]
+    upcoming = [
+        {
+            "id": str(r[0]),
+            "title": r[1],
+            "scheduledAt": datetime.datetime.fromisoformat(r[2]),
+            "status": r[3],
+        }
+        for r in upcoming_rows
+    ]
 
     return {
-        "stats": {"totalSessions": int(stats[0]), "sessionsThisWeek": int(stats[1])},
+        "stats": {"totalSessions": int(total_sessions), "sessionsThisWeek": int(sessions_this_week)},
         "subjectProgress": subject_progress,
         "activeRepeatFlags": active_repeat,
         "upcoming": upcoming,
@@ -1351,140 +1475,177 @@ def _dos_chat_threads_sync(student_id: str) -> list[dict[str, Any]]:
     return [{"id": str(r[0]), "createdAt": r[1]} for r in rows]
 
 
-def _dos_chat_post_sync(payload: DosChatRequest) -> dict[str, Any]:
-    from openai import OpenAI
+@functools.lru_cache(maxsize=1)
+def _openai() -> AsyncOpenAI:
+    # One client per process so its httpx pool keeps connections to the API alive between calls.
+    return AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY", ""))
+
 
+async def _dos_chat_post(payload: DosChatRequest) -> dict[str, Any]:
     message = payload.message.strip()
     if not message:
         raise HTTPException(status_code=400, detail="Message is required")
 
-    with get_conn() as conn, conn.cursor() as cur:
+    async with get_async_conn() as conn, conn.cursor() as cur:
         thread_id = payload.threadId
         if not thread_id:
-            cur.execute("INSERT INTO dos_chat_threads (student_id) VALUES (%s) RETURNING id", (payload.studentId,))
-            thread_id = str(cur.fetchone()[0])
+            await cur.execute("INSERT INTO dos_chat_threads (student_id) VALUES (%s) RETURNING id", (payload.studentId,))
+            thread_id = str((await cur.fetchone())[0])
 
-        cur.execute(
+        await cur.execute(
             "INSERT INTO dos_chat_messages (thread_id, role, content) VALUES (%s, 'user', %s)",
             (thread_id, message),
         )
 
-        cur.execute(
-            """
-            SELECT role, content
-            FROM dos_chat_messages
-            WHERE thread_id = %s
-            ORDER BY created_at DESC
-            LIMIT 12
-            """,
-            (thread_id,),
-        )
-        recent_messages = cur.fetchall()
-
-        cur.execute(
+        # All prompt context in one round trip; the user message inserted above is visible
+        # because this is a separate statement in the same transaction.
+        await cur.execute(
             """
-            SELECT s.name, s.level
-            FROM student_enrolments se
-            INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
-            INNER JOIN subjects s ON s.id = bs.subject_id
-            WHERE se.student_id = %s
-            """,
-            (payload.studentId,),
-        )
-        enrolments = [{"subjectName": r[0], "level": r[1]} for r in cur.fetchall()]
-
-        cur.execute(
-            """
-            SELECT concept, reason, priority
-            FROM repeat_flags
-            WHERE student_id = %s AND status = 'active'
-            ORDER BY flagged_at DESC
-            LIMIT 12
+            SELECT
+              COALESCE((
+                SELECT json_agg(json_build_array(m.role, m.content) ORDER BY m.created_at DESC)
+                FROM (
+                  SELECT role, content, created_at
+                  FROM dos_chat_messages
+                  WHERE thread_id = %(thread_id)s
+                  ORDER BY created_at DESC
+                  LIMIT 12
+                ) m
+              ), '[]'),
+              COALESCE((
+                SELECT json_agg(json_build_object('subjectName', s.name, 'level', s.level))
+                FROM student_enrolments se
+                INNER JOIN board_subjects bs ON bs.id = se.board_subject_id
+                INNER JOIN subjects s ON s.id = bs.subject_id
+                WHERE se.student_id = %(student_id)s
+              ), '[]'),
+              COALESCE((
+                SELECT json_agg(
+                  json_build_object('concept', rf.concept, 'reason', rf.reason, 'priority', rf.priority)
+                  ORDER BY rf.flagged_at DESC
+                )
+                FROM (
+                  SELECT concept, reason, priority, flagged_at
+                  FROM repeat_flags
+                  WHERE student_id = %(student_id)s AND status = 'active'
+                  ORDER BY flagged_at DESC
+                  LIMIT 12
+                ) rf
+              ), '[]'),
+              COALESCE((
+                SELECT json_agg(
+                  json_build_object(
+                    'confidenceScore', ps.confidence_score,
+                    'areasToImprove', ps.areas_to_improve,
+                    'recommendedFocus', ps.recommended_focus
+                  )
+                  ORDER BY ps.generated_at DESC
+                )
+                FROM (
+                  SELECT confidence_score, areas_to_improve, recommended_focus, generated_at
+                  FROM progress_snapshots
+                  WHERE student_id = %(student_id)s
+                  ORDER BY generated_at DESC
+                  LIMIT 6
+                ) ps
+              ), '[]'),
+              (SELECT COUNT(*) FROM sessions WHERE student_id = %(student_id)s)
             """,
-            (payload.studentId,),
+            {"thread_id": thread_id, "student_id": payload.studentId},
         )
-        repeats = [{"concept": r[0], "reason": r[1], "priority": r[2]} for r in cur.fetchall()]
+        recent_messages, enrolments, repeats, snapshots, session_total = await cur.fetchone()
+        await conn.commit()
 
-        cur.execute(
-            """
-            SELECT confidence_score, areas_to_improve, recommended_focus
-            FROM progress_snapshots
-            WHERE student_id = %s
-            ORDER BY generated_at DESC
-            LIMIT 6
-            """,
-            (payload.studentId,),
-        )
-        snapshots = [
-            {"confidenceScore": r[0], "areasToImprove": r[1], "recommendedFocus": r[2]}
-            for r in cur.fetchall()
-        ]
+    # The connection goes back to the pool before the OpenAI call so slow completions can't
+    # leave pooled connections idle in transaction.
+    openai_key = os.environ.get("OPENAI_API_KEY")
+    assistant_reply = "I can help plan your next steps. Please set OPENAI_API_KEY to enable AI recommendations."
 
-        cur.execute("SELECT COUNT(*) FROM sessions WHERE student_id = %s", (payload.studentId,))
-        session_total = int((cur.fetchone() or [0])[0])
-
-        openai_key = os.environ.get("OPENAI_API_KEY")
-        assistant_reply = "I can help plan your next steps. Please set OPENAI_API_KEY to enable AI recommendations."
-
-        if openai_key:
-            client = OpenAI(api_key=openai_key)
-            completion = client.chat.completions.create(
-                model=os.environ.get("SUMMARY_OPENAI_MODEL", "gpt-5-mini"),
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a Director of Studies planning assistant. Give concise UK-school-focused tutoring guidance. Be practical and specific.",
-                    },
-                    {
-                        "role": "system",
-                        "content": (
-                            f"Student context:\nSubjects: {json.dumps(enrolments)}\n"
-                            f"Active repeats: {json.dumps(repeats)}\n"
-                            f"Recent snapshots: {json.dumps(snapshots)}\n"
-                            f"Total sessions tracked: {session_total}"
-                        ),
-                    },
-                    *[
-                        {"role": "assistant" if r[0] == "assistant" else "user", "content": r[1]}
-                        for r in reversed(recent_messages)
-                    ],
+    if openai_key:
+        client = _openai()
+        completion = await client.chat.completions.create(
+            model=os.environ.get("SUMMARY_OPENAI_MODEL", "gpt-5-mini"),
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are a Director of Studies planning assistant. Give concise UK-school-focused tutoring guidance. Be practical and specific.",
+                },
+                {
+                    "role": "system",
+                    "content": (
+                        f"Student context:\nSubjects: {orjson.dumps(enrolments).decode()}\n"
+                        f"Active repeats: {orjson.dumps(repeats).decode()}\n"
+                        f"Recent snapshots: {orjson.dumps(snapshots).decode()}\n"
+                        f"Total sessions tracked: {session_total}"
+                    ),
+                },
+                *[
+                    {"role": "assistant" if r[0] == "assistant" else "user", "content": r[1]}
+                    for r in reversed(recent_messages)
                 ],
-            )
-            assistant_reply = completion.choices[0].message.content.strip() if completion.choices[0].message.content else assistant_reply
+            ],
+        )
+        assistant_reply = completion.choices[0].message.content.strip() if completion.choices[0].message.content else assistant_reply
 
-        cur.execute(
+    async with get_async_conn() as conn:
+        await conn.execute(
             "INSERT INTO dos_chat_messages (thread_id, role, content) VALUES (%s, 'assistant', %s)",
             (thread_id, assistant_reply),
         )
-        conn.commit()
+        await conn.commit()
 
     return {"threadId": thread_id, "reply": assistant_reply}
 
 
+# Shared so repeated admin calls (the demo logins make two in a row) reuse a kept-alive connection.
+_supabase_admin_http: httpx.Client | None = None
+_supabase_admin_http_lock = threading.Lock()
+
+
+def _get_supabase_admin_http() -> httpx.Client:
+    global _supabase_admin_http
+    with _supabase_admin_http_lock:
+        if _supabase_admin_http is None or _supabase_admin_http.is_closed:
+            _supabase_admin_http = httpx.Client(timeout=30)
+        return _supabase_admin_http
+
+
+def _close_supabase_admin_http() -> None:
+    global _supabase_admin_http
+    with _supabase_admin_http_lock:
+        if _supabase_admin_http is not None:
+            _supabase_admin_http.close()
+            _supabase_admin_http = None
+
+
 def _supabase_admin_request(method: str, path: str, body: dict[str, Any] | None = None) -> dict[str, Any]:
     supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL", "")
     secret_key = os.environ.get("SUPABASE_SECRET_KEY", "")
     if not supabase_url or not secret_key:
         raise HTTPException(status_code=500, detail="Supabase admin config missing")
 
-    data = json.dumps(body).encode("utf-8") if body is not None else None
-    req = urllib_request.Request(
+    response = _get_supabase_admin_http().request(
+        method,
         f"{supabase_url}{path}",
-        method=method,
-        data=data,
+        content=orjson.dumps(body) if body is not None else None,
         headers={
             "apikey": secret_key,
             "Authorization": f"Bearer {secret_key}",
             "Content-Type": "application/json",
         },
     )
-    try:
-        with urllib_request.urlopen(req, timeout=30) as response:
-            text = response.read().decode("utf-8")
-            return json.loads(text) if text else {}
-    except urllib_error.HTTPError as exc:
-        detail = exc.read().decode("utf-8")
-        raise HTTPException(status_code=500, detail=f"Supabase admin request failed: {detail}") from exc
+    if response.status_code >= 400:
+        raise HTTPException(status_code=500, detail=f"Supabase admin request failed: {response.text}")
+    return orjson.loads(response.content) if response.content else {}
+
+
+def _find_auth_user_by_email(email: str) -> dict[str, Any] | None:
+    # GoTrue's filter is a substring match on email, so the exact match is still picked here,
+    # but only among the handful of users the server returns.
+    query = urllib_parse.urlencode({"filter": email, "page": 1, "per_page": 50})
+    users_response = _supabase_admin_request("GET", f"/auth/v1/admin/users?{query}")
+    users = users_response.get("users", []) if isinstance(users_response, dict) else []
+    return next((u for u in users if str(u.get("email", "")).lower() == email.lower()), None)
 
 
 def _guest_login_sync() -> dict[str, Any]:
@@ -1492,9 +1653,7 @@ def _guest_login_sync() -> dict[str, Any]:
     guest_password = os.environ.get("GUEST_DEMO_PASSWORD", "GuestDemo123!")
     guest_name = os.environ.get("GUEST_DEMO_NAME", "Guest Student")
 
-    users_response = _supabase_admin_request("GET", "/auth/v1/admin/users?page=1&per_page=200")
-    users = users_response.get("users", []) if isinstance(users_response, dict) else []
-    existing = next((u for u in users if str(u.get("email", "")).lower() == guest_email.lower()), None)
+    existing = _find_auth_user_by_email(guest_email)
 
     metadata = {"displayName": guest_name, "accountType": "student", "isDemo": True}
     if existing:
@@ -1581,9 +1740,7 @@ def _guest_admin_login_sync() -> dict[str, Any]:
     admin_password = os.environ.get("GUEST_ADMIN_PASSWORD", "AdminDemo123!")
     admin_name = os.environ.get("GUEST_ADMIN_NAME", "Guest Admin")
 
-    users_response = _supabase_admin_request("GET", "/auth/v1/admin/users?page=1&per_page=200")
-    users = users_response.get("users", []) if isinstance(users_response, dict) else []
-    existing = next((u for u in users if str(u.get("email", "")).lower() == admin_email.lower()), None)
+    existing = _find_auth_user_by_email(admin_email)
 
     metadata = {"displayName": admin_name, "accountType": "admin", "isDemo": True}
     if existing:
@@ -1639,36 +1796,40 @@ def _guest_admin_login_sync() -> dict[str, Any]:
     return {"email": admin_email, "password": admin_password}
 
 
-def _wait_for_transcript_text_sync(session_id: str, max_attempts: int = 6, delay_ms: int = 400) -> str:
-    for attempt in range(max_attempts):
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(
-                "SELECT transcript_text FROM session_transcripts WHERE session_id = %s",
-                (session_id,),
-            )
-            row = cur.fetchone()
-
-        transcript_text = str(row[0]) if row and row[0] else ""
-        if transcript_text.strip():
-            return transcript_text
-
-        if attempt < max_attempts - 1:
-            import time
-
-            time.sleep(delay_ms / 1000)
-
-    return ""
-
-
-def _summarize_transcript_sync(transcript_text: str) -> SummaryPayload:
-    from openai import OpenAI
+def _wait_for_transcript_text_sync(session_id: str, timeout_s: float = 2.4) -> str:
+    """Return the session's transcript text, waiting up to ``timeout_s`` for it to be written.
 
+    Blocks on the ``transcript_ready`` notification sent by the session_transcripts trigger
+    rather than polling the table.
+    """
+    select_sql = "SELECT transcript_text FROM session_transcripts WHERE session_id = %s"
+    with get_conn() as conn:
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            # LISTEN before the first read so a write landing in between still wakes us.
+            conn.execute("LISTEN transcript_ready")
+            row = conn.execute(select_sql, (session_id,)).fetchone()
+            if not (row and row[0] and str(row[0]).strip()):
+                for notify in conn.notifies(timeout=timeout_s):
+                    if notify.payload == str(session_id).lower():
+                        break
+                row = conn.execute(select_sql, (session_id,)).fetchone()
+        finally:
+            conn.execute("UNLISTEN transcript_ready")
+            conn.autocommit = autocommit
+
+    transcript_text = str(row[0]) if row and row[0] else ""
+    return transcript_text if transcript_text.strip() else ""
+
+
+async def _summarize_transcript(transcript_text: str) -> SummaryPayload:
     api_key = os.environ.get("OPENAI_API_KEY", "")
     if not api_key:
         return SummaryPayload(summaryMd="No summary generated because OPENAI_API_KEY is not set.", keyTakeaways=[], citations=[])
 
-    client = OpenAI(api_key=api_key)
-    completion = client.chat.completions.create(
+    client = _openai()
+    completion = await client.chat.completions.create(
         model=SUMMARY_OPENAI_MODEL,
         response_format={"type": "json_object"},
         messages=[
@@ -1687,7 +1848,7 @@ def _summarize_transcript_sync(transcript_text: str) -> SummaryPayload:
         ],
     )
     raw = completion.choices[0].message.content or "{}"
-    parsed = json.loads(raw)
+    parsed = orjson.loads(raw)
     return SummaryPayload(
         summaryMd=str(parsed.get("summaryMd") or "No summary generated."),
         keyTakeaways=[str(v) for v in parsed.get("keyTakeaways", []) if isinstance(v, str)],
@@ -1695,9 +1856,7 @@ def _summarize_transcript_sync(transcript_text: str) -> SummaryPayload:
     )
 
 
-def _analyze_progress_sync(transcript_text: str) -> ProgressPayload:
-    from openai import OpenAI
-
+async def _analyze_progress(transcript_text: str) -> ProgressPayload:
     api_key = os.environ.get("OPENAI_API_KEY", "")
     if not api_key:
         return ProgressPayload(
@@ -1708,8 +1867,8 @@ def _analyze_progress_sync(transcript_text: str) -> ProgressPayload:
             repeat=[],
         )
 
-    client = OpenAI(api_key=api_key)
-    completion = client.chat.completions.create(
+    client = _openai()
+    completion = await client.chat.completions.create(
         model=SUMMARY_OPENAI_MODEL,
         response_format={"type": "json_object"},
         messages=[
@@ -1726,7 +1885,7 @@ def _analyze_progress_sync(transcript_text: str) -> ProgressPayload:
         ],
     )
     raw = completion.choices[0].message.content or "{}"
-    parsed = json.loads(raw)
+    parsed = orjson.loads(raw)
 
     score_raw = parsed.get("confidenceScore", 0.6)
     score = float(score_raw) if isinstance(score_raw, (float, int)) else 0.6
@@ -1752,8 +1911,8 @@ def _analyze_progress_sync(transcript_text: str) -> ProgressPayload:
     )
 
 
-def _end_session_sync(session_id: str, student_id: str) -> bool:
-    duration_seconds = 0
+def _end_session_mark_sync(session_id: str, student_id: str) -> tuple[Any, Any, int] | None:
+    """Mark the session ended; returns (enrolment_id, topic_id, duration_seconds) or None if not found."""
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             "SELECT id, student_id, enrolment_id, topic_id FROM sessions WHERE id = %s",
@@ -1761,10 +1920,10 @@ def _end_session_sync(session_id: str, student_id: str) -> bool:
         )
         row = cur.fetchone()
         if not row:
-            return False
+            return None
 
         if str(row[1]) != student_id:
-            return False
+            return None
 
         enrolment_id = row[2]
         topic_id = row[3]
@@ -1787,10 +1946,18 @@ def _end_session_sync(session_id: str, student_id: str) -> bool:
         duration_seconds = int(duration_row[0] or 0) if duration_row else 0
         conn.commit()
 
-    transcript_text = _wait_for_transcript_text_sync(session_id)
+    return enrolment_id, topic_id, duration_seconds
 
-    summary, progress = asyncio.run(_generate_summary_and_progress_async(transcript_text))
 
+def _store_session_outcome_sync(
+    session_id: str,
+    student_id: str,
+    enrolment_id: Any,
+    topic_id: Any,
+    duration_seconds: int,
+    summary: SummaryPayload,
+    progress: ProgressPayload,
+) -> None:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
@@ -1805,8 +1972,8 @@ def _end_session_sync(session_id: str, student_id: str) -> bool:
             (
                 session_id,
                 summary.summaryMd,
-                json.dumps(summary.keyTakeaways),
-                json.dumps(summary.citations),
+                Jsonb(summary.keyTakeaways, dumps=orjson.dumps),
+                Jsonb(summary.citations, dumps=orjson.dumps),
             ),
         )
 
@@ -1831,9 +1998,9 @@ def _end_session_sync(session_id: str, student_id: str) -> bool:
                     enrolment_id,
                     topic_id,
                     str(progress.confidenceScore),
-                    json.dumps(progress.strengths),
-                    json.dumps(progress.improvements),
-                    json.dumps(progress.focus),
+                    Jsonb(progress.strengths, dumps=orjson.dumps),
+                    Jsonb(progress.improvements, dumps=orjson.dumps),
+                    Jsonb(progress.focus, dumps=orjson.dumps),
                 ),
             )
 
@@ -1870,21 +2037,52 @@ def _end_session_sync(session_id: str, student_id: str) -> bool:
 
     consume_quota_minutes(student_id, (duration_seconds + 59) // 60)
 
-    return True
-
 
-async def _generate_summary_and_progress_async(transcript_text: str) -> tuple[SummaryPayload, ProgressPayload]:
-    summary_task = asyncio.to_thread(_summarize_transcript_sync, transcript_text)
-    progress_task = asyncio.to_thread(_analyze_progress_sync, transcript_text)
-    summary, progress = await asyncio.gather(summary_task, progress_task)
+async def _generate_summary_and_progress(transcript_text: str) -> tuple[SummaryPayload, ProgressPayload]:
+    summary, progress = await asyncio.gather(
+        _summarize_transcript(transcript_text),
+        _analyze_progress(transcript_text),
+    )
     return summary, progress
 
 
+async def _end_session(session_id: str, student_id: str) -> bool:
+    ended = await asyncio.to_thread(_end_session_mark_sync, session_id, student_id)
+    if ended is None:
+        return False
+    enrolment_id, topic_id, duration_seconds = ended
+
+    transcript_text = await asyncio.to_thread(_wait_for_transcript_text_sync, session_id)
+    summary, progress = await _generate_summary_and_progress(transcript_text)
+    await asyncio.to_thread(
+        _store_session_outcome_sync,
+        session_id,
+        student_id,
+        enrolment_id,
+        topic_id,
+        duration_seconds,
+        summary,
+        progress,
+    )
+    return True
+
+
 @app.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/healthz")
+async def healthz() -> dict[str, str]:
+    """Readiness check: also verifies a pooled DB connection can run a query."""
+    try:
+        async with get_async_conn() as conn:
+            await conn.execute("SELECT 1")
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ok"}
+
+
 @app.post("/join")
 async def join_room(payload: JoinRequest) -> dict[str, Any]:
     await _start_agent_join(payload)
@@ -1895,14 +2093,16 @@ async def join_room(payload: JoinRequest) -> dict[str, Any]:
 @app.post("/api/session/create")
 async def create_session(
     payload: SessionCreateRequest,
+    response: Response,
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> SessionCreateResponse:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    response.headers["Cache-Control"] = "no-store"
     if not LIVEKIT_API_KEY or not LIVEKIT_API_SECRET:
         raise HTTPException(status_code=500, detail="LiveKit credentials missing")
 
-    return await asyncio.to_thread(_create_session_sync, payload.courseId, payload.topicId, payload.studentId)
+    return await _create_session(payload.courseId, payload.topicId, payload.studentId)
 
 
 @app.post("/api/session/start-agent")
@@ -1911,18 +2111,14 @@ async def start_session_agent(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
 
     session_row = await asyncio.to_thread(_get_session_by_id_and_student_sync, payload.sessionId, payload.studentId)
     if not session_row:
         raise HTTPException(status_code=404, detail="Session not found")
 
     room_name, course_id, topic_id, enrolment_id = session_row
-    tutor_config, repeat_flags, recommended_focus = await asyncio.to_thread(
-        _load_tutor_runtime_context,
-        payload.studentId,
-        enrolment_id,
-    )
+    tutor_config, repeat_flags, recommended_focus = await _load_tutor_runtime_context(payload.studentId, enrolment_id)
 
     await _start_agent_join(
         JoinRequest(
@@ -1961,21 +2157,24 @@ async def end_session(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
-    ok = await asyncio.to_thread(_end_session_sync, payload.sessionId, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    ok = await _end_session(payload.sessionId, payload.studentId)
     if not ok:
         raise HTTPException(status_code=404, detail="Session not found")
     return {"ok": True}
 
 
-@app.get("/api/sessions")
+@app.get("/api/sessions", response_model=dict[str, list[SessionListItem]])
 async def list_sessions(
     studentId: str,
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
-) -> dict[str, list[SessionListItem]]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    sessions_list = await asyncio.to_thread(_list_sessions_sync, studentId)
+    accept: str | None = Header(default=None),
+) -> dict[str, list[SessionListItem]] | StreamingResponse:
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    if _wants_ndjson(accept):
+        return StreamingResponse(_ndjson_lines(_iter_sessions(studentId)), media_type=NDJSON_MEDIA_TYPE)
+    sessions_list = [item async for item in _iter_sessions(studentId)]
     return {"sessions": sessions_list}
 
 
@@ -1983,26 +2182,32 @@ async def list_sessions(
 async def get_session_detail(
     session_id: str,
     studentId: str,
+    response: Response,
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, SessionDetail]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    session = await asyncio.to_thread(_get_session_detail_sync, session_id, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    session = await _get_session_detail(session_id, studentId)
     if not session:
         raise HTTPException(status_code=404, detail="Not found")
+    # Carries the LiveKit participant token; keep it out of shared caches.
+    response.headers["Cache-Control"] = "no-store"
     return {"session": session}
 
 
-@app.get("/api/calendar")
+@app.get("/api/calendar", response_model=dict[str, Any])
 async def calendar_list(
     studentId: str,
     from_: str | None = None,
     to: str | None = None,
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
-) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    tutorials = await asyncio.to_thread(_calendar_list_sync, studentId, from_, to)
+    accept: str | None = Header(default=None),
+) -> dict[str, Any] | StreamingResponse:
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    if _wants_ndjson(accept):
+        return StreamingResponse(_ndjson_lines(_iter_calendar(studentId, from_, to)), media_type=NDJSON_MEDIA_TYPE)
+    tutorials = [item async for item in _iter_calendar(studentId, from_, to)]
     return {"tutorials": tutorials}
 
 
@@ -2012,10 +2217,10 @@ async def calendar_create(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, str]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     if not payload.title or not payload.scheduledAt:
         raise HTTPException(status_code=400, detail="title and scheduledAt are required")
-    tutorial_id = await asyncio.to_thread(_calendar_create_sync, payload)
+    tutorial_id = await _calendar_create(payload)
     return {"id": tutorial_id}
 
 
@@ -2026,8 +2231,8 @@ async def calendar_update(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
-    await asyncio.to_thread(_calendar_update_sync, tutorial_id, payload)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _calendar_update(tutorial_id, payload)
     return {"ok": True}
 
 
@@ -2038,8 +2243,8 @@ async def calendar_delete(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    await asyncio.to_thread(_calendar_delete_sync, tutorial_id, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _calendar_delete(tutorial_id, studentId)
     return {"ok": True}
 
 
@@ -2052,7 +2257,7 @@ async def calendar_feed_token_get(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     result = await asyncio.to_thread(_calendar_feed_token_get_sync, studentId)
     return result
 
@@ -2063,14 +2268,11 @@ async def calendar_feed_token_regenerate(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     result = await asyncio.to_thread(_calendar_feed_token_regenerate_sync, studentId)
     return result
 
 
-from fastapi.responses import Response  # noqa: E402
-
-
 @app.get("/calendar/feed/{token}")
 async def calendar_ical_feed(token: str) -> Response:
     """Public iCal feed — no auth required, uses unguessable token."""
@@ -2158,7 +2360,7 @@ async def calendar_integrations_list(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     rows = await asyncio.to_thread(_calendar_integrations_list_sync, studentId)
     return {"integrations": rows}
 
@@ -2175,7 +2377,7 @@ async def calendar_integration_toggle(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     result = await asyncio.to_thread(
         _calendar_integration_toggle_sync, payload.studentId, payload.provider, payload.enabled
     )
@@ -2189,7 +2391,7 @@ async def calendar_integration_delete(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     await asyncio.to_thread(_calendar_integration_delete_sync, integration_id, studentId)
     return {"ok": True}
 
@@ -2235,14 +2437,20 @@ def _calendar_integration_delete_sync(integration_id: str, student_id: str) -> N
         conn.commit()
 
 
-@app.get("/api/reference/board-subjects")
+@app.get("/api/reference/board-subjects", response_model=dict[str, Any])
 async def reference_board_subjects(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
-) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization)
-    rows = await asyncio.to_thread(_reference_board_subjects_sync)
-    return {"boardSubjects": rows}
+) -> Response:
+    global _reference_board_subjects_cache
+    await _validate_internal_api_key(x_internal_api_key, authorization)
+    now = time.monotonic()
+    cached = _reference_board_subjects_cache
+    if cached is None or cached[0] <= now:
+        rows = await asyncio.to_thread(_reference_board_subjects_sync)
+        cached = (now + REFERENCE_CACHE_TTL_S, orjson.dumps({"boardSubjects": rows}))
+        _reference_board_subjects_cache = cached
+    return Response(content=cached[1], media_type="application/json")
 
 
 @app.get("/api/student/enrolments")
@@ -2251,7 +2459,7 @@ async def student_enrolments_list(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     rows = await asyncio.to_thread(_student_enrolments_list_sync, studentId)
     return {"enrolments": rows}
 
@@ -2262,8 +2470,9 @@ async def student_enrolments_create(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     await asyncio.to_thread(_student_enrolment_upsert_sync, payload)
+    _invalidate_tutor_lists(payload.studentId)
     return {"ok": True}
 
 
@@ -2273,8 +2482,9 @@ async def student_enrolments_delete(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     await asyncio.to_thread(_student_enrolment_delete_sync, payload)
+    _invalidate_tutor_lists(payload.studentId)
     return {"ok": True}
 
 
@@ -2284,7 +2494,7 @@ async def student_invite_code(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     return await asyncio.to_thread(_student_invite_code_sync, studentId)
 
 
@@ -2294,8 +2504,8 @@ async def tutor_personas_list(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    personas = await asyncio.to_thread(_tutor_personas_list_sync, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    personas = await _cached_tutor_list("personas", studentId, _tutor_personas_list_sync)
     return {"personas": personas}
 
 
@@ -2305,10 +2515,11 @@ async def tutor_personas_create(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     if not payload.name.strip():
         raise HTTPException(status_code=400, detail="Tutor name is required")
     persona = await asyncio.to_thread(_tutor_persona_create_sync, payload)
+    _invalidate_tutor_lists(payload.studentId)
     return {"persona": persona}
 
 
@@ -2319,10 +2530,11 @@ async def tutor_personas_update(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     if not payload.name.strip():
         raise HTTPException(status_code=400, detail="Tutor name is required")
     persona = await asyncio.to_thread(_tutor_persona_update_sync, persona_id, payload)
+    _invalidate_tutor_lists(payload.studentId)
     if not persona:
         raise HTTPException(status_code=404, detail="Persona not found")
     return {"persona": persona}
@@ -2335,8 +2547,9 @@ async def tutor_personas_delete(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     await asyncio.to_thread(_tutor_persona_delete_sync, persona_id, studentId)
+    _invalidate_tutor_lists(studentId)
     return {"ok": True}
 
 
@@ -2346,8 +2559,8 @@ async def tutor_config_list(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    enrolments = await asyncio.to_thread(_tutor_config_list_sync, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    enrolments = await _cached_tutor_list("config", studentId, _tutor_config_list_sync)
     return {"enrolments": enrolments}
 
 
@@ -2357,8 +2570,9 @@ async def tutor_config_update(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
     await asyncio.to_thread(_tutor_config_update_sync, payload)
+    _invalidate_tutor_lists(payload.studentId)
     return {"ok": True}
 
 
@@ -2368,7 +2582,7 @@ async def parent_links_list(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, parentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, parentId)
     links = await asyncio.to_thread(_parent_links_list_sync, parentId)
     return {"links": links}
 
@@ -2379,7 +2593,7 @@ async def parent_links_create(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.parentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.parentId)
     await asyncio.to_thread(_parent_link_student_sync, payload)
     return {"ok": True}
 
@@ -2390,7 +2604,7 @@ async def parent_link_code(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.parentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.parentId)
     student_id = await asyncio.to_thread(_parent_link_code_sync, payload)
     return {"ok": True, "studentId": student_id}
 
@@ -2402,7 +2616,7 @@ async def parent_restrictions_get(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, parentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, parentId)
     restriction = await asyncio.to_thread(_parent_restrictions_get_sync, parentId, studentId)
     return {"restriction": restriction}
 
@@ -2413,7 +2627,7 @@ async def parent_restrictions_put(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.parentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.parentId)
     await asyncio.to_thread(_parent_restrictions_upsert_sync, payload)
     return {"ok": True}
 
@@ -2424,8 +2638,8 @@ async def progress_overview(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
-    return await asyncio.to_thread(_progress_overview_sync, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    return await _progress_overview(studentId)
 
 
 @app.get("/api/dos-chat")
@@ -2434,7 +2648,7 @@ async def dos_chat_threads(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     threads = await asyncio.to_thread(_dos_chat_threads_sync, studentId)
     return {"threads": threads}
 
@@ -2445,8 +2659,8 @@ async def dos_chat_post(
     x_internal_api_key: str | None = Header(default=None),
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
-    return await asyncio.to_thread(_dos_chat_post_sync, payload)
+    await _validate_internal_api_key(x_internal_api_key, authorization, payload.studentId)
+    return await _dos_chat_post(payload)
 
 
 @app.post("/api/auth/guest-login")
@@ -2468,7 +2682,7 @@ async def terms_accept(
     authorization: str | None = Header(default=None),
     x_internal_api_key: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    user_id = _validate_internal_api_key(x_internal_api_key, authorization)
+    user_id = await _validate_internal_api_key(x_internal_api_key, authorization)
     if not user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
     await asyncio.to_thread(_terms_accept_sync, user_id)
@@ -2490,24 +2704,21 @@ async def consent_status(
     authorization: str | None = Header(default=None),
     x_internal_api_key: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _validate_internal_api_key(x_internal_api_key, authorization, studentId)
+    await _validate_internal_api_key(x_internal_api_key, authorization, studentId)
     return await asyncio.to_thread(_consent_status_sync, studentId)
 
 
 def _consent_status_sync(student_id: str) -> dict[str, Any]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            "SELECT date_of_birth, consent_granted_at FROM students WHERE id = %s",
+            "SELECT date_part('year', age(CURRENT_DATE, date_of_birth))::int, consent_granted_at FROM students WHERE id = %s",
             (student_id,),
         )
         row = cur.fetchone()
         if not row:
             return {"required": False, "granted": False, "minorAge": False}
 
-        dob = row[0]
-        consent_granted_at = row[1]
-        today = datetime.date.today()
-        age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+        age, consent_granted_at = row
         is_minor = age < 13
 
         return {
@@ -2523,7 +2734,7 @@ async def delete_profile(
     authorization: str | None = Header(default=None),
     x_internal_api_key: str | None = Header(default=None),
 ) -> dict[str, bool]:
-    user_id = _validate_internal_api_key(x_internal_api_key, authorization)
+    user_id = await _validate_internal_api_key(x_internal_api_key, authorization)
     if not user_id:
         raise HTTPException(status_code=401, detail="Unauthorized")
     await asyncio.to_thread(_soft_delete_profile_sync, user_id)
@@ -2562,7 +2773,7 @@ async def create_feedback(
     payload: FeedbackRequest,
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
 
     if payload.feedbackType not in ("session", "general", "course_suggestion"):
         raise HTTPException(status_code=400, detail="Invalid feedback type")
@@ -2587,7 +2798,7 @@ async def create_feedback(
                     payload.sessionId,
                     payload.rating,
                     payload.comment,
-                    json.dumps(payload.metadata or {}),
+                    Jsonb(payload.metadata or {}, dumps=orjson.dumps),
                 ),
             )
             row = cur.fetchone()
@@ -2608,9 +2819,9 @@ if _admin_emails_raw.strip():
     ADMIN_EMAILS = {e.strip().lower() for e in _admin_emails_raw.split(",") if e.strip()}
 
 
-def _require_admin(authorization: str | None) -> str:
+async def _require_admin(authorization: str | None) -> str:
     """Verify the caller is an admin (account_type = 'admin' in DB). Returns profile_id."""
-    profile_id = _get_user_id_from_bearer(authorization)
+    profile_id = await get_user_id_from_bearer(authorization)
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             "SELECT account_type, email FROM profiles WHERE id = %s AND deleted_at IS NULL",
@@ -2630,7 +2841,8 @@ def _require_admin(authorization: str | None) -> str:
 
 def _validate_waitlist_email(email: str) -> str:
     cleaned = email.strip().lower()
-    if not EMAIL_REGEX.match(cleaned):
+    match = EMAIL_REGEX.fullmatch(cleaned) if len(cleaned) <= EMAIL_MAX_LENGTH else None
+    if match is None or "." not in match.group(1)[1:-1]:
         raise HTTPException(status_code=400, detail="Invalid email")
     return cleaned
 
@@ -2698,7 +2910,7 @@ async def admin_waitlist(
     per_page: int = 50,
     status: str | None = None,
 ) -> dict[str, Any]:
-    _require_admin(authorization)
+    await _require_admin(authorization)
 
     normalized_status = _validate_waitlist_status(status) if status else None
     safe_page = max(1, page)
@@ -2759,7 +2971,7 @@ async def admin_waitlist_update_status(
     payload: WaitlistStatusUpdateRequest,
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _require_admin(authorization)
+    await _require_admin(authorization)
     status = _validate_waitlist_status(payload.status)
 
     def _update() -> dict[str, Any]:
@@ -2803,7 +3015,7 @@ async def admin_waitlist_export(
     authorization: str | None = Header(default=None),
     status: str | None = None,
 ) -> StreamingResponse:
-    _require_admin(authorization)
+    await _require_admin(authorization)
 
     normalized_status = _validate_waitlist_status(status) if status else None
 
@@ -2880,7 +3092,7 @@ async def admin_waitlist_export(
 async def admin_stats(
     authorization: str | None = Header(default=None),
 ) -> dict[str, Any]:
-    _require_admin(authorization)
+    await _require_admin(authorization)
 
     def _query() -> dict[str, Any]:
         with get_conn() as conn, conn.cursor() as cur:
@@ -2937,7 +3149,7 @@ async def admin_feedback(
     per_page: int = 50,
     feedback_type: str | None = None,
 ) -> dict[str, Any]:
-    _require_admin(authorization)
+    await _require_admin(authorization)
 
     def _query() -> dict[str, Any]:
         with get_conn() as conn, conn.cursor() as cur:
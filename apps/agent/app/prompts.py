@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+# Placeholder substituted for the retrieved references when splitting the prompt.
+_REFERENCES_MARKER = "\x00references\x00"
+
 
 def build_system_prompt(
     course_name: str,
@@ -66,3 +69,30 @@ Opening turn rule:
 Retrieved context:
 {references}
 """.strip()
+
+
+def build_system_prompt_split(
+    course_name: str,
+    topic_name: str,
+    *,
+    tutor_name: str,
+    personality_prompt: str,
+    repeat_flags: list[str],
+    recommended_focus: list[str],
+) -> tuple[str, str]:
+    """Return the (before, after) text around the references slot of the system prompt.
+
+    Everything except the retrieved references is fixed for a session, so callers
+    can render this once and splice references in per turn.
+    """
+    prompt = build_system_prompt(
+        course_name,
+        topic_name,
+        _REFERENCES_MARKER,
+        tutor_name=tutor_name,
+        personality_prompt=personality_prompt,
+        repeat_flags=repeat_flags,
+        recommended_focus=recommended_focus,
+    )
+    prefix, suffix = prompt.split(_REFERENCES_MARKER, 1)
+    return prefix, suffix
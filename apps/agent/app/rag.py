@@ -1,39 +1,310 @@
 from __future__ import annotations
 
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Any
 
-from .db import embedding_for, get_conn
+import numpy as np
 
+from .db import embeddings_for, get_conn
 
-def retrieve_chunks(query: str, course_id: int, topic_id: int, k: int = 5) -> list[dict[str, Any]]:
-    embedding = embedding_for(query)
-    vector_literal = "[" + ",".join(str(x) for x in embedding) + "]"
+EMBEDDING_DIM = 1536
+RAG_CACHE_SIMILARITY = float(os.environ.get("RAG_CACHE_SIMILARITY", "0.95"))
+RAG_CACHE_MAX_ENTRIES = int(os.environ.get("RAG_CACHE_MAX_ENTRIES", "256"))
+# Chunks are re-ingested by scripts/ingest.py in another process, which can't invalidate this
+# cache, so cached retrievals expire after this long instead.
+RAG_CACHE_TTL_S = float(os.environ.get("RAG_CACHE_TTL_S", "600"))
+# How long the retrieval scheduler waits to coalesce turns from concurrent sessions.
+RAG_BATCH_WINDOW_MS = float(os.environ.get("RAG_BATCH_WINDOW_MS", "50"))
+# Cached embeddings are unit vectors stored as int8 with this scale.
+_INT8_SCALE = 127.0
+
+
+class _CacheNamespace:
+    def __init__(self, num_tables: int) -> None:
+        self.entries: OrderedDict[int, tuple[np.ndarray, list[dict[str, Any]], float]] = OrderedDict()
+        self.entry_keys: dict[int, list[bytes]] = {}
+        self.tables: list[dict[bytes, set[int]]] = [{} for _ in range(num_tables)]
+
+    def remove(self, entry_id: int) -> None:
+        self.entries.pop(entry_id, None)
+        for table, key in zip(self.tables, self.entry_keys.pop(entry_id, ())):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+
+class SemanticCache:
+    """LSH-bucketed cache of retrieval results keyed by query embedding.
+
+    Each ``(course_id, topic_id)`` namespace keeps up to ``max_entries`` results
+    in LRU order. A lookup hashes the embedding into ``num_tables``
+    random-projection buckets and only checks cosine similarity against entries
+    that share at least one bucket, so near-duplicate questions skip the vector
+    search entirely. Stored embeddings are quantized to int8, a quarter of the
+    float32 footprint at well under 1% similarity error. Entries expire after
+    ``ttl_s`` so re-ingested content is picked up.
+    """
+
+    def __init__(
+        self,
+        *,
+        dim: int = EMBEDDING_DIM,
+        num_tables: int = 8,
+        num_bits: int = 16,
+        threshold: float = RAG_CACHE_SIMILARITY,
+        max_entries: int = RAG_CACHE_MAX_ENTRIES,
+        ttl_s: float = RAG_CACHE_TTL_S,
+        seed: int = 0,
+    ) -> None:
+        if not 0 < num_bits <= 64:
+            raise ValueError("num_bits must be between 1 and 64")
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((num_tables, dim, num_bits)).astype(np.float32)
+        # Flattened to (dim, tables * bits) so hashing is a single BLAS matrix-vector product.
+        self._planes = np.ascontiguousarray(planes.transpose(1, 0, 2).reshape(dim, num_tables * num_bits))
+        self._num_tables = num_tables
+        self._num_bits = num_bits
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._ttl_s = ttl_s
+        self._namespaces: dict[tuple[int, int], _CacheNamespace] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: list[float] | np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _bucket_keys(self, vector: np.ndarray) -> list[bytes]:
+        # (tables, bits) sign pattern, packed to at most 8 bytes per table.
+        bits = (vector @ self._planes).reshape(self._num_tables, self._num_bits) > 0
+        return [row.tobytes() for row in np.packbits(bits, axis=1)]
+
+    def get(self, course_id: int, topic_id: int, embedding: list[float] | np.ndarray) -> list[dict[str, Any]] | None:
+        vector = self._normalize(embedding)
+        keys = self._bucket_keys(vector)
+        with self._lock:
+            namespace = self._namespaces.get((course_id, topic_id))
+            if namespace is None:
+                return None
+
+            candidates: set[int] = set()
+            for table, key in zip(namespace.tables, keys):
+                candidates.update(table.get(key, ()))
 
+            now = time.monotonic()
+            for entry_id in [entry_id for entry_id in candidates if namespace.entries[entry_id][2] <= now]:
+                namespace.remove(entry_id)
+                candidates.discard(entry_id)
+
+            if not candidates:
+                return None
+            candidate_ids = list(candidates)
+            stored = np.stack([namespace.entries[entry_id][0] for entry_id in candidate_ids])
+            similarities = (stored.astype(np.float32) @ vector) / _INT8_SCALE
+            best = int(np.argmax(similarities))
+            if similarities[best] < self._threshold:
+                return None
+            best_id = candidate_ids[best]
+            namespace.entries.move_to_end(best_id)
+            return namespace.entries[best_id][1]
+
+    def put(
+        self,
+        course_id: int,
+        topic_id: int,
+        embedding: list[float] | np.ndarray,
+        chunks: list[dict[str, Any]],
+    ) -> None:
+        vector = self._normalize(embedding)
+        keys = self._bucket_keys(vector)
+        with self._lock:
+            namespace = self._namespaces.setdefault((course_id, topic_id), _CacheNamespace(len(keys)))
+            entry_id = self._next_id
+            self._next_id += 1
+
+            quantized = np.clip(np.rint(vector * _INT8_SCALE), -127, 127).astype(np.int8)
+            namespace.entries[entry_id] = (quantized, chunks, time.monotonic() + self._ttl_s)
+            namespace.entry_keys[entry_id] = keys
+            for table, key in zip(namespace.tables, keys):
+                table.setdefault(key, set()).add(entry_id)
+
+            while len(namespace.entries) > self._max_entries:
+                namespace.remove(next(iter(namespace.entries)))
+
+    def invalidate(self, course_id: int, topic_id: int) -> None:
+        with self._lock:
+            self._namespaces.pop((course_id, topic_id), None)
+
+
+_semantic_cache = SemanticCache()
+
+
+def _vector_literal(embedding: list[float]) -> str:
+    return "[" + ",".join(str(x) for x in embedding) + "]"
+
+
+def _search_chunks_many(
+    embeddings: list[list[float]],
+    course_id: int,
+    topic_id: int,
+    k: int,
+) -> list[list[dict[str, Any]]]:
+    """Run one top-k search per embedding against a topic in a single round trip."""
     sql = """
     SELECT
-      c.id AS chunk_id,
-      d.title AS doc_title,
-      c.content,
-      d.source_path,
-      1 - (c.embedding <=> %s::vector) AS similarity
-    FROM chunks c
-    JOIN documents d ON c.document_id = d.id
-    WHERE c.course_id = %s AND c.topic_id = %s
-    ORDER BY c.embedding <=> %s::vector
-    LIMIT %s
+      q.ord,
+      r.chunk_id,
+      r.doc_title,
+      r.content,
+      r.source_path,
+      r.similarity
+    FROM unnest(%s::text[]) WITH ORDINALITY AS q(vec, ord)
+    CROSS JOIN LATERAL (
+      SELECT
+        c.id AS chunk_id,
+        d.title AS doc_title,
+        c.content,
+        d.source_path,
+        1 - (c.embedding <=> q.vec::vector) AS similarity
+      FROM chunks c
+      JOIN documents d ON c.document_id = d.id
+      WHERE c.course_id = %s AND c.topic_id = %s
+      ORDER BY c.embedding <=> q.vec::vector
+      LIMIT %s
+    ) r
+    ORDER BY q.ord, r.similarity DESC
     """
 
+    vector_literals = [_vector_literal(embedding) for embedding in embeddings]
     with get_conn() as conn, conn.cursor() as cur:
-      cur.execute(sql, (vector_literal, course_id, topic_id, vector_literal, k))
+      cur.execute(sql, (vector_literals, course_id, topic_id, k))
       rows = cur.fetchall()
 
-    return [
-        {
-            "chunk_id": row[0],
-            "doc_title": row[1],
-            "content": row[2],
-            "source_path": row[3],
-            "similarity": float(row[4]) if row[4] is not None else 0.0,
-        }
-        for row in rows
-    ]
+    results: list[list[dict[str, Any]]] = [[] for _ in embeddings]
+    for row in rows:
+        results[int(row[0]) - 1].append(
+            {
+                "chunk_id": row[1],
+                "doc_title": row[2],
+                "content": row[3],
+                "source_path": row[4],
+                "similarity": float(row[5]) if row[5] is not None else 0.0,
+            }
+        )
+    return results
+
+
+def retrieve_chunks_batch(requests: list[tuple[str, int, int, int]]) -> list[list[dict[str, Any]]]:
+    """Resolve several ``(query, course_id, topic_id, k)`` retrievals at once.
+
+    Queries are embedded in one API call; cache misses are grouped per topic so
+    each topic is searched in a single statement.
+    """
+    if not requests:
+        return []
+
+    embeddings = embeddings_for([query for query, _, _, _ in requests])
+    results: list[list[dict[str, Any]] | None] = [None] * len(requests)
+    misses: dict[tuple[int, int, int], list[int]] = {}
+
+    for index, ((_, course_id, topic_id, k), embedding) in enumerate(zip(requests, embeddings)):
+        cached = _semantic_cache.get(course_id, topic_id, embedding)
+        if cached is not None:
+            results[index] = cached[:k]
+        else:
+            misses.setdefault((course_id, topic_id, k), []).append(index)
+
+    for (course_id, topic_id, k), indices in misses.items():
+        found = _search_chunks_many([embeddings[i] for i in indices], course_id, topic_id, k)
+        for index, chunks in zip(indices, found):
+            _semantic_cache.put(course_id, topic_id, embeddings[index], chunks)
+            results[index] = chunks
+
+    return [chunks or [] for chunks in results]
+
+
+def retrieve_chunks(query: str, course_id: int, topic_id: int, k: int = 5) -> list[dict[str, Any]]:
+    return retrieve_chunks_batch([(query, course_id, topic_id, k)])[0]
+
+
+@dataclass
+class _PendingRetrieval:
+    query: str
+    course_id: int
+    topic_id: int
+    k: int
+    future: asyncio.Future[list[dict[str, Any]]]
+
+
+class RetrievalScheduler:
+    """Coalesce retrievals from concurrent sessions into batched lookups.
+
+    The first submitted request opens a short window; everything queued by the
+    time it closes is embedded and searched together off the event loop.
+    """
+
+    def __init__(self, window_s: float = RAG_BATCH_WINDOW_MS / 1000) -> None:
+        self._window_s = window_s
+        self._queue: asyncio.Queue[_PendingRetrieval] | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _ensure_consumer(self) -> asyncio.Queue[_PendingRetrieval]:
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop or self._task is None or self._task.done():
+            if self._loop is not loop:
+                self._queue = asyncio.Queue()
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+        assert self._queue is not None
+        return self._queue
+
+    async def submit(self, query: str, course_id: int, topic_id: int, k: int = 5) -> list[dict[str, Any]]:
+        queue = self._ensure_consumer()
+        future: asyncio.Future[list[dict[str, Any]]] = asyncio.get_running_loop().create_future()
+        queue.put_nowait(_PendingRetrieval(query, course_id, topic_id, k, future))
+        return await future
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            if self._window_s > 0:
+                await asyncio.sleep(self._window_s)
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+
+            pending = [item for item in batch if not item.future.done()]
+            if not pending:
+                continue
+
+            # Group by topic so each topic's rows are searched back to back.
+            pending.sort(key=lambda item: (item.course_id, item.topic_id))
+            try:
+                results = await asyncio.to_thread(
+                    retrieve_chunks_batch,
+                    [(item.query, item.course_id, item.topic_id, item.k) for item in pending],
+                )
+            except Exception as exc:
+                for item in pending:
+                    if not item.future.done():
+                        item.future.set_exception(exc)
+                continue
+
+            for item, chunks in zip(pending, results):
+                if not item.future.done():
+                    item.future.set_result(chunks)
+
+
+retrieval_scheduler = RetrievalScheduler()
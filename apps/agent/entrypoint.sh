@@ -18,4 +18,6 @@ done
 
 python scripts/bootstrap_db.py
 python scripts/ingest.py || true
-exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+# run_agent_session tasks share the server loop, so pin uvloop (and the C httptools parser)
+# rather than relying on --loop/--http auto.
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools
@@ -186,6 +186,31 @@ SCHEMA_SQL = [
       updated_at timestamptz NOT NULL DEFAULT NOW()
     )
     """,
+    # Quota checks and credit consumption filter on these columns on every session start/end.
+    "CREATE INDEX IF NOT EXISTS usage_credits_profile_created_idx ON usage_credits (profile_id, created_at) WHERE minutes_remaining > 0",
+    # Also serves the parent/guardian daily/weekly limit sums.
+    "CREATE INDEX IF NOT EXISTS sessions_student_started_idx ON sessions (student_id, started_at) INCLUDE (duration_seconds)",
+    """
+    CREATE INDEX IF NOT EXISTS subscriptions_profile_active_idx
+    ON subscriptions (profile_id, updated_at DESC)
+    WHERE status IN ('active', 'trialing', 'past_due')
+    """,
+    # Stripe event ids already handled by /billing/webhook, so redeliveries are no-ops.
+    # Events are acked on receipt and applied by a background worker, which sets processed_at.
+    """
+    CREATE TABLE IF NOT EXISTS processed_webhook_events (
+      event_id text PRIMARY KEY,
+      event_type text NOT NULL,
+      received_at timestamptz NOT NULL DEFAULT NOW(),
+      payload jsonb,
+      processed_at timestamptz
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS processed_webhook_events_pending_idx
+    ON processed_webhook_events (received_at)
+    WHERE processed_at IS NULL
+    """,
     """
     CREATE TABLE IF NOT EXISTS referrals (
       id serial PRIMARY KEY,
@@ -342,6 +367,23 @@ SCHEMA_SQL = [
       transcript_text text NOT NULL DEFAULT ''
     )
     """,
+    # Wakes summary jobs waiting on LISTEN transcript_ready once a transcript has text.
+    """
+    CREATE OR REPLACE FUNCTION notify_transcript_ready() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+      IF NEW.transcript_text <> '' THEN
+        PERFORM pg_notify('transcript_ready', NEW.session_id::text);
+      END IF;
+      RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE OR REPLACE TRIGGER session_transcripts_ready_notify
+    AFTER INSERT OR UPDATE OF transcript_text ON session_transcripts
+    FOR EACH ROW EXECUTE FUNCTION notify_transcript_ready()
+    """,
     """
     CREATE TABLE IF NOT EXISTS session_summaries (
       id serial PRIMARY KEY,
@@ -372,6 +414,9 @@ SCHEMA_SQL = [
       embedding vector(1536) NOT NULL
     )
     """,
+    # Retrieval always filters by course and topic, so an exact scan over one
+    # topic's rows beats a global ANN index, which would post-filter and lose hits.
+    "CREATE INDEX IF NOT EXISTS chunks_course_topic_idx ON chunks (course_id, topic_id)",
     # Calendar integration tables
     """
     CREATE TABLE IF NOT EXISTS calendar_integrations (
@@ -0,0 +1,38 @@
+"""Tests for input validation and code generation helpers."""
+
+from __future__ import annotations
+
+import pytest
+from fastapi import HTTPException
+
+from app.main import EMAIL_MAX_LENGTH, _INVITE_CODE_ALPHABET, _generate_code, _validate_waitlist_email
+
+
+class TestValidateWaitlistEmail:
+    def test_normalizes_valid_address(self) -> None:
+        assert _validate_waitlist_email("  Student@Example.CO.uk ") == "student@example.co.uk"
+
+    @pytest.mark.parametrize(
+        "email",
+        ["", "no-at-sign", "a@b", "a@.com", "a@com.", "a@@b.com", "a b@c.com", "a@b c.com"],
+    )
+    def test_rejects_invalid(self, email: str) -> None:
+        with pytest.raises(HTTPException):
+            _validate_waitlist_email(email)
+
+    def test_rejects_overlong_and_hostile_input(self) -> None:
+        with pytest.raises(HTTPException):
+            _validate_waitlist_email("a" * EMAIL_MAX_LENGTH + "@b.com")
+        with pytest.raises(HTTPException):
+            _validate_waitlist_email("a@" + "." * 10_000)
+
+
+class TestGenerateCode:
+    def test_uses_only_unambiguous_alphabet(self) -> None:
+        allowed = set(_INVITE_CODE_ALPHABET.decode("ascii"))
+        codes = [_generate_code() for _ in range(500)]
+        assert all(len(code) == 6 and set(code) <= allowed for code in codes)
+        assert not allowed & set("01IO")
+        # 32 symbols, so masking a random byte with 0x1F stays uniform.
+        assert len(allowed) == 32
+        assert len(set(codes)) > 490
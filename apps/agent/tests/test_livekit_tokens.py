@@ -0,0 +1,59 @@
+"""Tests for the hand-signed LiveKit access tokens."""
+
+from __future__ import annotations
+
+import base64
+import os
+from typing import Any
+
+import orjson
+from livekit.api import AccessToken, TokenVerifier, VideoGrants
+
+from app import main
+
+
+def _payload(token: str) -> dict[str, Any]:
+    segment = token.split(".")[1]
+    return orjson.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+
+
+def _sdk_token(identity: str, grants: VideoGrants) -> str:
+    token = AccessToken(api_key=os.environ["LIVEKIT_API_KEY"], api_secret=os.environ["LIVEKIT_API_SECRET"])
+    return token.with_identity(identity).with_name(identity).with_grants(grants).to_jwt()
+
+
+def _without_times(claims: dict[str, Any]) -> dict[str, Any]:
+    assert claims.pop("exp") - claims.pop("nbf") == 6 * 60 * 60
+    return claims
+
+
+class TestLivekitTokens:
+    def test_participant_token_matches_sdk_claims(self) -> None:
+        ours = main._build_participant_token("room-1", "student-1")
+        sdk = _sdk_token(
+            "student-1",
+            VideoGrants(room_join=True, room="room-1", can_publish=True, can_subscribe=True, can_publish_data=True),
+        )
+        assert _without_times(_payload(ours)) == _without_times(_payload(sdk))
+
+    def test_agent_token_matches_sdk_claims(self) -> None:
+        ours = main.build_agent_token("room-1")
+        sdk = _sdk_token(
+            "TutorBot",
+            VideoGrants(
+                room_join=True,
+                room="room-1",
+                can_publish=True,
+                can_subscribe=True,
+                can_publish_data=True,
+                can_update_own_metadata=True,
+            ),
+        )
+        assert _without_times(_payload(ours)) == _without_times(_payload(sdk))
+
+    def test_signature_verifies(self) -> None:
+        verifier = TokenVerifier(api_key=os.environ["LIVEKIT_API_KEY"], api_secret=os.environ["LIVEKIT_API_SECRET"])
+        claims = verifier.verify(main._build_participant_token("room-1", "student-1"))
+        assert claims.identity == "student-1"
+        assert claims.name == "student-1"
+        assert claims.video is not None and claims.video.room == "room-1"
@@ -0,0 +1,67 @@
+"""Tests for the throttled Stripe price-id sync behind /plans and checkout."""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import pytest
+
+from app import billing
+
+
+class _FakeCursor:
+    rowcount = 0
+
+    def execute(self, *_args: Any) -> None:
+        pass
+
+    def __enter__(self) -> _FakeCursor:
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        pass
+
+
+class _FakeConn:
+    def cursor(self) -> _FakeCursor:
+        return _FakeCursor()
+
+    def commit(self) -> None:
+        pass
+
+
+@contextmanager
+def _fake_get_conn() -> Iterator[_FakeConn]:
+    yield _FakeConn()
+
+
+@pytest.fixture(autouse=True)
+def _one_plan(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(billing, "STRIPE_SECRET_KEY", "sk_test_fake")
+    monkeypatch.setattr(billing, "PLAN_PRODUCT_IDS", {"Standard Monthly": "prod_1"})
+    monkeypatch.setattr(billing, "get_conn", _fake_get_conn)
+    monkeypatch.setattr(billing, "_plan_price_synced_at", None)
+
+
+class TestSyncPlanPriceIds:
+    def test_stripe_failure_does_not_mark_sync_fresh(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        def _fail(**_kwargs: Any) -> Any:
+            raise RuntimeError("stripe unavailable")
+
+        monkeypatch.setattr(billing.stripe.Price, "list", _fail)
+        billing._sync_plan_price_ids_from_env()
+        assert billing._plan_price_synced_at is None
+
+    def test_success_marks_sync_fresh(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        calls: list[str] = []
+
+        def _list(**kwargs: Any) -> dict[str, Any]:
+            calls.append(kwargs["product"])
+            return {"data": [{"id": "price_1", "created": 1, "recurring": {"interval": "month"}}]}
+
+        monkeypatch.setattr(billing.stripe.Price, "list", _list)
+        billing._sync_plan_price_ids_from_env()
+        billing._sync_plan_price_ids_from_env()
+        assert billing._plan_price_synced_at is not None
+        assert calls == ["prod_1"]
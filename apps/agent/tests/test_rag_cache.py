@@ -0,0 +1,81 @@
+"""Tests for the semantic retrieval cache in front of retrieve_chunks."""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from app import rag
+from app.rag import SemanticCache
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    return vector / np.linalg.norm(vector)
+
+
+class TestSemanticCache:
+    def _cache(self, **kwargs: float) -> SemanticCache:
+        return SemanticCache(dim=32, num_tables=4, num_bits=8, **kwargs)
+
+    def test_exact_repeat_hits(self) -> None:
+        cache = self._cache()
+        embedding = _unit(np.random.default_rng(1).standard_normal(32))
+        chunks = [{"chunk_id": 1, "content": "x"}]
+        cache.put(1, 2, embedding, chunks)
+        assert cache.get(1, 2, embedding) == chunks
+
+    def test_near_duplicate_hits_and_unrelated_misses(self) -> None:
+        cache = self._cache()
+        rng = np.random.default_rng(2)
+        embedding = _unit(rng.standard_normal(32))
+        cache.put(1, 2, embedding, [{"chunk_id": 1}])
+
+        near = _unit(embedding + 0.01 * rng.standard_normal(32))
+        assert cache.get(1, 2, near) == [{"chunk_id": 1}]
+        assert cache.get(1, 2, -embedding) is None
+
+    def test_namespaces_are_scoped_by_course_and_topic(self) -> None:
+        cache = self._cache()
+        embedding = _unit(np.random.default_rng(3).standard_normal(32))
+        cache.put(1, 2, embedding, [{"chunk_id": 1}])
+        assert cache.get(1, 3, embedding) is None
+
+        cache.invalidate(1, 2)
+        assert cache.get(1, 2, embedding) is None
+
+    def test_lru_eviction(self) -> None:
+        cache = self._cache(max_entries=2)
+        rng = np.random.default_rng(4)
+        first, second, third = (_unit(rng.standard_normal(32)) for _ in range(3))
+        cache.put(1, 1, first, [{"chunk_id": 1}])
+        cache.put(1, 1, second, [{"chunk_id": 2}])
+        assert cache.get(1, 1, first) is not None  # refresh first
+        cache.put(1, 1, third, [{"chunk_id": 3}])
+
+        assert cache.get(1, 1, second) is None
+        assert cache.get(1, 1, first) == [{"chunk_id": 1}]
+        assert cache.get(1, 1, third) == [{"chunk_id": 3}]
+
+    def test_expired_entries_miss_and_are_dropped(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        clock = [1000.0]
+        monkeypatch.setattr(rag.time, "monotonic", lambda: clock[0])
+        cache = self._cache(ttl_s=60)
+        embedding = _unit(np.random.default_rng(5).standard_normal(32))
+        cache.put(1, 2, embedding, [{"chunk_id": 1}])
+
+        clock[0] += 59
+        assert cache.get(1, 2, embedding) == [{"chunk_id": 1}]
+
+        clock[0] += 2
+        assert cache.get(1, 2, embedding) is None
+        namespace = cache._namespaces[(1, 2)]
+        assert not namespace.entries
+        assert not any(namespace.tables)
+
+    def test_invalidate_then_put_serves_fresh_results(self) -> None:
+        cache = self._cache()
+        embedding = _unit(np.random.default_rng(6).standard_normal(32))
+        cache.put(1, 2, embedding, [{"chunk_id": 1}])
+        cache.invalidate(1, 2)
+        cache.put(1, 2, embedding, [{"chunk_id": 2}])
+        assert cache.get(1, 2, embedding) == [{"chunk_id": 2}]
@@ -0,0 +1,61 @@
+"""Tests for the pure helpers used when starting a tutoring session."""
+
+from __future__ import annotations
+
+import datetime
+import time
+import uuid
+
+from app.main import _is_now_blocked, _minute_of_day, _uuid7
+
+
+class TestMinuteOfDay:
+    def test_parses_hh_mm(self) -> None:
+        assert _minute_of_day("09:30") == 570
+        assert _minute_of_day("23:59") == 1439
+
+    def test_missing_defaults_to_midnight_and_garbage_is_none(self) -> None:
+        assert _minute_of_day(None) == 0
+        assert _minute_of_day("9") == 540
+        assert _minute_of_day("nine:thirty") is None
+
+
+class TestIsNowBlocked:
+    # 2026-10-18 is a Sunday (dayOfWeek 0); 2026-10-19 is a Monday (dayOfWeek 1).
+    SUNDAY = datetime.datetime(2026, 10, 18, 18, 15)
+    MONDAY = datetime.datetime(2026, 10, 19, 8, 0)
+
+    def test_blocks_inside_window_inclusive(self) -> None:
+        blocked = [{"dayOfWeek": 1, "startTime": "07:30", "endTime": "08:00"}]
+        assert _is_now_blocked(blocked, self.MONDAY)
+        assert not _is_now_blocked(blocked, self.MONDAY.replace(minute=1))
+
+    def test_sunday_is_day_zero(self) -> None:
+        assert _is_now_blocked([{"dayOfWeek": 0, "startTime": "18:00", "endTime": "19:00"}], self.SUNDAY)
+        assert not _is_now_blocked([{"dayOfWeek": 1, "startTime": "18:00", "endTime": "19:00"}], self.SUNDAY)
+
+    def test_compares_minutes_not_strings(self) -> None:
+        # "9:00" sorts after "18:15" as text but is earlier in the day.
+        assert _is_now_blocked([{"dayOfWeek": 0, "startTime": "9:00", "endTime": "20:00"}], self.SUNDAY)
+
+    def test_ignores_malformed_entries(self) -> None:
+        blocked = [None, {"startTime": "00:00", "endTime": "23:59"}, {"dayOfWeek": 0, "startTime": "x", "endTime": "y"}]
+        assert not _is_now_blocked(blocked, self.SUNDAY)
+        assert not _is_now_blocked({"dayOfWeek": 0}, self.SUNDAY)
+
+
+class TestUuid7:
+    def test_version_variant_and_timestamp(self) -> None:
+        before_ms = time.time_ns() // 1_000_000
+        value = _uuid7()
+        after_ms = time.time_ns() // 1_000_000
+        assert value.version == 7
+        assert value.variant == uuid.RFC_4122
+        assert before_ms <= value.int >> 80 <= after_ms
+
+    def test_ids_sort_by_creation_time(self) -> None:
+        first = _uuid7()
+        time.sleep(0.002)
+        second = _uuid7()
+        assert str(first) < str(second)
+        assert first != _uuid7()
@@ -0,0 +1,49 @@
+"""Tests for in-process retries of Stripe webhook events that failed to apply."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app import billing
+
+
+class TestRetryDelay:
+    def test_doubles_from_base_and_caps(self) -> None:
+        base = billing.STRIPE_EVENT_RETRY_BASE_S
+        assert billing._stripe_event_retry_delay_s(1) == base
+        assert billing._stripe_event_retry_delay_s(2) == base * 2
+        assert billing._stripe_event_retry_delay_s(50) == billing._STRIPE_EVENT_RETRY_MAX_S
+
+
+@pytest.mark.asyncio
+class TestOnStripeEventDone:
+    async def _done(self, exc: BaseException | None) -> asyncio.Future[None]:
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        if exc is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exc)
+        return future
+
+    async def test_failure_schedules_retry(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(billing, "STRIPE_EVENT_RETRY_BASE_S", 0.0)
+        scheduled: list[tuple[str, int]] = []
+        monkeypatch.setattr(billing, "_schedule_stripe_event", lambda event_id, attempt: scheduled.append((event_id, attempt)))
+
+        billing._on_stripe_event_done("evt_1", 1, await self._done(RuntimeError("stripe down")))
+        await asyncio.sleep(0.01)
+        assert scheduled == [("evt_1", 2)]
+
+    async def test_success_and_last_attempt_do_not_retry(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(billing, "STRIPE_EVENT_RETRY_BASE_S", 0.0)
+        scheduled: list[tuple[str, int]] = []
+        monkeypatch.setattr(billing, "_schedule_stripe_event", lambda event_id, attempt: scheduled.append((event_id, attempt)))
+
+        billing._on_stripe_event_done("evt_1", 1, await self._done(None))
+        billing._on_stripe_event_done(
+            "evt_2", billing._STRIPE_EVENT_MAX_ATTEMPTS, await self._done(RuntimeError("still down"))
+        )
+        await asyncio.sleep(0.01)
+        assert scheduled == []
@@ -0,0 +1,77 @@
+"""Tests for the per-student tutor persona/config list cache."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import pytest
+from httpx import AsyncClient
+
+from app import main
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache() -> None:
+    main._tutor_list_cache.clear()
+
+
+class _CountingLoader:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, student_id: str) -> list[dict[str, Any]]:
+        self.calls += 1
+        return [{"studentId": student_id, "call": self.calls}]
+
+
+@pytest.mark.asyncio
+class TestCachedTutorList:
+    async def test_repeat_reads_hit_cache(self) -> None:
+        loader = _CountingLoader()
+        first = await main._cached_tutor_list("config", "s1", loader)
+        second = await main._cached_tutor_list("config", "s1", loader)
+        assert first == second
+        assert loader.calls == 1
+
+    async def test_invalidate_drops_both_lists_for_student_only(self) -> None:
+        loader = _CountingLoader()
+        for kind in ("personas", "config"):
+            await main._cached_tutor_list(kind, "s1", loader)
+        await main._cached_tutor_list("config", "s2", loader)
+
+        main._invalidate_tutor_lists("s1")
+        assert set(main._tutor_list_cache) == {("config", "s2")}
+
+    async def test_expired_entry_reloads(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(main, "TUTOR_LIST_CACHE_TTL_S", 0.0)
+        loader = _CountingLoader()
+        await main._cached_tutor_list("personas", "s1", loader)
+        await main._cached_tutor_list("personas", "s1", loader)
+        assert loader.calls == 2
+
+
+@pytest.mark.asyncio
+class TestEnrolmentChangesInvalidate:
+    @pytest.fixture(autouse=True)
+    def _no_db(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        async def _allow(*_args: Any) -> str:
+            return "s1"
+
+        monkeypatch.setattr(main, "_validate_internal_api_key", _allow)
+        monkeypatch.setattr(main, "_student_enrolment_upsert_sync", lambda payload: None)
+        monkeypatch.setattr(main, "_student_enrolment_delete_sync", lambda payload: None)
+
+    async def test_create_invalidates(self, client: AsyncClient) -> None:
+        await main._cached_tutor_list("config", "s1", _CountingLoader())
+        res = await client.post(
+            "/api/student/enrolments",
+            json={"studentId": "s1", "boardSubjectId": 1, "examYear": 2027, "currentYearOfStudy": 1},
+        )
+        assert res.status_code == 200
+        assert ("config", "s1") not in main._tutor_list_cache
+
+    async def test_delete_invalidates(self, client: AsyncClient) -> None:
+        await main._cached_tutor_list("config", "s1", _CountingLoader())
+        res = await client.request("DELETE", "/api/student/enrolments", json={"studentId": "s1", "enrolmentId": 1})
+        assert res.status_code == 200
+        assert ("config", "s1") not in main._tutor_list_cache
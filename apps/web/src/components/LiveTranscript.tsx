@@ -18,9 +18,15 @@ export function LiveTranscript({ room }: { room: Room | undefined }) {
 
     const handler = (payload: Uint8Array) => {
       try {
-        const data = JSON.parse(new TextDecoder().decode(payload)) as TranscriptItem & { topic?: string };
-        if (data && data.text) {
-          setItems((prev) => [...prev, { speaker: data.speaker, text: data.text, timestamp: data.timestamp }]);
+        // The agent batches items as { items: [...] }; a bare item is still accepted.
+        const data = JSON.parse(new TextDecoder().decode(payload)) as
+          | (TranscriptItem & { topic?: string })
+          | { items?: TranscriptItem[] };
+        const incoming = (data && "items" in data ? data.items ?? [] : [data as TranscriptItem])
+          .filter((item) => item && item.text)
+          .map((item) => ({ speaker: item.speaker, text: item.text, timestamp: item.timestamp }));
+        if (incoming.length > 0) {
+          setItems((prev) => [...prev, ...incoming]);
         }
       } catch {
         return;